@@ -31,6 +31,22 @@ class TestCli(ExtTestCase):
         res = str(st)
         self.assertExists(dest)
 
+    def test_cli_parallel(self):
+        st = BufferedPrint()
+        main(args=["read_folder", "--help"], fLOG=st.fprint)
+        res = str(st)
+        self.assertIn("--n_jobs", res)
+        self.assertIn("--backend", res)
+
+        st = BufferedPrint()
+        fold = os.path.dirname(dummy_ct1())
+        temp = get_temp_folder(__file__, "temp_cli_parallel")
+        dest = os.path.join(temp, "example.csv")
+        main(args=["read_folder", "-f", fold, '-r', 'ct1',
+                   '--out', dest, '--n_jobs', '2', '--backend', 'thread'],
+             fLOG=st.fprint)
+        self.assertExists(dest)
+
 
 if __name__ == "__main__":
     unittest.main()
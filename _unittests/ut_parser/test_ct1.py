@@ -2,11 +2,20 @@
 @brief      test log(time=13s)
 """
 import datetime
+import io
+import json
 import os
 import pprint
+import shutil
 import unittest
-from pyquickhelper.pycode import ExtTestCase
-from manydataapi.parsers.ct1 import dummy_ct1, read_ct1
+from unittest import mock
+import numpy
+import pandas
+from pyquickhelper.pycode import ExtTestCase, get_temp_folder
+from manydataapi.parsers import ct1, folders
+from manydataapi.parsers.ct1 import (
+    dummy_ct1, read_ct1, iter_ct1, iter_ct1_bytes, _ct1_chunks,
+    CT1_SCHEMA, ct1_unknown_column, _ct1_baskets)
 from manydataapi.parsers.folders import read_folder
 
 
@@ -157,6 +166,285 @@ class TestCt1(ExtTestCase):
             res.T.to_excel("temp_test.xlsx")
         self.assertEqual(res.shape, (22, 43))
 
+    def test_ct1_df_columns(self):
+        dummy = dummy_ct1()
+        rows = []
+        for record in iter_ct1(dummy):
+            data = record.pop('data')
+            del record['tva']
+            for d in data:
+                d.update(record)
+                rows.append(d)
+        exp = pandas.DataFrame(rows)
+        res = read_ct1(dummy, as_df=True)
+        self.assertEqual(list(exp.columns), list(res.columns))
+        self.assertEqual(list(exp.dtypes), list(res.dtypes))
+        self.assertEqualDataFrame(exp, res)
+
+    def test_iter_ct1(self):
+        dummy = dummy_ct1()
+        res = read_ct1(dummy, as_df=False)
+        it = iter_ct1(dummy)
+        self.assertEqual(TestCt1.exp, next(it))
+        self.assertEqual(res, [TestCt1.exp] + list(it))
+        with open(dummy, "r", encoding="ascii") as f:
+            res2 = list(iter_ct1(f))
+        self.assertEqual(res, res2)
+        with open(dummy, "rb") as f:
+            res2 = list(iter_ct1(f))
+        self.assertEqual(res, res2)
+
+    def test_ct1_engines(self):
+        dummy = dummy_ct1()
+        with open(dummy, "rb") as f:
+            content = f.read()
+        baskets = [b"\x02" + b for b in content.split(b"\x02")[1:]]
+        # the fourth basket has a manual total
+        mixed = b"".join(baskets[i % 5] for i in [0, 3, 3, 1, 2, 4, 3, 0] * 5)
+        temp = get_temp_folder(__file__, "temp_ct1_engines")
+        name = os.path.join(temp, "mixed.map")
+        with open(name, "wb") as f:
+            f.write(mixed)
+
+        for data in [dummy, name]:
+            with self.subTest(data=data):
+                exp = read_ct1(data, engine='text')
+                got = read_ct1(data)
+                self.assertEqual(list(exp.columns), list(got.columns))
+                self.assertEqual(list(exp.dtypes), list(got.dtypes))
+                self.assertEqualDataFrame(exp, got)
+                exp = read_ct1(data, engine='text', as_df=False)
+                self.assertEqual(exp, read_ct1(data, as_df=False))
+                with open(data, "rb") as f:
+                    self.assertEqual(exp, list(iter_ct1_bytes(f.read())))
+                with open(data, "rb") as f:
+                    self.assertEqual(exp, read_ct1(f, as_df=False))
+
+        text = mixed.decode("ascii")
+        self.assertEqualDataFrame(read_ct1(text, engine='text'), read_ct1(text))
+        self.assertEqualDataFrame(read_ct1(name), read_ct1(io.BytesIO(mixed)))
+        self.assertEqualDataFrame(read_ct1(name), read_ct1(mixed))
+
+        # no total, both engines raise the same exception
+        lines = baskets[1].split(b"\r\n")
+        wrong = mixed + b"\r\n".join(line for line in lines
+                                      if not line.startswith(b"F"))
+        errors = []
+        for engine in ['text', 'bytes']:
+            with self.assertRaises(ValueError) as e:
+                read_ct1(wrong.decode('ascii'), engine=engine)
+            errors.append(str(e.exception))
+        self.assertEqual(errors[0], errors[1])
+        self.assertRaise(lambda: read_ct1(dummy, engine='any'), ValueError)
+
+    def test_ct1_chunks(self):
+        dummy = dummy_ct1()
+        with open(dummy, "rb") as f:
+            content = f.read()
+        baskets = [b"\x02" + b for b in content.split(b"\x02")[1:]]
+        mixed = b"".join(baskets[i % 5] for i in [0, 3, 3, 1, 2, 4, 3, 0] * 5)
+        lines = baskets[1].split(b"\r\n")
+        wrong = b"".join([mixed, b"\r\n".join(line for line in lines
+                                              if not line.startswith(b"F")),
+                          mixed])
+        temp = get_temp_folder(__file__, "temp_ct1_chunks")
+        names = {}
+        for key, data in [('crlf', mixed), ('lf', mixed.replace(b"\r\n", b"\n")),
+                          ('cr', mixed.replace(b"\r\n", b"\r")), ('wrong', wrong)]:
+            names[key] = os.path.join(temp, key + ".map")
+            with open(names[key], "wb") as f:
+                f.write(data)
+
+        for key in ['crlf', 'lf', 'cr']:
+            exp = read_ct1(names[key])
+            exp_rec = read_ct1(names[key], as_df=False)
+            for n_jobs, chunk_size in [(1, 1), (2, 1), (3, 2000), (-1, None)]:
+                with self.subTest(key=key, n_jobs=n_jobs, chunk_size=chunk_size):
+                    got = read_ct1(names[key], n_jobs=n_jobs, chunk_size=chunk_size)
+                    self.assertEqual(list(exp.columns), list(got.columns))
+                    self.assertEqual(list(exp.dtypes), list(got.dtypes))
+                    self.assertEqualDataFrame(exp, got)
+                    self.assertEqual(exp_rec, read_ct1(
+                        names[key], as_df=False, n_jobs=n_jobs, chunk_size=chunk_size))
+
+        # a chunk ends after a complete basket
+        self.assertEqual(len(_ct1_chunks(mixed, 1)), 40)
+        for begin, end in _ct1_chunks(mixed, 1):
+            self.assertEqual(mixed[begin:begin + 1], b"\x02")
+            self.assertTrue(mixed[:end].endswith(b"\x05\r\n"))
+
+        with self.assertRaises(ValueError) as e:
+            read_ct1(names['wrong'])
+        for n_jobs in [1, 2]:
+            with self.assertRaises(ValueError) as e2:
+                read_ct1(names['wrong'], n_jobs=n_jobs, chunk_size=1)
+            self.assertEqual(str(e.exception), str(e2.exception))
+
+    def test_ct1_streaming(self):
+        with open(dummy_ct1(), "rb") as f:
+            content = f.read()
+        baskets = [b"\x02" + b for b in content.split(b"\x02")[1:]]
+        lines = baskets[1].split(b"\r\n")
+        wrong = b"\r\n".join(line for line in lines if not line.startswith(b"F"))
+        mixed = b"".join(baskets[i % 5] for i in [0, 3, 3, 1, 2, 4, 3, 0] * 20)
+        temp = get_temp_folder(__file__, "temp_ct1_streaming")
+        names = []
+        for key, data in [('crlf', mixed), ('cr', mixed.replace(b"\r\n", b"\r")),
+                          ('wrong', mixed + wrong + mixed)]:
+            names.append(os.path.join(temp, key + ".map"))
+            with open(names[-1], "wb") as f:
+                f.write(data)
+        n_lines = mixed.count(b"\r\n")
+        basket_lines = max(b.count(b"\r\n") for b in baskets)
+        exp = read_ct1(names[0], engine='text')
+
+        # counts the lines held at the same time
+        held = []
+        columns_lines = ct1._ct1_columns_lines
+
+        def count_lines(lines, **kwargs):
+            held.append(len(lines))
+            return columns_lines(lines, **kwargs)
+
+        with mock.patch.object(ct1, '_ct1_block_size', 2048):
+            with mock.patch.object(ct1, '_ct1_columns_lines', count_lines):
+                for name in names[:2]:
+                    del held[:]
+                    got = read_ct1(name)
+                    self.assertEqualDataFrame(exp, got)
+                    self.assertEqual(sum(held), n_lines)
+                    self.assertLess(max(held), 2048 // 10 + basket_lines)
+                    self.assertLess(max(held), n_lines // 10)
+
+                # a binary stream is also read by blocks
+                del held[:]
+                with open(names[0], "rb") as f:
+                    self.assertEqualDataFrame(exp, read_ct1(f))
+                self.assertEqual(sum(held), n_lines)
+                self.assertLess(max(held), 2048 // 10 + basket_lines)
+
+                got, rejects = read_ct1(names[2], errors='collect')
+                self.assertEqualDataFrame(pandas.concat([exp, exp], ignore_index=True), got)
+                self.assertEqual([(r['first_line'], r['last_line']) for r in rejects],
+                                 [(n_lines + 1, n_lines + len(lines) - 2)])
+                self.assertRaise(lambda: read_ct1(names[2]), ValueError)
+
+    def test_ct1_typed(self):
+        dummy = dummy_ct1()
+        exp = read_ct1(dummy)
+        got = read_ct1(dummy, typed=True)
+        self.assertEqual(list(exp.columns), list(got.columns))
+        for k in exp.columns:
+            dtype = CT1_SCHEMA.get(k, 'category' if ct1_unknown_column(k) else None)
+            self.assertEqual(str(got[k].dtype), dtype)
+            if dtype == 'category':
+                self.assertEqual(exp[k].astype(object).fillna('?').tolist(),
+                                 got[k].astype(object).fillna('?').tolist())
+            elif dtype == 'float32':
+                self.assertEqualArray(exp[k].to_numpy(dtype=numpy.float32),
+                                      got[k].to_numpy())
+            else:
+                self.assertEqual(exp[k].tolist(), got[k].tolist())
+        self.assertLess(got.memory_usage(deep=True).sum(),
+                        exp.memory_usage(deep=True).sum() / 4)
+        self.assertEqualDataFrame(got, read_ct1(dummy, typed=True, engine='text'))
+        self.assertEqualDataFrame(got, read_ct1(dummy, typed=True, n_jobs=2, chunk_size=1))
+        temp = get_temp_folder(__file__, "temp_ct1_typed")
+        self.assertEqualDataFrame(got, read_ct1(
+            dummy, typed=True, baskets=list(exp['BASKET'].unique()),
+            index=os.path.join(temp, "dummy.idx")))
+
+        got = read_ct1(dummy, typed=True, drop_unknown=True)
+        self.assertEqual(got.shape, (22, 26))
+        self.assertNotIn('IT1', got.columns)
+        self.assertNotIn('INFO0', got.columns)
+        self.assertNotIn('INFOL2_1', got.columns)
+        self.assertIn('ITCODE', got.columns)
+        self.assertEqual(read_ct1(dummy, drop_unknown=True).shape, (22, 26))
+        self.assertEqualDataFrame(got, read_ct1(dummy, typed=True, drop_unknown=True,
+                                                engine='text'))
+
+        # unknown fields are never stored
+        with open(dummy, "rb") as f:
+            lines = f.read().splitlines()
+        store = ct1._ct1_columns_bytes(lines, drop_unknown=True)
+        self.assertEqual([k for k in store.order if ct1_unknown_column(k)], [])
+        records = read_ct1(dummy, as_df=False, drop_unknown=True)
+        self.assertEqual(len(records), 5)
+        for rec in records:
+            self.assertEqual([k for k in rec if ct1_unknown_column(k)], [])
+            for item in rec['data']:
+                self.assertEqual([k for k in item if ct1_unknown_column(k)], [])
+        self.assertEqual(records, list(iter_ct1(dummy, drop_unknown=True)))
+
+    def test_ct1_typed_blocks(self):
+        with open(dummy_ct1(), "rb") as f:
+            content = f.read()
+        baskets = [b"\x02" + b for b in content.split(b"\x02")[1:]]
+        mixed = b"".join(baskets[i % 5] for i in [0, 3, 3, 1, 2, 4, 3, 0] * 20)
+        temp = get_temp_folder(__file__, "temp_ct1_typed_blocks")
+        name = os.path.join(temp, "mixed.map")
+        with open(name, "wb") as f:
+            f.write(mixed)
+        exp = read_ct1(name, typed=True)
+
+        # counts the items converted at the same time
+        converted = []
+        to_dataframe = ct1._CT1Columns.to_dataframe
+
+        def count_items(store, typed=False):
+            converted.append(store.n_items)
+            return to_dataframe(store, typed=typed)
+
+        with mock.patch.object(ct1, '_ct1_block_size', 2048):
+            with mock.patch.object(ct1, '_ct1_frame_items', 8):
+                with mock.patch.object(ct1._CT1Columns, 'to_dataframe', count_items):
+                    for kwargs in [{}, dict(engine='text'), dict(drop_unknown=True)]:
+                        del converted[:]
+                        got = read_ct1(name, typed=True, **kwargs)
+                        if kwargs.get('drop_unknown', False):
+                            self.assertEqualDataFrame(
+                                exp[[c for c in exp.columns
+                                     if not ct1_unknown_column(c)]], got)
+                        else:
+                            self.assertEqualDataFrame(exp, got)
+                        self.assertGreater(len(converted), 10)
+                        self.assertLess(max(converted), exp.shape[0] // 10)
+                self.assertEqualDataFrame(
+                    exp, read_ct1(name, typed=True, n_jobs=2, chunk_size=1))
+                self.assertEqualDataFrame(exp, read_ct1(
+                    name, typed=True, baskets=list(exp['BASKET'].unique()),
+                    index=os.path.join(temp, "mixed.idx")))
+
+    def test_ct1_folder_typed(self):
+        dummy = dummy_ct1()
+        temp = get_temp_folder(__file__, "temp_ct1_folder_typed")
+        with open(dummy, "rb") as f:
+            content = f.read()
+        baskets = [b"\x02" + b for b in content.split(b"\x02")[1:]]
+        for i in range(3):
+            with open(os.path.join(temp, "f%d.map" % i), "wb") as f:
+                f.write(b"".join(baskets[i:]))
+        exp = read_folder(temp)
+        got = read_folder(temp, typed=True)
+        self.assertEqual(got.shape, exp.shape)
+        for k in ['ITNAME', 'BASKET', 'IT1']:
+            self.assertEqual(got[k].dtype.name, 'category')
+            self.assertEqual(exp[k].astype(object).fillna('?').tolist(),
+                             got[k].astype(object).fillna('?').tolist())
+        got = read_folder(temp, typed=True, drop_unknown=True)
+        self.assertEqual(list(got.columns),
+                         [c for c in exp.columns if not ct1_unknown_column(c)])
+        self.assertEqual(got['ITNAME'].dtype.name, 'category')
+
+    def test_ct1_string(self):
+        dummy = dummy_ct1()
+        with open(dummy, "r", encoding="ascii") as f:
+            content = f.read()
+        res1 = read_ct1(dummy, as_df=False)
+        res2 = read_ct1(content, as_df=False)
+        self.assertEqual(res1, res2)
+
     def test_ct1_folder(self):
         dummy = dummy_ct1()
         fold = os.path.dirname(dummy)
@@ -178,6 +466,254 @@ class TestCt1(ExtTestCase):
         res2 = read_folder(fold, lambda f: read_ct1(f, as_df=True))
         self.assertEqual(res1, res2)
 
+    def test_ct1_folder_parallel(self):
+        dummy = dummy_ct1()
+        temp = get_temp_folder(__file__, "temp_ct1_folder_parallel")
+        for i in range(5):
+            shutil.copy(dummy, os.path.join(temp, "f%d.map" % i))
+        exp = read_folder(temp)
+        self.assertEqual(exp.shape, (110, 43))
+        for backend in ['thread', 'process']:
+            with self.subTest(backend=backend):
+                res = read_folder(temp, n_jobs=2, backend=backend)
+                self.assertEqualDataFrame(exp, res)
+
+        with open(os.path.join(temp, "f2.map"), "a", encoding="ascii") as f:
+            # no total, the basket cannot be checked
+            f.write("\x02HASH2\x1d216\r\n"
+                    "L\x1d800\x1dITEM11\x1d0\x1d0\x1d1\x1d0\x1d  21.00\x1d"
+                    " 0.2501\x1d0\x1d    5.25\r\n\x04HASH1\x05\r\n")
+        for backend in ['serial', 'thread', 'process']:
+            with self.subTest(backend=backend):
+                with self.assertRaises(ValueError) as e:
+                    read_folder(temp, n_jobs=2, backend=backend)
+                self.assertIn("f2.map", str(e.exception))
+        self.assertRaise(lambda: read_folder(temp, backend='any'), ValueError)
+
+    def _wrong_baskets(self):
+        "returns a file with valid baskets and the same file with malformed baskets"
+        with open(dummy_ct1(), "rb") as f:
+            content = f.read()
+        baskets = [b"\x02" + b for b in content.split(b"\x02")[1:]]
+        lines = baskets[0].split(b"\r\n")
+        # no total
+        no_total = b"\r\n".join(line for line in lines if not line.startswith(b"F"))
+        # wrong amount
+        amount = b"\r\n".join(lines[:3] + [lines[3].replace(b"21.00", b"2x.00")] + lines[4:])
+        # no end
+        no_end = b"\r\n".join(line for line in lines if not line.startswith(b"\x04"))
+        good = b"".join(baskets[i] for i in [0, 1, 2, 3, 4])
+        wrong = b"".join([baskets[0], no_total, baskets[1], amount, baskets[2],
+                          b"L\x1d800\x1dITEM11\r\n", baskets[3], no_end, baskets[4]])
+        return good, wrong
+
+    def test_ct1_errors(self):
+        good, wrong = self._wrong_baskets()
+        temp = get_temp_folder(__file__, "temp_ct1_errors")
+        name = os.path.join(temp, "wrong.map")
+        with open(name, "wb") as f:
+            f.write(wrong)
+        exp = read_ct1(good)
+        exp_rec = read_ct1(good, as_df=False)
+        self.assertRaise(lambda: read_ct1(wrong), ValueError)
+        self.assertEqualDataFrame(exp, read_ct1(wrong, errors='skip'))
+
+        res, rejects = read_ct1(wrong, errors='collect')
+        self.assertEqualDataFrame(exp, res)
+        self.assertEqual([(r['first_line'], r['last_line']) for r in rejects],
+                         [(18, 33), (52, 68), (83, 83), (98, 113)])
+        self.assertEqual([type(r['error']) for r in rejects],
+                         [ValueError, ValueError, RuntimeError, RuntimeError])
+        self.assertIn("Unable to process one record line 18-33", str(rejects[0]['error']))
+        self.assertIn("2x.00", str(rejects[1]['error']))
+        lines = wrong.decode('ascii').split('\r\n')
+        for r in rejects:
+            self.assertEqual(r['text'], "\n".join(lines[r['first_line'] - 1:r['last_line']]))
+
+        for kwargs in [dict(), dict(n_jobs=2, chunk_size=1), dict(as_df=False)]:
+            with self.subTest(kwargs=kwargs):
+                got = []
+                res = read_ct1(name, errors='collect', rejects=got, **kwargs)
+                if kwargs.get('as_df', True):
+                    self.assertEqualDataFrame(exp, res)
+                else:
+                    self.assertEqual(exp_rec, res)
+                self.assertEqual(
+                    [(r['first_line'], r['text'], str(r['error'])) for r in rejects],
+                    [(r['first_line'], r['text'], str(r['error'])) for r in got])
+                self.assertEqual({r['file'] for r in got}, {name})
+
+        # the index only contains complete baskets,
+        # a basket with no end is always reported
+        got = []
+        res = read_ct1(name, errors='collect', rejects=got,
+                       baskets=['HASH1', 'HASH2', 'HASH3', 'HASH4'])
+        self.assertEqual(exp['BASKET'].tolist(), res['BASKET'].tolist())
+        self.assertEqual([(r['first_line'], r['last_line']) for r in got],
+                         [(18, 33), (52, 68), (98, 113)])
+        self.assertEqual([(r['text'], str(r['error'])) for r in rejects[3:]],
+                         [(r['text'], str(r['error'])) for r in got[2:]])
+        self.assertRaise(lambda: read_ct1(name, baskets='HASH1'), RuntimeError)
+
+        out = os.path.join(temp, "rejects.json")
+        read_ct1(name, errors='collect', rejects=out)
+        with open(out, "r", encoding="utf-8") as f:
+            saved = [json.loads(line) for line in f]
+        self.assertEqual([(r['first_line'], r['last_line']) for r in saved],
+                         [(18, 33), (52, 68), (83, 83), (98, 113)])
+        self.assertTrue(saved[1]['error'].startswith("ValueError: could not convert"))
+        self.assertRaise(lambda: read_ct1(name, errors='any'), ValueError)
+        self.assertRaise(lambda: read_ct1(name, errors='skip', engine='text'), ValueError)
+
+        # malformed tax rate
+        baskets = [b"\x02" + b for b in good.split(b"\x02")[1:]]
+        rate = baskets[1].replace(b"T\x1d1\x1d    5.50", b"T\x1d1\x1d     abc")
+        self.assertNotEqual(rate, baskets[1])
+        bad_rate = b"".join([baskets[0], rate] + baskets[2:])
+        exp = read_ct1(b"".join([baskets[0]] + baskets[2:]))
+        exp_rec = read_ct1(b"".join([baskets[0]] + baskets[2:]), as_df=False)
+        self.assertRaise(lambda: read_ct1(bad_rate), ValueError)
+        self.assertRaise(lambda: read_ct1(bad_rate, as_df=False), ValueError)
+        self.assertRaise(lambda: read_ct1(bad_rate.decode('ascii'), engine='text'),
+                         ValueError)
+        self.assertEqualDataFrame(exp, read_ct1(bad_rate, errors='skip'))
+        self.assertEqual(exp_rec, read_ct1(bad_rate, errors='skip', as_df=False))
+        for as_df in [True, False]:
+            res, rejects = read_ct1(bad_rate, errors='collect', as_df=as_df)
+            self.assertEqual(len(rejects), 1)
+            self.assertIsInstance(rejects[0]['error'], ValueError)
+            self.assertIn("abc", rejects[0]['text'])
+
+    def test_ct1_baskets(self):
+        good, wrong = self._wrong_baskets()
+        baskets = list(_ct1_baskets([good.split(b"\r\n")]))
+        self.assertEqual(len(baskets), 5)
+        for first, lines, error in baskets:
+            self.assertIsNone(error)
+            self.assertEqual(lines[0][:1], b"\x02")
+            self.assertEqual(lines[-1][:1], b"\x04")
+            self.assertEqual(good.split(b"\r\n")[first], lines[0])
+
+        rejects = []
+        lines = wrong.split(b"\r\n")
+        baskets = list(_ct1_baskets([lines], rejects=rejects))
+        self.assertEqual([(r['first_line'], r['last_line']) for r in rejects], [(83, 83)])
+        self.assertEqual([first + 1 for first, _, error in baskets if error is not None], [98])
+        self.assertRaise(lambda: list(_ct1_baskets([lines])), RuntimeError)
+        # a basket truncated by the end of the lines
+        first, truncated, error = list(_ct1_baskets([lines[:20]]))[-1]
+        self.assertEqual(first, 17)
+        self.assertEqual(truncated, lines[17:20])
+        self.assertIsNone(error)
+
+    def test_ct1_folder_errors(self):
+        good, wrong = self._wrong_baskets()
+        temp = get_temp_folder(__file__, "temp_ct1_folder_errors")
+        for i in range(4):
+            with open(os.path.join(temp, "f%d.map" % i), "wb") as f:
+                f.write(wrong if i == 1 else good)
+        exp = pandas.concat([read_ct1(good)] * 4)
+        for backend in ['serial', 'process']:
+            with self.subTest(backend=backend):
+                self.assertRaise(lambda: read_folder(temp), ValueError)  # pylint: disable=W0640
+                res = read_folder(temp, errors='skip', n_jobs=2, backend=backend)
+                self.assertEqualDataFrame(exp, res)
+                res, rejects = read_folder(temp, errors='collect', n_jobs=2,
+                                           backend=backend)
+                self.assertEqualDataFrame(exp, res)
+                self.assertEqual(len(rejects), 4)
+                self.assertEqual({os.path.split(r['file'])[-1] for r in rejects},
+                                 {"f1.map"})
+
+        # a reader which fails on a file
+        def reader(name):
+            if name.endswith("f2.map"):
+                raise ValueError("unable")
+            if name.endswith("f3.map"):
+                raise TypeError("wrong type")
+            return read_ct1(name, as_df=False, errors='skip')
+
+        rejects = []
+        res = read_folder(temp, reader, errors='collect', rejects=rejects)
+        self.assertEqual(len(res), 10)
+        self.assertEqual(len(rejects), 2)
+        self.assertEqual(str(rejects[0]['error']), "unable")
+        self.assertIsInstance(rejects[1]['error'], TypeError)
+        self.assertIsNone(rejects[0]['first_line'])
+        self.assertRaise(lambda: read_folder(temp, reader), ValueError)
+        res = read_folder(temp, reader, errors='skip', backend='thread', n_jobs=2)
+        self.assertEqual(len(res), 10)
+
+    def test_ct1_folder_cache(self):
+        dummy = dummy_ct1()
+        temp = get_temp_folder(__file__, "temp_ct1_folder_cache")
+        data = os.path.join(temp, "data")
+        cache = os.path.join(temp, "cache")
+        os.makedirs(data)
+        for i in range(3):
+            shutil.copy(dummy, os.path.join(data, "f%d.map" % i))
+        exp = read_folder(data)
+
+        logs = []
+        res = read_folder(data, cache_dir=cache, verbose=True,
+                          fLOG=logs.append)
+        self.assertEqualDataFrame(exp, res)
+        self.assertIn("cache: 0 hits, 3 misses in '%s'." % cache, logs)
+        self.assertEqual(len(os.listdir(cache)), 3)
+
+        logs.clear()
+        res = read_folder(data, cache_dir=cache, verbose=True,
+                          fLOG=logs.append)
+        self.assertEqualDataFrame(exp, res)
+        self.assertIn("cache: 3 hits, 0 misses in '%s'." % cache, logs)
+
+        with open(dummy, "r", encoding="ascii") as f:
+            content = f.read()
+        with open(os.path.join(data, "f1.map"), "w", encoding="ascii") as f:
+            f.write(content.split("\x04")[0] + "\x04HASH1\x05\n")
+        logs.clear()
+        res = read_folder(data, cache_dir=cache, verbose=True,
+                          fLOG=logs.append)
+        self.assertIn("cache: 2 hits, 1 misses in '%s'." % cache, logs)
+        self.assertEqual(res.shape, (49, 43))
+        self.assertEqual(len(os.listdir(cache)), 3)
+        self.assertEqualDataFrame(res, read_folder(data))
+
+        # a failed write keeps the previous entry
+        before = sorted(os.listdir(cache))
+        with open(os.path.join(data, "f1.map"), "a", encoding="ascii") as f:
+            f.write("\n")
+        with mock.patch.object(folders.pickle, 'dump', side_effect=OSError("disk full")):
+            self.assertRaise(lambda: read_folder(data, cache_dir=cache), OSError)
+        self.assertEqual(sorted(os.listdir(cache)), before)
+        res = read_folder(data, cache_dir=cache)
+        self.assertEqual(len(os.listdir(cache)), 3)
+        self.assertNotEqual(sorted(os.listdir(cache)), before)
+
+        # typed and untyped results are kept side by side
+        typed = read_folder(data, cache_dir=cache, typed=True)
+        self.assertEqual(str(typed['BASKET'].dtype), 'category')
+        self.assertEqual(len(os.listdir(cache)), 6)
+        logs.clear()
+        res = read_folder(data, cache_dir=cache, verbose=True,
+                          fLOG=logs.append)
+        self.assertIn("cache: 3 hits, 0 misses in '%s'." % cache, logs)
+        self.assertEqual(str(res['BASKET'].dtype), str(exp['BASKET'].dtype))
+        logs.clear()
+        res = read_folder(data, cache_dir=cache, verbose=True, typed=True,
+                          fLOG=logs.append)
+        self.assertIn("cache: 3 hits, 0 misses in '%s'." % cache, logs)
+        self.assertEqualDataFrame(typed, res)
+
+        # two lambda functions do not share their results
+        first = read_folder(data, lambda name: [1], cache_dir=cache)
+        second = read_folder(data, lambda name: [2], cache_dir=cache)
+        self.assertEqual(first, [1, 1, 1])
+        self.assertEqual(second, [2, 2, 2])
+        values = [read_folder(data, lambda name, v=v: [v], cache_dir=cache)
+                  for v in [3, 4]]
+        self.assertEqual(values, [[3, 3, 3], [4, 4, 4]])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,103 @@
+"""
+@brief      test log(time=2s)
+"""
+import os
+import time
+import unittest
+import numpy
+from pyquickhelper.pycode import ExtTestCase, get_temp_folder
+from manydataapi.parsers.ct1 import dummy_ct1, read_ct1
+from manydataapi.parsers.ct1_index import (
+    build_ct1_index, load_ct1_index, select_ct1_index)
+
+
+class TestCt1Index(ExtTestCase):
+
+    def _mixed(self, name, sep=b"\r\n"):
+        with open(dummy_ct1(), "rb") as f:
+            content = f.read()
+        baskets = [b"\x02" + b for b in content.split(b"\x02")[1:]]
+        mixed = b"".join(baskets[i % 5] for i in [0, 3, 1, 2, 4] * 3)
+        with open(name, "wb") as f:
+            f.write(mixed.replace(b"\r\n", sep))
+        return name
+
+    def test_build_ct1_index(self):
+        temp = get_temp_folder(__file__, "temp_build_ct1_index")
+        for sep in [b"\r\n", b"\n", b"\r"]:
+            with self.subTest(sep=sep):
+                name = self._mixed(os.path.join(temp, "mixed.map"), sep)
+                idx = build_ct1_index(name)
+                self.assertExists(name + ".idx")
+                self.assertEqual(list(idx.columns),
+                                 ['offset', 'size', 'line', 'BASKET', 'DATETIME'])
+                self.assertEqual(idx.shape[0], 15)
+                df = read_ct1(name)
+                exp = df.drop_duplicates('BASKET')[['BASKET', 'DATETIME']]
+                got = idx.drop_duplicates('BASKET')[['BASKET', 'DATETIME']]
+                self.assertEqual(exp['BASKET'].tolist(), got['BASKET'].tolist())
+                self.assertEqual(exp['DATETIME'].tolist(), got['DATETIME'].tolist())
+                with open(name, "rb") as f:
+                    content = f.read()
+                for offset, size in zip(idx['offset'], idx['size']):
+                    self.assertEqual(content[offset:offset + 1], b"\x02")
+                    self.assertEqual(content[offset + size - 1:offset + size], sep[-1:])
+                lines = content.splitlines()
+                for offset, line in zip(idx['offset'], idx['line']):
+                    self.assertEqual(lines[line], content[offset:].splitlines()[0])
+
+    def test_load_ct1_index(self):
+        temp = get_temp_folder(__file__, "temp_load_ct1_index")
+        name = self._mixed(os.path.join(temp, "mixed.map"))
+        index = os.path.join(temp, "mixed.index")
+        idx = load_ct1_index(name, index=index)
+        self.assertExists(index)
+        self.assertNotExists(name + ".idx")
+        self.assertEqualDataFrame(idx, load_ct1_index(name, index=index))
+        self.assertEqual(idx.shape[0], 15)
+        # the file is modified, the index is built again
+        time.sleep(0.01)
+        with open(name, "ab") as f:
+            f.write(b"\x02HASH2\r\n")
+        idx2 = load_ct1_index(name, index=index)
+        self.assertEqualDataFrame(idx, idx2)
+        with numpy.load(index) as data:
+            self.assertEqual(int(data['file_size']), os.stat(name).st_size)
+
+    def test_read_ct1_baskets(self):
+        temp = get_temp_folder(__file__, "temp_read_ct1_baskets")
+        name = self._mixed(os.path.join(temp, "mixed.map"))
+        df = read_ct1(name)
+        records = read_ct1(name, as_df=False)
+
+        for baskets in ['HASH1', ['HASH4', 'HASH1']]:
+            with self.subTest(baskets=baskets):
+                sel = [baskets] if isinstance(baskets, str) else baskets
+                exp = df[df['BASKET'].isin(sel)].reset_index(drop=True)
+                got = read_ct1(name, baskets=baskets)
+                # columns only filled by other baskets are missing
+                self.assertEqual([c for c in exp.columns if c in got.columns],
+                                 list(got.columns))
+                self.assertEqualDataFrame(exp[got.columns], got)
+                got = read_ct1(name, baskets=baskets, as_df=False)
+                self.assertEqual([r for r in records if r['BASKET'] in sel], got)
+
+        dates = sorted(set(df['DATETIME']))
+        start, end = dates[1], dates[3]
+        exp = df[(df['DATETIME'] >= start) & (df['DATETIME'] < end)]
+        got = read_ct1(name, start=start, end=end)
+        self.assertEqualDataFrame(exp.reset_index(drop=True)[got.columns], got)
+        got = read_ct1(name, start=str(start))
+        self.assertEqual(got.shape[0], (df['DATETIME'] >= start).sum())
+        got = read_ct1(name, baskets=['none'])
+        self.assertEqual(got.shape[0], 0)
+
+        idx = load_ct1_index(name)
+        self.assertEqual(select_ct1_index(idx, end=end).shape[0],
+                         (idx['DATETIME'] < end).sum())
+        self.assertRaise(lambda: read_ct1(dummy_ct1().encode('ascii'), baskets='HASH1'),
+                         ValueError)
+
+
+if __name__ == "__main__":
+    unittest.main()
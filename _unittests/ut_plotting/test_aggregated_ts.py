@@ -1,10 +1,15 @@
 """
 @brief      test log(time=3s)
 """
+import os
+import pickle
 import unittest
-from pyquickhelper.pycode import ExtTestCase
+import numpy
+import pandas
+from pyquickhelper.pycode import ExtTestCase, get_temp_folder
 from manydataapi.parsers.ct1 import dummy_ct1, read_ct1
-from manydataapi.plotting import plot_aggregated_ts
+from manydataapi.plotting import (
+    plot_aggregated_ts, aggregate_ts, TimeSeriesRollup)
 
 
 class TestAggregatedTs(ExtTestCase):
@@ -73,6 +78,84 @@ class TestAggregatedTs(ExtTestCase):
         plot_aggregated_ts(df, ax=ax, value='ITPRICE', agg='weekhour')
         plt.close('all')
 
+    def test_aggregate_ts(self):
+        rnd = numpy.random.RandomState(0)
+        n = 5000
+        dates = pandas.Series(
+            numpy.datetime64('2019-12-25') +
+            rnd.randint(0, 800 * 24 * 60, n).astype('timedelta64[m]'))
+        dates[::50] = pandas.NaT
+        df = pandas.DataFrame(dict(date=dates, X=rnd.randn(n),
+                                   N=rnd.randint(0, 10, n)))
+        df.loc[::7, "X"] = numpy.nan
+
+        exp_keys = dict(
+            year=[dates.dt.year],
+            month=[dates.dt.year, dates.dt.month],
+            day=[dates.dt.year, dates.dt.month, dates.dt.day],
+            weekday=[dates.dt.weekday],
+            hour=[dates.dt.hour],
+            weekhour=[dates.dt.weekday, dates.dt.hour])
+        reducers = ['sum', 'mean', 'count', 'min', 'max', 'median', 0.9]
+        for agg, keys in exp_keys.items():
+            with self.subTest(agg=agg):
+                got = aggregate_ts(df, ['X', 'N'], agg=agg, reducer=reducers)
+                keys = [k.rename(name) for k, name in zip(
+                    keys, got.index.names)]
+                gr = df[["X", "N"]].groupby(keys)
+                for col in ["X", "N"]:
+                    g = gr[col]
+                    exp = pandas.DataFrame({
+                        col + "_sum": g.sum(), col + "_mean": g.mean(),
+                        col + "_count": g.count(), col + "_min": g.min(),
+                        col + "_max": g.max(), col + "_median": g.median(),
+                        col + "_q90": g.quantile(0.9)})
+                    exp.index = exp.index.set_names(got.index.names)
+                    cols = [c for c in got.columns if c.startswith(col + "_")]
+                    pandas.testing.assert_frame_equal(
+                        exp, got[cols], check_dtype=False, check_index_type=False)
+
+        got = aggregate_ts(df, 'N', agg='month')
+        self.assertEqual(list(got.columns), ['N'])
+        self.assertEqual(got['N'].dtype, numpy.int64)
+        self.assertEqual(list(got.index.names), ['year', 'month'])
+        self.assertRaise(lambda: aggregate_ts(df, 'N', reducer='any'), ValueError)
+
+    def test_rollup(self):
+        temp = get_temp_folder(__file__, "temp_rollup")
+        rnd = numpy.random.RandomState(0)
+        n = 3000
+        df = pandas.DataFrame(dict(
+            date=numpy.datetime64('2019-12-25') +
+            numpy.sort(rnd.randint(0, 400 * 24 * 60, n)).astype('timedelta64[m]'),
+            X=rnd.randn(n), N=rnd.randint(0, 10, n)))
+        df.loc[::7, "X"] = numpy.nan
+
+        rollup = TimeSeriesRollup(['X', 'N'])
+        for begin in range(0, n, 700):
+            rollup.update(df.iloc[begin: begin + 700])
+        self.assertEqual(rollup.rows, n)
+        self.assertEqual(rollup.date, 'date')
+
+        name = os.path.join(temp, "rollup.pkl")
+        rollup.save(name)
+        restored = TimeSeriesRollup.load(name)
+        restored = pickle.loads(pickle.dumps(restored))
+
+        reducers = ['sum', 'mean', 'count', 'min', 'max']
+        for agg in ['month', 'day', 'hour', 'weekday', 'weekhour']:
+            with self.subTest(agg=agg):
+                exp = aggregate_ts(df, ['X', 'N'], agg=agg, reducer=reducers)
+                got = restored.aggregate(agg=agg, reducer=reducers)
+                pandas.testing.assert_frame_equal(exp, got, check_dtype=False)
+
+        from matplotlib import pyplot as plt
+        _, ax = plt.subplots(1, 1)
+        plot_aggregated_ts(rollup, ax=ax, value='X', agg='weekhour')
+        plt.close('all')
+        self.assertRaise(lambda: rollup.aggregate('X', agg='year'), ValueError)
+        self.assertRaise(lambda: rollup.aggregate('X', reducer=0.5), ValueError)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,203 @@
+"""
+@brief      test log(time=5s)
+"""
+import os
+import gzip
+import hashlib
+import json
+import time
+import threading
+import unittest
+import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from pyquickhelper.pycode import get_temp_folder, ExtTestCase
+from manydataapi.velib import DataCollectJCDecaux, read_jcdecaux_binary
+
+
+def fake_stations(contract, nb=3):
+    "Returns stations in the format of the API."
+    return [{"number": i, "contract_name": contract, "name": "S%d" % i,
+             "address": "street %d" % i, "banking": "True", "bonus": "False",
+             "bike_stands": 10, "available_bike_stands": 10 - i,
+             "available_bikes": i, "status": "OPEN",
+             "last_update": 1368121860000.0,
+             "position": {"lat": 47.2 + i / 100, "lng": 6.0 + i / 100}}
+            for i in range(nb)]
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    "Simulates the JCDecaux API."
+
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    # the data changes when version changes
+    version = 0
+
+    def setup(self):
+        FakeHandler.connections += 1
+        BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        contract = query["contract"][0]
+        if contract == "slow":
+            time.sleep(1)
+        stations = fake_stations(contract)
+        for st in stations:
+            st["available_bikes"] += FakeHandler.version
+        content = json.dumps(stations).encode("utf-8")
+        etag = '"%s"' % hashlib.md5(content).hexdigest()
+        if contract != "noetag" and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            content = gzip.compress(content)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            self.send_header("Content-Encoding", "gzip")
+        if contract != "noetag":
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        pass
+
+
+class TestDataVelibAsync(ExtTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever,
+                                      daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def velib(self):
+        velib = DataCollectJCDecaux("KEY")
+        velib._url_api = ("http://127.0.0.1:%d/vls/v1/stations?contract=%%s&apiKey=%%s" %
+                          self.server.server_address[1])
+        velib.contracts = {k: 1 for k in ["lyon", "nancy", "besancon", "slow",
+                                             "noetag"]}
+        return velib
+
+    def test_get_json(self):
+        js = self.velib().get_json("lyon")
+        self.assertEqual(len(js), 3)
+        self.assertEqual(js[1]["lat"], 47.21)
+        self.assertEqual(js[1]["banking"], 1)
+
+    def test_get_json_timeout(self):
+        velib = self.velib()
+        begin = time.perf_counter()
+        self.assertRaise(lambda: velib.get_json("slow", timeout=0.3), TimeoutError)
+        # the socket stops the request, the server needs one second
+        self.assertLess(time.perf_counter() - begin, 0.9)
+        self.assertEqual(velib.http_metrics()["errors"], 1)
+        self.assertEqual(len(velib.get_json("lyon", timeout=5)), 3)
+        self.assertEqual(len(velib.get_json("lyon")), 3)
+        velib.session.close()
+
+    def test_keep_alive_conditional(self):
+        velib = self.velib()
+        before = FakeHandler.connections
+        js = velib.get_json("lyon", conditional=True)
+        self.assertEqual(len(js), 3)
+        self.assertIsNone(velib.get_json("lyon", conditional=True))
+        js = velib.get_json("lyon")
+        self.assertEqual(len(js), 3)
+        FakeHandler.version += 1
+        try:
+            js = velib.get_json("lyon", conditional=True)
+        finally:
+            FakeHandler.version -= 1
+        self.assertEqual(js[0]["available_bikes"], 1)
+        for _ in range(3):
+            self.assertEqual(len(velib.get_json("noetag", conditional=True)), 3)
+        self.assertEqual(FakeHandler.connections - before, 1)
+
+        stats = velib.http_metrics()
+        self.assertEqual(stats["requests"], 7)
+        self.assertEqual(stats["not_modified"], 1)
+        self.assertEqual(stats["connections"], 1)
+        self.assertGreater(stats["bytes"], 0)
+        self.assertGreater(stats["avg_latency"], 0)
+        hist = list(velib.session.history)
+        self.assertEqual([h["url"] for h in hist],
+                         ["lyon"] * 4 + ["noetag"] * 3)
+        self.assertEqual(hist[1]["status"], 304)
+        self.assertEqual(hist[1]["bytes"], 0)
+        velib.session.close()
+
+    def test_collecting_data_not_modified(self):
+        temp = get_temp_folder(__file__, "temp_collect_not_modified")
+        name = os.path.join(temp, "velib.bin")
+        stop = datetime.datetime.now() + datetime.timedelta(seconds=0.5)
+        velib = self.velib()
+        velib.collecting_data("lyon", 100, name, stop_datetime=stop,
+                              storage='bin', fLOG=None)
+        df = read_jcdecaux_binary(name)
+        self.assertEqual(df.shape, (3, 15))
+        self.assertGreater(velib.http_metrics()["not_modified"], 1)
+
+    def test_collect_many(self):
+        temp = get_temp_folder(__file__, "temp_collect_many")
+        stop = datetime.datetime.now() + datetime.timedelta(seconds=1.2)
+        logs = []
+        counts = self.velib().collect_many(
+            ["lyon", "nancy", "besancon", "slow"], delayms=300, folder=temp,
+            stop_datetime=stop, max_concurrency=2, timeout=0.5,
+            log_every=1, fLOG=logs.append)
+        self.assertEqual(counts["slow"], 0)
+        self.assertGreater(counts["lyon"], 1)
+        self.assertEqual(counts["lyon"], counts["nancy"])
+        self.assertIn("timeout for 'slow'", "\n".join(logs))
+        self.assertExists(os.path.join(temp, "velib_data.lyon.txt"))
+        self.assertNotExists(os.path.join(temp, "velib_data.slow.txt"))
+
+    def test_collect_many_errors(self):
+        temp = get_temp_folder(__file__, "temp_collect_many_errors")
+        velib = self.velib()
+        write_snapshot = velib._write_snapshot
+
+        def failing_write(js, now, outfile, **kwargs):
+            if "nancy" in outfile:
+                raise OSError("disk full")
+            return write_snapshot(js, now, outfile, **kwargs)
+
+        velib._write_snapshot = failing_write
+        stop = datetime.datetime.now() + datetime.timedelta(seconds=0.5)
+        logs = []
+        counts = velib.collect_many(
+            ["lyon", "nancy"], delayms=100, folder=temp, stop_datetime=stop,
+            timeout=None, fLOG=logs.append)
+        self.assertGreater(counts["lyon"], 0)
+        self.assertEqual(counts["nancy"], 0)
+        self.assertIn("error for 'nancy'", "\n".join(logs))
+        self.assertIn("disk full", "\n".join(logs))
+        self.assertExists(os.path.join(temp, "velib_data.lyon.txt"))
+
+    def test_collect_many_bin(self):
+        temp = get_temp_folder(__file__, "temp_collect_many_bin")
+        stop = datetime.datetime.now() + datetime.timedelta(seconds=0.5)
+        counts = self.velib().collect_many(
+            ["lyon", "nancy"], delayms=100, folder=temp, stop_datetime=stop,
+            storage='bin', fLOG=None)
+        df = read_jcdecaux_binary(os.path.join(temp, "velib_data.lyon.bin"))
+        self.assertEqual(df.shape, (counts["lyon"] * 3, 15))
+        self.assertEqual(set(df["contract_name"]), {"lyon"})
+
+
+if __name__ == "__main__":
+    unittest.main()
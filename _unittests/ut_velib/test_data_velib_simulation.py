@@ -2,9 +2,15 @@
 @brief      test log(time=28s)
 """
 import os
+import tempfile
 import unittest
+import random
+import datetime
+import numpy
+import pandas
 from pyquickhelper.loghelper import fLOG
-from manydataapi.velib import DataCollectJCDecaux
+from manydataapi.velib import (
+    DataCollectJCDecaux, simulate_batch, SimulationProgress)
 
 
 class TestDataVelibSimulation (unittest.TestCase):
@@ -39,6 +45,163 @@ class TestDataVelibSimulation (unittest.TestCase):
                 if __name__ != "__main__":
                     return
 
+    def test_data_velib_simulation_engine(self):
+        fold = os.path.abspath(os.path.split(__file__)[0])
+        df = DataCollectJCDecaux.to_df(os.path.join(fold, "data"))
+        start = datetime.datetime(2020, 1, 1)
+        for bike, speed, index in [(1, 10, None), (10, 15, None), (10, 15, True)]:
+            res = []
+            for engine in ["python", "array"]:
+                random.seed(3)
+                res.append(DataCollectJCDecaux.simulate(
+                    df, bike, speed, iteration=200, start=start,
+                    index=index, engine=engine, fLOG=None))
+            self.assertGreater(res[0][0].shape[0], bike)
+            pandas.testing.assert_frame_equal(res[0][0], res[1][0])
+            pandas.testing.assert_frame_equal(res[0][1], res[1][1])
+
+    def test_data_velib_simulation_seed(self):
+        fold = os.path.abspath(os.path.split(__file__)[0])
+        df = DataCollectJCDecaux.to_df(os.path.join(fold, "data"))
+        start = datetime.datetime(2020, 1, 1)
+        random.seed(5)
+        state = random.getstate()
+        res = [DataCollectJCDecaux.simulate(df, 5, 15, iteration=200, start=start,
+                                            seed=seed, engine=engine, fLOG=None)
+               for seed, engine in [(7, "array"), (7, "python"), (7, "array"),
+                                    (8, "array")]]
+        self.assertEqual(state, random.getstate())
+        pandas.testing.assert_frame_equal(res[0][0], res[1][0])
+        pandas.testing.assert_frame_equal(res[0][0], res[2][0])
+        pandas.testing.assert_frame_equal(res[0][1], res[2][1])
+        self.assertNotEqual(res[0][0].shape, res[3][0].shape)
+
+        res = [DataCollectJCDecaux.simulate(
+            df, 5, 15, iteration=200, start=start, fLOG=None,
+            seed=numpy.random.default_rng(0)) for i in range(2)]
+        pandas.testing.assert_frame_equal(res[0][0], res[1][0])
+
+    def test_data_velib_simulation_batch(self):
+        fold = os.path.abspath(os.path.split(__file__)[0])
+        df = DataCollectJCDecaux.to_df(os.path.join(fold, "data"))
+        scenarios = [dict(nbbike=2, speed=10), dict(nbbike=5, speed=15),
+                     dict(nbbike=5, speed=15, delta_speed=5)]
+        raw = simulate_batch(df, scenarios, replications=3, iteration=100,
+                             backend='serial', aggregate=False)
+        self.assertEqual(raw.shape[0], 9)
+        self.assertEqual(list(raw.columns[:2]), ["scenario", "replication"])
+        self.assertTrue(all(raw["departures"] >= raw["trips"]))
+        par = simulate_batch(df, scenarios, replications=3, iteration=100,
+                             n_jobs=2, aggregate=False)
+        pandas.testing.assert_frame_equal(raw, par)
+
+        agg = simulate_batch(df, scenarios, replications=3, iteration=100,
+                             backend='thread', n_jobs=2)
+        self.assertEqual(agg.shape[0], 3)
+        self.assertEqual(list(agg["replications"]), [3, 3, 3])
+        self.assertEqual(list(agg["nbbike"]), [2, 5, 5])
+        self.assertIn("trips_mean", agg.columns)
+        self.assertIn("empty_minutes_std", agg.columns)
+        self.assertAlmostEqual(agg["trips_mean"][0],
+                               raw["trips"][:3].mean())
+
+    def test_data_velib_simulation_progress(self):
+        fold = os.path.abspath(os.path.split(__file__)[0])
+        df = DataCollectJCDecaux.to_df(os.path.join(fold, "data"))
+
+        class Clock:
+            "every call moves the time by 0.1s"
+
+            def __init__(self):
+                self.t = 0.
+
+            def __call__(self):
+                self.t += 0.1
+                return self.t
+
+        class Counter:
+            "tqdm-like"
+
+            def __init__(self):
+                self.n = 0
+
+            def update(self, n):
+                self.n += n
+
+        for engine in ["array", "python"]:
+            logs = []
+            DataCollectJCDecaux.simulate(df, 5, 15, iteration=200, seed=0,
+                                         engine=engine,
+                                         fLOG=lambda *args: logs.append(args))
+            # the default interval is one second
+            self.assertLess(len(logs), 10)
+
+            metrics = []
+            prog = SimulationProgress(metrics.append, interval=1., clock=Clock())
+            DataCollectJCDecaux.simulate(df, 5, 15, iteration=200, seed=0,
+                                         engine=engine, progress=prog, fLOG=None)
+            self.assertEqual(prog.reports, len(metrics))
+            self.assertGreater(len(metrics), 10)
+            self.assertLess(len(metrics), 25)
+            self.assertEqual(metrics[-1]['iteration'], 200)
+            self.assertEqual(metrics[-1]['iterations'], 200)
+
+            counter = Counter()
+            DataCollectJCDecaux.simulate(df, 5, 15, iteration=200, seed=0,
+                                         engine=engine, progress=counter, fLOG=None)
+            self.assertEqual(counter.n, 200)
+
+            logs = []
+            dfp, _ = DataCollectJCDecaux.simulate(
+                df, 5, 15, iteration=200, seed=0, engine=engine, trace=True,
+                fLOG=lambda *args: logs.append(args))
+            traced = [log for log in logs if log[0].startswith("    ")]
+            self.assertEqual(len(traced), dfp.shape[0])
+
+    def test_data_velib_simulation_sink(self):
+        fold = os.path.abspath(os.path.split(__file__)[0])
+        df = DataCollectJCDecaux.to_df(os.path.join(fold, "data"))
+        start = datetime.datetime(2020, 1, 1)
+        exp_p, exp_s = DataCollectJCDecaux.simulate(
+            df, 5, 15, iteration=200, start=start, seed=0, fLOG=None)
+
+        chunks = []
+        got_p, got_s = DataCollectJCDecaux.simulate(
+            df, 5, 15, iteration=200, start=start, seed=0, fLOG=None,
+            sink=chunks.append, chunk_size=30)
+        self.assertIsNone(got_s)
+        self.assertEqual(len(chunks), 7)
+        nst = exp_s.shape[0] // 200
+        self.assertEqual([c.shape[0] for c in chunks],
+                         [30 * nst] * 6 + [20 * nst])
+        pandas.testing.assert_frame_equal(exp_p, got_p)
+        pandas.testing.assert_frame_equal(
+            exp_s, pandas.concat(chunks).reset_index(drop=True))
+
+        with tempfile.TemporaryDirectory() as temp:
+            for name, sep in [("status.csv", ","), ("status.txt", "\t")]:
+                name = os.path.join(temp, name)
+                _, got = DataCollectJCDecaux.simulate(
+                    df, 5, 15, iteration=200, start=start, seed=0, fLOG=None,
+                    sink=name, chunk_size=64)
+                self.assertEqual(got, name)
+                back = pandas.read_csv(name, sep=sep)
+                self.assertEqual(list(back.columns), list(exp_s.columns))
+                self.assertEqual(back.shape, exp_s.shape)
+                self.assertEqual(list(back["available_bikes"]),
+                                 list(exp_s["available_bikes"]))
+
+        stats = simulate_batch(df, [dict(nbbike=5, speed=15)], replications=1,
+                               seed=0, iteration=200, aggregate=False)
+        seed = int(numpy.random.SeedSequence(0).spawn(1)[0].generate_state(
+            1, numpy.uint64)[0])
+        _, full = DataCollectJCDecaux.simulate(
+            df, 5, 15, iteration=200, start=start, seed=seed, fLOG=None)
+        self.assertEqual(stats["empty_minutes"][0],
+                         (full["available_bikes"] == 0).sum())
+        self.assertEqual(stats["full_minutes"][0],
+                         (full["available_bike_stands"] == 0).sum())
+
 
 if __name__ == "__main__":
     unittest.main()
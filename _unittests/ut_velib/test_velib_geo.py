@@ -0,0 +1,60 @@
+"""
+@brief      test log(time=2s)
+"""
+import os
+import unittest
+import numpy
+from pyquickhelper.pycode import ExtTestCase
+from manydataapi.velib import (
+    DataCollectJCDecaux, haversine, distance_matrix, station_distance_matrix)
+
+
+class TestVelibGeo(ExtTestCase):
+
+    def setUp(self):
+        fold = os.path.abspath(os.path.split(__file__)[0])
+        self.df = DataCollectJCDecaux.to_df(os.path.join(fold, "data"))
+
+    def test_haversine(self):
+        lat = self.df["lat"].values[:20]
+        lng = self.df["lng"].values[:20]
+        d = haversine(lat[0], lng[0], lat, lng)
+        self.assertEqual(d.shape, (20,))
+        for i in range(20):
+            exp = DataCollectJCDecaux.distance_haversine(
+                lat[0], lng[0], lat[i], lng[i])
+            self.assertAlmostEqual(d[i], exp, places=9)
+        d = haversine(lat[0], lng[0], lat[1], lng[1])
+        self.assertIsInstance(d, float)
+
+    def test_distance_matrix(self):
+        lat = self.df["lat"].values[:30]
+        lng = self.df["lng"].values[:30]
+        exp = haversine(lat[:, None], lng[:, None], lat[None, :], lng[None, :])
+        got = distance_matrix(lat, lng)
+        self.assertEqual(got.dtype, numpy.float32)
+        self.assertEqualArray(exp.astype(numpy.float32), got)
+        blocked = distance_matrix(lat, lng, block_size=7)
+        self.assertEqualArray(got, blocked)
+        rect = distance_matrix(lat[:5], lng[:5], lat, lng, dtype=numpy.float64)
+        self.assertEqual(rect.shape, (5, 30))
+        self.assertEqualArray(exp[:5], rect)
+
+    def test_station_distance_matrix(self):
+        mat = station_distance_matrix(self.df)
+        numbers = sorted(set(self.df["number"]))
+        self.assertEqual(list(mat.index), numbers)
+        self.assertEqual(list(mat.columns), numbers)
+        self.assertEqualArray(numpy.diag(mat.values),
+                              numpy.zeros(len(numbers), dtype=numpy.float32))
+        self.assertEqualArray(mat.values, mat.values.T)
+        again = station_distance_matrix(self.df.iloc[::-1])
+        self.assertIs(mat, again)
+        self.assertFalse(mat.values.flags.writeable)
+        nocache = station_distance_matrix(self.df, cache=False, block_size=5)
+        self.assertIsNot(mat, nocache)
+        self.assertEqualArray(mat.values, nocache.values)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+"""
+@brief      test log(time=3s)
+"""
+import os
+import shutil
+import unittest
+from unittest import mock
+import numpy
+from pyquickhelper.pycode import ExtTestCase, get_temp_folder
+from manydataapi.velib import DataCollectJCDecaux, VelibFrames, render_frames
+from manydataapi.velib import rendering
+from manydataapi.velib.rendering import _folium_layers
+try:
+    import folium
+except ImportError:  # pragma: no cover
+    folium = None
+
+
+class TestVelibRendering(ExtTestCase):
+
+    def setUp(self):
+        fold = os.path.abspath(os.path.split(__file__)[0])
+        self.df = DataCollectJCDecaux.to_df(os.path.join(fold, "data"))
+
+    def test_frames(self):
+        df = self.df.sample(frac=1., random_state=0)
+        frames = VelibFrames(df, size=3)
+        dates = list(sorted(set(df["file"])))
+        self.assertEqual(frames.dates, dates)
+        self.assertEqual(len(frames), len(dates))
+        for i, d in enumerate(dates):
+            sub = df[df["file"] == d]
+            x, y, c, b = frames[i]
+            self.assertEqualArray(sub["lng"].values, x)
+            self.assertEqualArray(sub["lat"].values, y)
+            self.assertEqualArray(
+                sub.apply(lambda r: r["available_bike_stands"] ** 0.5 * 3,
+                          axis=1).values, c)
+            self.assertEqualArray(
+                sub.apply(lambda r: r["available_bikes"] ** 0.5 * 3,
+                          axis=1).values, b)
+        lim = frames.limits()
+        self.assertEqual(lim[0], df["lng"].min())
+        self.assertEqual(lim[3], df["lat"].max())
+
+    def test_animation_frames(self):
+        frames = VelibFrames(self.df)
+        anim = DataCollectJCDecaux.animation(frames)
+        self.assertIsNotNone(anim)
+        _, ax, plt = DataCollectJCDecaux.draw(self.df[self.df["file"] == frames.dates[0]])
+        self.assertEqualArray(
+            ax.collections[0].get_sizes(), frames[0][2])
+        plt.close('all')
+
+    def test_render_png(self):
+        temp = get_temp_folder(__file__, "temp_render_png")
+        frames = VelibFrames(self.df)
+        logs = []
+        res = render_frames(frames, os.path.join(temp, "img", "velib_%03d.png"),
+                            chunk_size=3, figsize=(4, 3), fLOG=logs.append)
+        self.assertEqual(res["frames"], len(frames))
+        self.assertGreater(res["fps"], 0)
+        self.assertIn("fps", logs[-1])
+        names = sorted(os.listdir(os.path.join(temp, "img")))
+        self.assertEqual(names, ["velib_%03d.png" % i for i in range(len(frames))])
+
+        res = render_frames(self.df, os.path.join(temp, "par", "velib_%03d.png"),
+                            n_jobs=2, chunk_size=3, figsize=(4, 3))
+        self.assertEqual(res["frames"], len(frames))
+        self.assertEqual(sorted(os.listdir(os.path.join(temp, "par"))), names)
+
+    def test_render_empty(self):
+        temp = get_temp_folder(__file__, "temp_render_empty")
+        frames = VelibFrames(self.df.iloc[:0])
+        self.assertEqual(len(frames), 0)
+        for n_jobs in [1, 2]:
+            res = render_frames(frames, os.path.join(temp, "velib.mp4"), n_jobs=n_jobs)
+            self.assertEqual(res["frames"], 0)
+        self.assertEqual(os.listdir(temp), [])
+
+    def test_render_video_errors(self):
+        temp = get_temp_folder(__file__, "temp_render_video_errors")
+        name = os.path.join(temp, "velib.mp4")
+        frames = VelibFrames(self.df)
+        with mock.patch.object(rendering, '_ffmpeg_exe', lambda: "ffmpeg"):
+            with mock.patch.object(rendering.subprocess, 'Popen') as popen:
+                # ffmpeg stops while it receives the frames,
+                # the original error is raised
+                popen.return_value.stdin.write.side_effect = BrokenPipeError("pipe")
+                popen.return_value.stdin.close.side_effect = BrokenPipeError("close")
+                popen.return_value.wait.return_value = 1
+                self.assertRaise(lambda: render_frames(frames, name, figsize=(4, 3)),
+                                 BrokenPipeError)
+                popen.return_value.wait.assert_called_once_with()
+
+                # ffmpeg fails once every frame was sent
+                popen.reset_mock()
+                popen.return_value.stdin.write.side_effect = None
+                popen.return_value.stdin.close.side_effect = None
+                self.assertRaise(lambda: render_frames(frames, name, figsize=(4, 3)),
+                                 RuntimeError)
+
+    @unittest.skipIf(folium is None, reason="folium is missing")
+    def test_folium_layers(self):
+        df = self.df[self.df["file"] == self.df["file"].iloc[0]].copy()
+        df.iloc[0, df.columns.get_loc("lat")] = numpy.nan
+        size = 2
+
+        # previous implementation, one marker per station
+        markers = {'#3186cc': [], '#cc8631': []}
+        for _, row in df[df["lat"].notnull() & df["lng"].notnull()].iterrows():
+            t = "+ {0} o {1}".format(row["available_bikes"],
+                                     row["available_bike_stands"])
+            for color, col in [('#3186cc', "available_bikes"),
+                               ('#cc8631', "available_bike_stands")]:
+                markers[color].append(folium.CircleMarker(
+                    [row["lat"], row["lng"]], color=color, fill_color=color, popup=t,
+                    radius=(row[col] / numpy.pi) ** 0.5 * 30 * size))
+
+        layers = _folium_layers(df, size=size)
+        self.assertEqual(len(layers), 2)
+        for layer, color in zip(layers, ['#3186cc', '#cc8631']):
+            features = layer.data["features"]
+            exp = markers[color]
+            self.assertEqual(len(features), len(exp))
+            self.assertEqual(len(features), df.shape[0] - 1)
+            self.assertEqual(layer.marker.options["color"], color)
+            self.assertEqual(layer.marker.options["fillColor"], color)
+            for feat, marker in zip(features, exp):
+                # folium drops a null radius
+                radius = marker.options.get("radius", 0)
+                self.assertEqual(feat["geometry"]["coordinates"][::-1], marker.location)
+                self.assertAlmostEqual(feat["properties"]["radius"], radius)
+                style = layer.style_function(feat)
+                self.assertAlmostEqual(style["radius"], radius)
+                self.assertEqual(style["color"], color)
+                popup = list(marker._children.values())[0]  # pylint: disable=W0212
+                self.assertIn(">{}</div>".format(feat["properties"]["text"]),
+                              popup.html.render())
+
+        map_osm = DataCollectJCDecaux.draw(df, use_folium=True, size=size)
+        html = map_osm.get_root().render()
+        self.assertIn("#3186cc", html)
+        self.assertIn("#cc8631", html)
+        self.assertIn(features[1]["properties"]["text"], html)
+
+    @unittest.skipIf(shutil.which("ffmpeg") is None, reason="ffmpeg is missing")
+    def test_render_video(self):
+        temp = get_temp_folder(__file__, "temp_render_video")
+        name = os.path.join(temp, "velib.mp4")
+        res = render_frames(self.df, name, n_jobs=2, chunk_size=3,
+                            figsize=(4, 3))
+        self.assertEqual(res["frames"], 10)
+        self.assertExists(name)
+
+
+if __name__ == "__main__":
+    unittest.main()
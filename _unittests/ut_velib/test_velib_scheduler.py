@@ -0,0 +1,116 @@
+"""
+@brief      test log(time=3s)
+"""
+import os
+import time
+import threading
+import unittest
+import datetime
+from pyquickhelper.pycode import get_temp_folder, ExtTestCase
+from manydataapi.velib import PeriodicScheduler, DataCollectJCDecaux
+
+
+class FakeClock:
+    "Clock moved forward by sleeps and by the work done in every tick."
+
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+class SlowJCDecaux(DataCollectJCDecaux):
+    "Returns the same snapshot after a delay."
+
+    def __init__(self, delay):
+        DataCollectJCDecaux.__init__(self, None)
+        self.delay = delay
+        self.calls = []
+
+    def get_json(self, contract, conditional=False):
+        self.calls.append(time.monotonic())
+        time.sleep(self.delay)
+        return [dict(number=1, contract_name=contract, name="a",
+                     collect_date=datetime.datetime.now())]
+
+
+class TestVelibScheduler(ExtTestCase):
+
+    def run_fake(self, policy, durations):
+        clock = FakeClock()
+        sched = PeriodicScheduler(10, policy=policy, max_ticks=len(durations),
+                                  clock=clock)
+        # waits are replaced by moving the fake clock
+        sched._stop.wait = lambda t: setattr(clock, 'now', clock.now + t)
+        starts = []
+        for tick in sched:
+            starts.append(clock.now)
+            clock.now += durations[tick]
+        return sched, starts
+
+    def test_no_drift(self):
+        sched, starts = self.run_fake('skip', [3, 9, 1, 4])
+        self.assertEqual(starts, [0, 10, 20, 30])
+        self.assertEqual(sched.skipped, 0)
+        self.assertEqual(sched.summary()['max_lateness'], 0)
+
+    def test_skip(self):
+        sched, starts = self.run_fake('skip', [25, 1, 1])
+        self.assertEqual(starts, [0, 30, 40])
+        self.assertEqual(sched.skipped, 2)
+        self.assertEqual(list(sched.lateness), [0, 0, 0])
+
+    def test_catchup(self):
+        sched, starts = self.run_fake('catchup', [25, 1, 1, 1])
+        self.assertEqual(starts, [0, 25, 26, 30])
+        self.assertEqual(sched.skipped, 0)
+        self.assertEqual(list(sched.lateness), [0, 15, 6, 0])
+        self.assertEqual(sched.summary()['max_lateness'], 15)
+
+    def test_jitter(self):
+        clock = FakeClock()
+        sched = PeriodicScheduler(10, jitter=2, max_ticks=20, seed=0,
+                                  clock=clock)
+        sched._stop.wait = lambda t: setattr(clock, 'now', clock.now + t)
+        starts = [clock.now for tick in sched]
+        for i, s in enumerate(starts):
+            self.assertGreaterEqual(s, i * 10)
+            self.assertLesser(s, i * 10 + 2)
+
+    def test_stop(self):
+        sched = PeriodicScheduler(60)
+        ticks = []
+        timer = threading.Timer(0.2, sched.stop)
+        timer.start()
+        begin = time.perf_counter()
+        for tick in sched:
+            ticks.append(tick)
+        self.assertLesser(time.perf_counter() - begin, 5)
+        self.assertEqual(ticks, [0])
+        self.assertTrue(sched.stopped)
+
+    def test_wrong_policy(self):
+        self.assertRaise(lambda: PeriodicScheduler(1, policy="any"),
+                         ValueError)
+
+    def test_collecting_data_drift(self):
+        temp = get_temp_folder(__file__, "temp_velib_scheduler")
+        name = os.path.join(temp, "velib.txt")
+        velib = SlowJCDecaux(0.05)
+        stop = datetime.datetime.now() + datetime.timedelta(seconds=1.05)
+        logs = []
+        res = velib.collecting_data("lyon", 100, name, stop_datetime=stop,
+                                    log_every=1, fLOG=logs.append)
+        self.assertIn(res['ticks'], (10, 11))
+        self.assertEqual(res['skipped'], 0)
+        self.assertIn("late=", logs[0])
+        # collections start every 100ms despite the 50ms requests
+        diffs = [b - a for a, b in zip(velib.calls[:-1], velib.calls[1:])]
+        self.assertLesser(abs(sum(diffs) / len(diffs) - 0.1), 0.02)
+        with open(name, "r", encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), res['ticks'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+@brief      test log(time=3s)
+"""
+import os
+import unittest
+import random
+import numpy
+import pandas
+from pyquickhelper.pycode import ExtTestCase
+from manydataapi.velib import DataCollectJCDecaux, StationIndex, haversine
+
+
+class TestVelibSpatial(ExtTestCase):
+
+    def setUp(self):
+        fold = os.path.abspath(os.path.split(__file__)[0])
+        self.df = DataCollectJCDecaux.to_df(os.path.join(fold, "data"))
+
+    def random_stations(self, n=2000, seed=0):
+        rnd = numpy.random.RandomState(seed)
+        return pandas.DataFrame(dict(
+            number=numpy.arange(n) * 3,
+            lat=48.85 + rnd.randn(n) * 0.05,
+            lng=2.35 + rnd.randn(n) * 0.08))
+
+    def brute(self, df, lat, lng, mask=None):
+        d = haversine(lat, lng, df["lat"].values, df["lng"].values)
+        numbers = df["number"].values
+        if mask is not None:
+            d, numbers = d[mask], numbers[mask]
+        order = numpy.argsort(d, kind="stable")
+        return numbers[order], d[order]
+
+    def test_index_data(self):
+        index = StationIndex(self.df)
+        self.assertEqual(len(index), len(set(self.df["number"])))
+        stations = self.df.drop_duplicates("number").sort_values("number")
+        for lat, lng in zip(stations["lat"], stations["lng"]):
+            exp_n, exp_d = self.brute(stations, lat, lng)
+            got_n, got_d = index.query_knn(lat, lng, k=4)
+            self.assertEqualArray(exp_n[:4], got_n)
+            self.assertEqualArray(exp_d[:4], got_d, atol=1e-6)
+            got_n, got_d = index.query_radius(lat, lng, 0.6)
+            self.assertEqualArray(exp_n[exp_d <= 0.6], got_n)
+
+    def test_index_random(self):
+        df = self.random_stations()
+        index = StationIndex(df, cell=0.3)
+        rnd = numpy.random.RandomState(1)
+        lat = 48.85 + rnd.randn(50) * 0.06
+        lng = 2.35 + rnd.randn(50) * 0.1
+        mask = (df["number"].values % 2) == 0
+
+        knn_n, knn_d = index.query_knn(lat, lng, k=5)
+        self.assertEqual(knn_n.shape, (50, 5))
+        knn_m, _ = index.query_knn(lat, lng, k=5, mask=mask)
+        rad = index.query_radius(lat, lng, 0.5)
+        self.assertEqual(len(rad), 50)
+        rad_m = index.query_radius(lat, lng, 0.5, mask=df["number"][mask])
+        for i in range(50):
+            exp_n, exp_d = self.brute(df, lat[i], lng[i])
+            self.assertEqualArray(exp_n[:5], knn_n[i])
+            self.assertEqualArray(exp_d[:5], knn_d[i], atol=1e-6)
+            self.assertEqualArray(exp_n[exp_d <= 0.5], rad[i][0])
+            exp_n, exp_d = self.brute(df, lat[i], lng[i], mask=mask)
+            self.assertEqualArray(exp_n[:5], knn_m[i])
+            self.assertEqualArray(exp_n[exp_d <= 0.5], rad_m[i][0])
+
+        pos, _ = index.query_knn(lat[0], lng[0], k=2, positions=True)
+        self.assertEqualArray(index.numbers[pos], knn_n[0, :2])
+        self.assertEqualArray(index.position(knn_n[0, :2]), pos)
+
+    def test_knn_missing(self):
+        df = self.random_stations(20)
+        index = StationIndex(df, cell=0.1)
+        numbers, dist = index.query_knn(48.85, 2.35, k=3, mask=[0, 3])
+        self.assertEqual(sorted(numbers[:2].tolist()), [0, 3])
+        self.assertEqual(numbers[2], -1)
+        self.assertEqual(dist[2], numpy.inf)
+        self.assertRaise(lambda: index.query_knn(48.85, 2.35, k=0), ValueError)
+        self.assertRaise(lambda: index.query_knn([48.85], [2.35], k=-1), ValueError)
+
+    def test_simulate_index(self):
+        random.seed(0)
+        dfp, dfs = DataCollectJCDecaux.simulate(
+            self.df, 3, 15, iteration=200, index=True, fLOG=None)
+        self.assertGreater(dfs.shape[0], 0)
+        end = dfp[dfp["beginend"] == "end"]
+        self.assertGreater(end.shape[0], 0)
+        self.assertTrue(all(end["dist"] <= (15 + 2.5) * end["hours"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
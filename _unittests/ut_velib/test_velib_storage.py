@@ -0,0 +1,207 @@
+"""
+@brief      test log(time=3s)
+"""
+import os
+import unittest
+import datetime
+import pandas
+from pyquickhelper.pycode import get_temp_folder, ExtTestCase
+from manydataapi.velib import (
+    DataCollectJCDecaux, JCDecauxBinaryWriter,
+    read_jcdecaux_binary, read_jcdecaux_txt, convert_jcdecaux_txt)
+
+
+class OfflineJCDecaux(DataCollectJCDecaux):
+    "Replays the same snapshot."
+
+    def __init__(self, rows):
+        DataCollectJCDecaux.__init__(self, None)
+        self.rows = rows
+
+    def get_json(self, contract, conditional=False):
+        now = datetime.datetime.now()
+        rows = [dict(r) for r in self.rows]
+        for r in rows:
+            r["collect_date"] = now
+        return rows
+
+
+class TestVelibStorage(ExtTestCase):
+
+    def setUp(self):
+        fold = os.path.abspath(os.path.split(__file__)[0])
+        self.data = os.path.join(fold, "data")
+
+    def test_convert(self):
+        temp = get_temp_folder(__file__, "temp_velib_convert")
+        name = os.path.join(temp, "velib.bin")
+        n = convert_jcdecaux_txt(self.data, name)
+        self.assertEqual(n, 10)
+        size = sum(os.path.getsize(os.path.join(self.data, f))
+                   for f in os.listdir(self.data))
+        self.assertLesser(os.path.getsize(name) * 4, size)
+
+        exp = DataCollectJCDecaux.to_df(self.data)
+        exp = exp.sort_values(["file", "number"]).reset_index(drop=True)
+        got = read_jcdecaux_binary(name)
+        self.assertEqual(got["number"].dtype, "int32")
+        self.assertEqual(got["available_bikes"].dtype, "int16")
+        self.assertEqual(list(exp.columns), list(got.columns))
+        got = got.sort_values(["file", "number"]).reset_index(drop=True)
+        pandas.testing.assert_frame_equal(exp, got, check_dtype=False)
+
+    def test_append(self):
+        temp = get_temp_folder(__file__, "temp_velib_append")
+        name = os.path.join(temp, "velib.bin")
+        exp = DataCollectJCDecaux.to_df(self.data)
+        rows = exp.drop("file", axis=1).to_dict("records")
+        js = [dict(r, collect_date=r["collect_date"].to_pydatetime(),
+                   last_update=r["last_update"].to_pydatetime())
+              for r in rows[:5]]
+        JCDecauxBinaryWriter(name).append(js, label="a")
+        size = os.path.getsize(name)
+        writer = JCDecauxBinaryWriter(name)
+        self.assertEqual(len(writer.stations), 5)
+        writer.append(js, label="b")
+        # no new station, no new table
+        self.assertLesser(os.path.getsize(name) - size, size)
+        got = read_jcdecaux_binary(name)
+        self.assertEqual(got.shape, (10, 15))
+        self.assertEqual(list(got["file"]), ["a"] * 5 + ["b"] * 5)
+        self.assertEqual(list(got["name"][:5]), list(got["name"][5:]))
+
+    def snapshots(self):
+        "Builds snapshots from the first file, one station changes every time."
+        df = DataCollectJCDecaux.to_df(self.data)
+        rows = df[df["file"] == df["file"].iloc[0]].drop(
+            "file", axis=1).to_dict("records")
+        rows = [dict(r, collect_date=r["collect_date"].to_pydatetime(),
+                     last_update=r["last_update"].to_pydatetime())
+                for r in rows]
+        snaps = []
+        for i in range(10):
+            date = datetime.datetime(2014, 5, 22, 12, i)
+            snap = [dict(r, collect_date=date) for r in rows]
+            rows[i]["available_bikes"] += 1
+            if i == 3:
+                rows[5]["status"] = "CLOSED"
+            if i == 5:
+                # a station disappears
+                snap = snap[1:]
+            if i == 7:
+                # a new station
+                snap.append(dict(snap[-1], number=999, name="NEW"))
+            snaps.append(snap)
+        return snaps
+
+    def test_delta(self):
+        temp = get_temp_folder(__file__, "temp_velib_delta")
+        full = os.path.join(temp, "full.bin")
+        delta = os.path.join(temp, "delta.bin")
+        writer_full = JCDecauxBinaryWriter(full)
+        writer_delta = JCDecauxBinaryWriter(delta, keyframe_every=4)
+        for snap in self.snapshots():
+            writer_full.append(snap)
+            writer_delta.append(snap)
+        self.assertLesser(os.path.getsize(delta) * 2, os.path.getsize(full))
+
+        exp = read_jcdecaux_binary(full)
+        got = read_jcdecaux_binary(delta)
+        sort = ["file", "number"]
+        pandas.testing.assert_frame_equal(
+            exp.sort_values(sort).reset_index(drop=True),
+            got.sort_values(sort).reset_index(drop=True))
+
+        at = datetime.datetime(2014, 5, 22, 12, 6, 30)
+        snap = read_jcdecaux_binary(delta, at=at)
+        self.assertEqual(set(snap["collect_date"]),
+                         {datetime.datetime(2014, 5, 22, 12, 6)})
+        sub = exp[exp["collect_date"] == datetime.datetime(2014, 5, 22, 12, 6)]
+        pandas.testing.assert_frame_equal(
+            sub.sort_values(sort).reset_index(drop=True),
+            snap.sort_values(sort).reset_index(drop=True))
+
+        events = read_jcdecaux_binary(delta, mode="events")
+        self.assertEqual(events.shape[1], 16)
+        self.assertEqual(events["keyframe"].sum(), 30 * 3)
+        self.assertEqual((~events["keyframe"]).sum(), 9)
+        self.assertRaise(lambda: read_jcdecaux_binary(delta, mode="events", at=at),
+                         ValueError)
+
+        # reopening the file starts with a keyframe
+        writer_delta = JCDecauxBinaryWriter(delta, keyframe_every=4)
+        writer_delta.append(self.snapshots()[0], label="last")
+        events = read_jcdecaux_binary(delta, mode="events")
+        self.assertEqual(events["keyframe"].sum(), 30 * 4)
+
+    def test_read_txt(self):
+        rows = []
+        for name in os.listdir(self.data):
+            with open(os.path.join(self.data, name), "r", encoding="utf8") as f:
+                for line in f:
+                    dl = eval(line)  # pylint: disable=W0123
+                    for d in dl:
+                        d["file"] = name
+                    rows.extend(dl)
+        exp = pandas.DataFrame(rows)
+        got = read_jcdecaux_txt(self.data)
+        self.assertEqual(list(exp.dtypes), list(got.dtypes))
+        pandas.testing.assert_frame_equal(exp, got)
+        got = read_jcdecaux_txt(self.data, n_jobs=2)
+        pandas.testing.assert_frame_equal(exp, got)
+        got = DataCollectJCDecaux.to_df(self.data, columns=["number", "file"])
+        pandas.testing.assert_frame_equal(exp[["number", "file"]], got)
+
+    def test_read_txt_irregular(self):
+        temp = get_temp_folder(__file__, "temp_velib_irregular")
+        rows = [
+            [{'number': 1, 'name': "D'EAU", 'lat': 4.5,
+              'last_update': datetime.datetime(2014, 5, 22, 11, 51)},
+             {'number': 2, 'name': 'a\\b', 'lat': None}],
+            [{'number': 3, 'name': 'c', 'lat': 5,
+              'last_update': datetime.datetime(2014, 5, 22, 11, 51, 2, 5),
+              'position': {'lat': 5}}]]
+        for i, r in enumerate(rows):
+            name = os.path.join(temp, "velib_data.%d.txt" % i)
+            with open(name, "w", encoding="utf8") as f:
+                f.write(str(r))
+        exp = DataCollectJCDecaux.to_df(temp)
+        self.assertEqual(exp.shape, (3, 6))
+        self.assertEqual(list(exp["name"]), ["D'EAU", "a\\b", "c"])
+        self.assertEqual(list(exp["number"]), [1, 2, 3])
+        self.assertEqual(exp["lat"].dtype, "float64")
+        self.assertTrue(pandas.isna(exp["last_update"][1]))
+        self.assertEqual(exp["last_update"][2],
+                         datetime.datetime(2014, 5, 22, 11, 51, 2, 5))
+
+    def test_read_txt_no_eval(self):
+        temp = get_temp_folder(__file__, "temp_velib_no_eval")
+        name = os.path.join(temp, "velib_data.0.txt")
+        witness = os.path.join(temp, "witness.txt")
+        code = ("[c for c in ().__class__.__base__.__subclasses__() "
+                "if c.__name__ == 'BuiltinImporter'][0].load_module('os')"
+                ".system('echo > {}')".format(witness.replace("\\", "/")))
+        with open(name, "w", encoding="utf8") as f:
+            f.write("[{'number': 1, 'name': 'a'}]\n")
+            f.write("[{'number': %s, 'name': 'b'}]\n" % code)
+        self.assertRaise(lambda: DataCollectJCDecaux.to_df(temp), ValueError,
+                         "line 2 in file")
+        self.assertNotExists(witness)
+
+    def test_collecting_data_bin(self):
+        temp = get_temp_folder(__file__, "temp_velib_collect_bin")
+        name = os.path.join(temp, "velib.bin")
+        df = DataCollectJCDecaux.to_df(self.data)
+        rows = df[df["file"] == df["file"].iloc[0]].drop(
+            "file", axis=1).to_dict("records")
+        velib = OfflineJCDecaux(rows)
+        stop = datetime.datetime.now() + datetime.timedelta(seconds=0.5)
+        velib.collecting_data("besancon", 100, name, stop_datetime=stop,
+                              storage='bin', fLOG=None)
+        got = read_jcdecaux_binary(name)
+        self.assertEqual(got.shape[0] % len(rows), 0)
+        self.assertGreater(got.shape[0] // len(rows), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,10 +3,16 @@
 @file
 @brief Parses format from a paying machine.
 """
-import copy
 import datetime
+import io
+import itertools
+import mmap
+import operator
 import os
 import pprint
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy
 
 
 def dummy_ct1():
@@ -31,15 +37,1401 @@ def dummy_ct1():
     return data
 
 
-def read_ct1(file_or_str, encoding='ascii', as_df=True):
+def _post_process(record):
+    """
+    Checks the total of a basket, adds an item to fix it
+    if it was manually changed and computes the taxes for every item.
+
+    @param      record      basket
+    """
+    manual = [o for o in record['data'] if o['ITMANUAL'] == '1']
+    if len(manual) > 1:
+        raise ValueError(  # pragma: no cover
+            "More than one manual item.")
+    is_manual = len(manual) == 1
+
+    total = sum(obs['ITPRICE'] for obs in record['data'])
+    if is_manual:
+        diff = record['TOTAL-'] - total
+        new_obs = {'CAT': 2.0, 'ERROR': 0.0,
+                   'ITCODE': '30002X',
+                   'ITMANUAL': '2',
+                   'ITPRICE': diff,
+                   'ITQU': 1,
+                   'ITUNIT': abs(diff),
+                   'NEG': 1 if diff < 0 else 0,
+                   'PIECE': True, 'TVAID': manual[0]['TVAID']}
+        record['data'].append(new_obs)
+        total = sum(obs['ITPRICE'] for obs in record['data'])
+
+    record['TOTAL'] = total
+    if abs(record['TOTAL-'] - record['TOTAL']) >= 0.01:
+        raise ValueError(  # pragma: no cover
+            "Mismatch total' {} != {}".format(
+                record['TOTAL'], record['TOTAL-']))
+    if abs(record['TOTAL_'] - record['TOTAL']) >= 0.01:
+        raise ValueError(  # pragma: no cover
+            "Mismatch total' {} != {}".format(
+                record['TOTAL'], record['TOTAL_']))
+    del record['TOTAL_']
+    del record['TOTAL-']
+    tva_d = {t['TVAID']: t for t in record['tva']}
+    for item in record['data']:
+        if is_manual and item['ITMANUAL'] != '2':
+            continue
+        rate = tva_d[item['TVAID']]['RATE']
+        if not isinstance(rate, float):
+            raise ValueError(
+                "Unable to parse tax rate {!r}.".format(rate))
+        item['TVARATE'] = rate
+        item['TVA'] = item['ITPRICE'] * rate / 100
+    if len(record["data"]) == 0:
+        raise ValueError("No record.")  # pragma: no cover
+
+
+def _add_item(data, obs):
+    """
+    Normalizes an item (line ``L``), quantities, signs, checks
+    the price and appends it to the basket with the item added
+    to fix the price if needed.
+
+    @param      data        list of items of a basket
+    @param      obs         item
+    """
+    n = 'ITQU'
+    if obs['CAT'] == 2:
+        obs['PIECE'] = True
+        obs[n] = int(obs[n] * 1000)
+    else:
+        obs['PIECE'] = False
+    if obs['NEG']:
+        obs['ITUNIT'] *= -1
+        obs['ITPRICE'] *= -1
+    diff = abs(obs['ITQU'] * obs['ITUNIT'] - obs['ITPRICE'])
+    add_obs = None
+    if diff >= 0.01:  # 1 cent
+        obs['ERROR'] = diff
+        if obs['ITQU'] == 0 or obs['ITUNIT'] == 0:
+            obs['ERROR'] = 0.
+            obs['ITPRICE'] = 0.
+            if obs['ITCODE'] == '30002':
+                obs['ITMANUAL'] = '1'
+            else:
+                obs['ITMANUAL'] = '?'
+        elif diff >= 0.02:  # pragma: no cover
+            add_obs = obs.copy()
+            add_obs['ITCODE'] += 'X'
+            add_obs['ITPRICE'] = 0.
+            add_obs['NEG'] = 1 if diff < 0 else 0
+            add_obs['ITUNIT'] = abs(diff)
+            add_obs['ITQU'] = 1
+            add_obs['PIECE'] = True
+            add_obs['CAT'] = 1
+    data.append(obs)
+    if add_obs:
+        data.append(add_obs)
+
+
+def _open_ct1(file_or_str, encoding):
+    """
+    Returns a stream of lines and tells if the stream
+    must be closed by the caller.
+
+    @param      file_or_str     filename, file object or string
+    @param      encoding        encoding
+    @return                     stream, to_close
+    """
+    if hasattr(file_or_str, 'read'):
+        return file_or_str, False
+    if len(file_or_str) < 4000 and os.path.exists(file_or_str):
+        return open(file_or_str, encoding=encoding), True
+    return io.StringIO(file_or_str), True
+
+
+def _ct1_stream_lines(stream, encoding):
+    """
+    Reads a stream line by line and yields every line encoded
+    in *utf-8* (a line read from a binary stream is decoded first),
+    the delimiters of the format remain single bytes whatever
+    the encoding of the stream is.
+    """
+    for line in stream:
+        if isinstance(line, bytes):
+            line = line.decode(encoding)
+        yield line.rstrip('\n').strip('\r').encode('utf-8')
+
+
+def iter_ct1(file_or_str, encoding='ascii', drop_unknown=False):
+    """
+    Parses a file or a string which follows a specific
+    format called `CT1` and yields every basket
+    as soon as it is complete. The file is read line by line,
+    the memory only depends on the size of a basket.
+    Lines are grouped into baskets by @see fn _ct1_baskets
+    and every basket is parsed by @see fn _ct1_record
+    like the other engines of @see fn read_ct1 do.
+    See function @see fn read_ct1 for the meaning of every field.
+
+    @param      file_or_str     filename, file object or string
+    @param      encoding        encoding
+    @param      drop_unknown    the fields whose meaning is unknown
+                                are not stored (see @see fn ct1_unknown_column)
+    @return                     iterator on baskets (dictionaries)
+    """
+    stream, to_close = _open_ct1(file_or_str, encoding)
+    try:
+        yield from _tokenize_ct1([_ct1_stream_lines(stream, encoding)],
+                                 encoding='utf-8', drop_unknown=drop_unknown)
+    finally:
+        if to_close:
+            stream.close()
+
+
+#: field names of every record type
+_ct1_info_names = tuple('INFO%d' % i for i in range(10))
+_ct1_h_names = ('NB1', 'NB2', 'NAME', 'PLACE', 'STREET', 'ZIPCODE',
+                'INFOL2', 'INFOL2_1', 'INFOL2_2', 'INFOL2_3', 'INFOL2_4')
+_ct1_l_names = ('ITCODE', 'ITNAME', 'IT1', 'IT2', 'TVAID', 'IT4',
+                'ITUNIT', 'ITQU', 'CAT', 'ITPRICE',
+                'IT6', 'NEG', 'IT8', 'IT9', 'IT10', 'IT11', 'IT12')
+_ct1_l_numbers = ('ITUNIT', 'ITQU', 'CAT', 'ITPRICE', 'NEG')
+_ct1_t9_names = ('HT', 'TVA', 'TOTAL_')
+_ct1_t_names = ('RATE', 'HT', 'VALUE', 'TOTAL')
+_ct1_f_names = ('FCODE', 'TOTAL-', 'DATE', 'TIME', 'FCODE1', 'FCODE2')
+
+
+def _ct1_float(v):
+    "parses a space padded amount"
+    try:
+        # float ignores leading and trailing spaces
+        return float(v)
+    except ValueError:
+        return float(v.replace(" ", ""))
+
+
+def _ct1_datetime(vdate, vtime):
+    "parses ``DD.MM.YYYY`` and ``HH:MM:SS``"
+    if (vdate and vtime and len(vdate) == 10 and len(vtime) == 8 and vdate[2] == vdate[5] == '.' and
+            vtime[2] == vtime[5] == ':'):
+        digits = vdate[:2] + vdate[3:5] + vdate[6:] + vtime[:2] + vtime[3:5] + vtime[6:]
+        if digits.isascii() and digits.isdigit():
+            try:
+                return datetime.datetime(
+                    int(vdate[6:]), int(vdate[3:5]), int(vdate[:2]),
+                    int(vtime[:2]), int(vtime[3:5]), int(vtime[6:]))
+            except ValueError:
+                # strptime raises the expected exception
+                pass
+    return datetime.datetime.strptime(
+        "{} {}".format(vdate, vtime), "%d.%m.%Y %H:%M:%S")
+
+
+def _split_byte_lines(content, universal=True):
+    """
+    Splits bytes into lines, like a file opened in text mode
+    if *universal* is True, otherwise like a binary stream
+    or :epkg:`io.StringIO` (lines end with ``\\n``,
+    ``\\r`` is removed at both ends).
+    """
+    if universal or content.count(b"\r") == content.count(b"\r\n"):
+        return content.splitlines()
+    lines = content.split(b"\n")
+    if lines[-1] == b"":
+        lines.pop()
+    return [line.strip(b"\r") for line in lines]
+
+
+def _iter_byte_lines(stream, block_size=2 ** 24, universal=True):
+    """
+    Reads a binary stream by blocks and yields lists of lines (bytes).
+
+    @param      stream          binary stream
+    @param      block_size      size of a block
+    @param      universal       see @see fn _split_byte_lines
+    @return                     iterator on lists of lines
+    """
+    rest = b""
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        block = rest + block
+        # the last line may be incomplete
+        if universal:
+            end = max(block.rfind(b"\n"), block.rfind(b"\r"))
+            if end == len(block) - 1 and block[end] == 13:
+                # \r\n may be split between two blocks
+                end = max(block.rfind(b"\n", 0, end), block.rfind(b"\r", 0, end))
+        else:
+            end = block.rfind(b"\n")
+        if end == -1:
+            rest = block
+            continue
+        rest = block[end + 1:]
+        yield _split_byte_lines(block[:end + 1], universal)
+    if rest:
+        yield _split_byte_lines(rest, universal)
+
+
+#: exceptions a basket may raise while it is parsed
+_ct1_errors = (KeyError, ValueError, IndexError, RuntimeError)
+
+
+def _ct1_reject(rejects, first, last, lines, exc, encoding):
+    """
+    Stores a rejected basket.
+
+    @param      rejects     list of rejected baskets
+    @param      first       index of the first line
+    @param      last        index of the last line
+    @param      lines       lines of the basket (bytes)
+    @param      exc         exception
+    @param      encoding    encoding
+    """
+    rejects.append(dict(
+        first_line=first + 1, last_line=last + 1, error=exc,
+        text="\n".join(line.decode(encoding, errors='replace') for line in lines)))
+
+
+def _ct1_baskets(blocks, first_line=0, rejects=None, encoding='ascii'):
+    """
+    Splits lines of a `CT1` file (bytes) into baskets, a basket starts
+    with a line ``\\x02`` and ends with a line ``\\x04``. It is the tokenizer
+    @see fn _tokenize_ct1 and @see fn _ct1_columns_bytes share,
+    lines are then parsed by @see fn _ct1_parse_basket.
+    A line ``L``, ``T``, ``H``, ``F`` or ``\\x04`` outside a basket
+    raises an exception or is rejected, the other ones are ignored.
+
+    @param      blocks      iterator on lists of lines (bytes)
+    @param      first_line  index of the first line (for error messages)
+    @param      rejects     see @see fn _tokenize_ct1
+    @param      encoding    encoding
+    @return                 iterator on *(first, lines, error)*, *first* is
+                            the index of the line ``\\x02``, *lines* the lines
+                            of the basket, *error* is None or the exception raised
+                            once the lines are parsed if the next basket starts
+                            before this one ends, a basket truncated
+                            by the end of the lines does not end with
+                            a line ``\\x04`` and *error* is None
+    """
+    basket = None
+    first = None
+    i = first_line - 1
+    for lines in blocks:
+        for bline in lines:
+            i += 1
+            c = bline[:1]
+            if basket is not None:
+                if c == b"\x02":
+                    # the previous basket never ends
+                    yield first, basket, RuntimeError(
+                        "Wrong format at line {}".format(i + 1))
+                else:
+                    basket.append(bline)
+                    if c == b"\x04":
+                        yield first, basket, None
+                        basket = None
+                    continue
+            if c == b"\x02":
+                first = i
+                basket = [bline]
+            elif c == b"\x04" or (c in (b"L", b"T", b"H", b"F") and
+                                  bline[1:2] == b"\x1d"):
+                exc = RuntimeError("Wrong format at line {}".format(i + 1))
+                if rejects is None:
+                    raise exc
+                _ct1_reject(rejects, i, i, [bline], exc, encoding)
+    if basket is not None:
+        yield first, basket, None
+
+
+def _ct1_pairs(names, values, drop_unknown):
+    "pairs *(name, value)*, unknown fields are skipped if *drop_unknown* is True"
+    if drop_unknown:
+        return ((n, v) for n, v in zip(names, values) if n not in _ct1_unknown_names)
+    return zip(names, values)
+
+
+def _ct1_record(first, lines, encoding='ascii', drop_unknown=False):
+    """
+    Parses the lines of a basket returned by @see fn _ct1_baskets,
+    the output is the same as @see fn iter_ct1.
+
+    @param      first           index of the first line (for error messages)
+    @param      lines           lines of the basket (bytes)
+    @param      encoding        encoding
+    @param      drop_unknown    does not store the fields whose meaning
+                                is unknown (see @see fn ct1_unknown_column)
+    @return                     basket or None if the basket has no item
+                                or does not end with a line ``\\x04``
+    """
+    data = []
+    record = dict(data=data, tva=[])
+    if not drop_unknown:
+        for ii, info in enumerate(lines[0][1:].decode(encoding).split("\x1d")):
+            record['INFO%d' % ii] = info
+    for i, bline in enumerate(lines[1:], first + 1):
+        c = bline[:1]
+        if c == b"\x04":
+            record['BASKET'] = bline.decode(encoding).strip("\x04\x05")
+            if len(data) == 0:
+                return None
+            try:
+                _post_process(record)
+            except (KeyError, ValueError) as e:
+                raise ValueError("Unable to process one record line {}-{}\n{}\n-\n{}".format(
+                    first + 1, i + 1, pprint.pformat(record),
+                    "\n".join(h.decode(encoding) for h in lines))) from e
+            return record
+
+        if bline[1:2] != b"\x1d":
+            continue
+
+        if c == b"L":
+            obs = {'ITMANUAL': '0'}
+            obs.update(_ct1_pairs(_ct1_l_names, bline[2:].decode(encoding).split("\x1d"),
+                                  drop_unknown))
+            for n in _ct1_l_numbers:
+                if n in obs:
+                    obs[n] = _ct1_float(obs[n])
+            _add_item(data, obs)
+
+        elif c == b"T":
+            spl = bline[2:].decode(encoding).split("\x1d")
+            if spl[0] == '9' and len(spl) > 1:
+                for n, v in zip(_ct1_t9_names, spl[1:]):
+                    record[n] = _ct1_float(v)
+            else:
+                tva = {'TVAID': spl[0]}
+                for n, v in zip(_ct1_t_names, spl[1:]):
+                    try:
+                        tva[n] = _ct1_float(v)
+                    except ValueError:
+                        # _post_process checks the rate
+                        tva[n] = v
+                record['tva'].append(tva)
+
+        elif c == b"H":
+            record.update(_ct1_pairs(_ct1_h_names, bline[2:].decode(encoding).split("\x1d"),
+                                     drop_unknown))
+
+        elif c == b"F":
+            vtime = None
+            vdate = None
+            for n, v in zip(_ct1_f_names, bline[2:].decode(encoding).split("\x1d")):
+                if n == 'TOTAL-':
+                    record[n] = _ct1_float(v)
+                elif n == "TIME":
+                    vtime = v
+                elif n == "DATE":
+                    vdate = v
+                else:
+                    record[n] = v
+            record["DATETIME"] = _ct1_datetime(vdate, vtime)
+    return None
+
+
+def _ct1_parse_basket(first, lines, error, encoding='ascii', rejects=None,
+                      drop_unknown=False):
+    """
+    Parses a basket returned by @see fn _ct1_baskets
+    with @see fn _ct1_record.
+
+    @param      first           index of the first line
+    @param      lines           lines of the basket (bytes)
+    @param      error           None or the exception raised if the lines are valid
+    @param      encoding        encoding
+    @param      rejects         see @see fn _tokenize_ct1
+    @param      drop_unknown    see @see fn _ct1_record
+    @return                     basket or None
+    """
+    try:
+        record = _ct1_record(first, lines, encoding, drop_unknown=drop_unknown)
+        if error is not None:
+            raise error
+    except _ct1_errors as e:
+        if rejects is None:
+            raise
+        if error is not None or lines[-1][:1] == b"\x04":
+            # a basket truncated by the end of the file is ignored
+            _ct1_reject(rejects, first, first + len(lines) - 1, lines, e, encoding)
+        return None
+    return record
+
+
+def _tokenize_ct1(blocks, encoding='ascii', first_line=0, rejects=None,
+                  drop_unknown=False):
+    """
+    Tokenizes lines of a `CT1` file (bytes) into baskets,
+    the output is the same as @see fn iter_ct1.
+
+    @param      blocks          iterator on lists of lines (bytes)
+    @param      encoding        encoding
+    @param      first_line      index of the first line (for error messages)
+    @param      rejects         None to raise an exception on the first
+                                malformed basket, a list otherwise, the malformed
+                                baskets are skipped and added to this list
+                                (see @see fn read_ct1)
+    @param      drop_unknown    see @see fn _ct1_record
+    @return                     iterator on baskets
+    """
+    for first, lines, error in _ct1_baskets(blocks, first_line=first_line,
+                                            rejects=rejects, encoding=encoding):
+        record = _ct1_parse_basket(first, lines, error, encoding=encoding,
+                                   rejects=rejects, drop_unknown=drop_unknown)
+        if record is not None:
+            yield record
+
+
+def iter_ct1_bytes(content, encoding='ascii'):
+    """
+    Parses `CT1` content given as bytes (or any object supporting
+    the buffer protocol such as a `memoryview` or a `mmap`)
+    and yields every basket. The content is split into lines
+    as bytes, lines are grouped into baskets by @see fn _ct1_baskets
+    and every basket is parsed by @see fn _ct1_record,
+    amounts are converted with `float` which ignores the padding spaces.
+    The output is the same as @see fn iter_ct1.
+
+    @param      content     bytes
+    @param      encoding    encoding
+    @return                 iterator on baskets (dictionaries)
+    """
+    if not isinstance(content, bytes):
+        content = bytes(content)
+    return _tokenize_ct1([_split_byte_lines(content)], encoding=encoding)
+
+
+#: columns always stored as float in the dataframe
+_ct1_float_columns = {'CAT', 'ERROR', 'HT', 'ITPRICE', 'ITUNIT', 'NEG',
+                      'TOTAL', 'TVA', 'TVARATE'}
+
+
+#: types of the columns of the dataframe returned by
+#: @see fn read_ct1 with *typed=True*, strings repeated
+#: on many rows become categories, amounts are stored as float32
+CT1_SCHEMA = dict(
+    BASKET='category', CAT='int8', DATETIME='datetime64[s]', ERROR='float32',
+    FCODE='category', FCODE1='category', FCODE2='category', HT='float32',
+    ITCODE='category', ITMANUAL='category', ITNAME='category',
+    ITPRICE='float32', ITQU='float32', ITUNIT='float32',
+    NAME='category', NB1='category', NB2='category', NEG='int8',
+    PIECE='bool', PLACE='category', STREET='category', TOTAL='float32',
+    TVA='float32', TVAID='category', TVARATE='float32', ZIPCODE='category')
+
+_ct1_unknown = re.compile("^(IT[0-9]+|INFO.*)$")
+
+
+def ct1_unknown_column(name):
+    """
+    Tells if a column of the dataframe returned by @see fn read_ct1
+    has an unknown meaning (*IT1*, *IT2*, ..., *INFO0*, *INFOL2*, ...),
+    these columns are categories if the dataframe is typed.
+
+    @param      name        column name
+    @return                 boolean
+    """
+    return _ct1_unknown.match(name) is not None
+
+
+#: fields of the lines ``L`` and ``H`` whose meaning is unknown
+_ct1_unknown_names = frozenset(
+    n for n in _ct1_l_names + _ct1_h_names if ct1_unknown_column(n))
+
+
+def _ct1_dtype(name):
+    "returns the type of a column of a typed dataframe (see *CT1_SCHEMA*)"
+    return CT1_SCHEMA.get(name, 'category' if ct1_unknown_column(name) else None)
+
+
+def _ct1_typed(values, dtype):
+    """
+    Converts a column into an array with type *dtype*,
+    a column of integers or booleans with missing values becomes
+    a nullable array (``Int8``, ``boolean``).
+
+    @param      values      list, array or series
+    @param      dtype       type (see *CT1_SCHEMA*)
+    @return                 array or categorical
+    """
+    import pandas
+    if dtype == 'category':
+        return pandas.Categorical(values)
+    if dtype.startswith('datetime64'):
+        return pandas.to_datetime(pandas.Series(values)).to_numpy().astype(dtype)
+    arr = numpy.array(values, dtype=numpy.float64)
+    if dtype in ('int8', 'bool') and numpy.isnan(arr).any():
+        return pandas.array(arr, dtype='Int8').astype(
+            'Int8' if dtype == 'int8' else 'boolean')
+    return arr.astype(dtype)
+
+
+class _CT1Columns:
+    """
+    Stores baskets column by column, one row per item.
+    Item values are appended to one list per column,
+    basket values are stored once per basket and repeated
+    for every item when the dataframe is built.
+    """
+
+    def __init__(self):
+        self.order = {}
+        self.items = {}
+        self.baskets = {}
+        self.counts = []
+        self.n_items = 0
+
+    def add_item(self, d):
+        "adds one item (a dictionary)"
+        self.add_items({k: [v] for k, v in d.items()}, 1)
+
+    def add_items(self, values, count):
+        """
+        Adds *count* items sharing the same keys,
+        *values* maps every key to a list.
+        """
+        items = self.items
+        for k, v in values.items():
+            if k not in items:
+                items[k] = [numpy.nan] * self.n_items
+                if k not in self.order:
+                    self.order[k] = len(self.order)
+            items[k].extend(v)
+        self.n_items += count
+        if len(values) < len(items):
+            for col in items.values():
+                if len(col) < self.n_items:
+                    col.extend([numpy.nan] * (self.n_items - len(col)))
+
+    def add_baskets(self, values, counts):
+        """
+        Adds baskets sharing the same keys, *values* maps every key
+        to a list, *counts* is the number of items of every basket,
+        the items must be added first, the column order is the one
+        of a dataframe built from a list of rows.
+        """
+        baskets = self.baskets
+        n_basket = len(self.counts)
+        for k, v in values.items():
+            if k not in self.order:
+                self.order[k] = len(self.order)
+            if k not in baskets:
+                baskets[k] = [numpy.nan] * n_basket
+            baskets[k].extend(v)
+        self.counts.extend(counts)
+        if len(values) < len(baskets):
+            for col in baskets.values():
+                if len(col) < len(self.counts):
+                    col.extend([numpy.nan] * (len(self.counts) - len(col)))
+
+    def add_record(self, record):
+        "adds a basket returned by @see fn iter_ct1"
+        data = record['data']
+        for i, d in enumerate(data):
+            self.add_item(d)
+            if i == 0:
+                # same column order as a dataframe built
+                # from a list of rows
+                for k in record:
+                    if k not in self.order and k not in ('data', 'tva'):
+                        self.order[k] = len(self.order)
+        self.add_baskets({k: [v] for k, v in record.items()
+                          if k not in ('data', 'tva')}, [len(data)])
+
+    def extend(self, other):
+        """
+        Appends the baskets of another store, the result is the same
+        as a store filled with the baskets of both stores.
+        """
+        for k in sorted(other.order, key=lambda k: other.order[k]):
+            if k not in self.order:
+                self.order[k] = len(self.order)
+        if other.n_items > 0:
+            self.add_items(other.items, other.n_items)
+        if other.counts:
+            self.add_baskets(other.baskets, other.counts)
+
+    def to_dataframe(self, typed=False):
+        """
+        Builds the dataframe.
+
+        @param      typed           uses the types defined in *CT1_SCHEMA*
+        @return                     dataframe
+        """
+        import pandas
+        items = self.items
+        counts = numpy.array(self.counts, dtype=numpy.int64)
+        columns = {}
+        for k in sorted(self.order, key=lambda k: self.order[k]):
+            dtype = _ct1_dtype(k) if typed else None
+            if dtype is not None and k in self.baskets and k not in items:
+                # converted once per basket
+                col = _ct1_typed(self.baskets[k], dtype)
+                if isinstance(col, pandas.Categorical):
+                    col = pandas.Categorical.from_codes(
+                        numpy.repeat(col.codes, counts), dtype=col.dtype)
+                else:
+                    col = col.repeat(counts)
+            elif k in self.baskets:
+                col = pandas.Series(self.baskets[k]).repeat(counts)
+                col = col.reset_index(drop=True)
+                if k in items:
+                    # values coming from the basket override
+                    # the values coming from the items
+                    col = col.where(~col.isna(), pandas.Series(items[k]))
+            elif k in _ct1_float_columns:
+                col = numpy.array(items[k], dtype=numpy.float64)
+            else:
+                col = pandas.Series(items[k])
+            if dtype is not None and k in items:
+                col = _ct1_typed(col, dtype)
+            columns[k] = col
+        return pandas.DataFrame(columns, copy=False)
+
+
+def _ct1_concat_column(parts, dtype):
+    """
+    Concatenates the pieces of a column of typed dataframes,
+    an integer stands for as many missing values.
+    The result is the same as the column typed at once
+    by @see fn _ct1_typed.
+    """
+    import pandas
+    present = [p for p in parts if not isinstance(p, int)]
+    if dtype == 'category':
+        cats = [p.categories for p in present if len(p.categories) > 0]
+        cats = cats[0].append(cats[1:]).unique() if cats else present[0].categories
+        try:
+            cats = cats.sort_values()
+        except TypeError:  # pragma: no cover
+            pass
+        codes = [numpy.full(p, -1, dtype=numpy.int64) if isinstance(p, int)
+                 else p.set_categories(cats).codes for p in parts]
+        return pandas.Categorical.from_codes(
+            numpy.concatenate(codes), dtype=pandas.CategoricalDtype(cats))
+    if dtype is None:
+        return pandas.concat(
+            [pandas.Series([numpy.nan] * p) if isinstance(p, int) else pandas.Series(p)
+             for p in parts], ignore_index=True)
+    if dtype.startswith('datetime64'):
+        return numpy.concatenate([numpy.full(p, 'NaT', dtype=dtype) if isinstance(p, int)
+                                  else numpy.asarray(p, dtype=dtype) for p in parts])
+    # missing values make integers and booleans nullable
+    return _ct1_typed(numpy.concatenate(
+        [numpy.full(p, numpy.nan) if isinstance(p, int)
+         else pandas.Series(p).to_numpy(dtype=numpy.float64, na_value=numpy.nan)
+         for p in parts]), dtype)
+
+
+def _ct1_concat(frames):
+    """
+    Concatenates typed dataframes built by @see me _CT1Columns.to_dataframe,
+    the categories are merged, the result is the same as the dataframe
+    of all the baskets typed at once.
+
+    @param      frames      list of dataframes
+    @return                 dataframe
+    """
+    import pandas
+    if len(frames) == 0:
+        return pandas.DataFrame({})
+    if len(frames) == 1:
+        return frames[0]
+    names = {}
+    for df in frames:
+        for k in df.columns:
+            if k not in names:
+                names[k] = len(names)
+    columns = {}
+    for k in names:
+        parts = [df[k].values if k in df.columns else df.shape[0] for df in frames]
+        columns[k] = _ct1_concat_column(parts, _ct1_dtype(k))
+    return pandas.DataFrame(columns, copy=False)
+
+
+#: number of items a @see cl _CT1Frames stores before it converts them
+#: into a typed dataframe
+_ct1_frame_items = 2 ** 16
+
+
+class _CT1Frames:
+    """
+    Gathers the baskets parsed block by block. If *typed* is True,
+    the values are converted into a typed dataframe once there are
+    more than *_ct1_frame_items* items, the untyped values of the whole
+    file are never held in memory, dataframes are concatenated
+    by @see fn _ct1_concat.
+    """
+
+    def __init__(self, typed=False):
+        self.typed = typed
+        self.store = _CT1Columns()
+        self.frames = []
+
+    def flush(self):
+        "converts the stored values into a typed dataframe"
+        if self.store.counts:
+            self.frames.append(self.store.to_dataframe(typed=True))
+            self.store = _CT1Columns()
+
+    def _check(self):
+        "converts the stored values if there are too many"
+        if self.typed and self.store.n_items >= _ct1_frame_items:
+            self.flush()
+
+    def add_record(self, record):
+        "adds a basket returned by @see fn iter_ct1"
+        self.store.add_record(record)
+        self._check()
+
+    def extend(self, other):
+        "appends a @see cl _CT1Columns or another @see cl _CT1Frames"
+        if isinstance(other, _CT1Frames):
+            if other.frames:
+                self.flush()
+                self.frames.extend(other.frames)
+            other = other.store
+        self.store.extend(other)
+        self._check()
+
+    def to_dataframe(self):
+        "builds the dataframe"
+        if not self.typed:
+            return self.store.to_dataframe()
+        self.flush()
+        return _ct1_concat(self.frames)
+
+
+def _ct1_columns(records):
+    """
+    Stores baskets column by column.
+
+    @param      records     iterator on baskets, see @see fn iter_ct1
+    @return                 @see cl _CT1Columns
+    """
+    store = _CT1Columns()
+    for record in records:
+        store.add_record(record)
+    return store
+
+
+def _ct1_frames(records, typed=False):
+    """
+    Stores baskets column by column, see @see cl _CT1Frames.
+
+    @param      records     iterator on baskets, see @see fn iter_ct1
+    @param      typed       converts the values while the baskets are added
+    @return                 @see cl _CT1Frames
+    """
+    frames = _CT1Frames(typed)
+    for record in records:
+        frames.add_record(record)
+    return frames
+
+
+def _ct1_to_dataframe(records):
+    """
+    Converts baskets into a dataframe, one row per item.
+
+    @param      records     iterator on baskets, see @see fn iter_ct1
+    @return                 dataframe
+    """
+    return _ct1_columns(records).to_dataframe()
+
+
+def _ct1_numbers(col):
+    "converts a column of amounts into an array"
+    try:
+        return numpy.array(col, dtype=numpy.float64)
+    except ValueError:
+        return numpy.array([_ct1_float(v) for v in col], dtype=numpy.float64)
+
+
+def _ct1_widths(lines):
+    "returns the number of fields of every line"
+    return numpy.fromiter(map(operator.methodcaller('count', b"\x1d"), lines),
+                          dtype=numpy.int64, count=len(lines)) + 1
+
+
+def _ct1_fields(lines, width, encoding):
+    """
+    Splits lines having the same number of fields at once,
+    returns one list per field.
+    """
+    if len(lines) == 0:
+        return [[] for i in range(width)]
+    fields = b"\x1d".join(lines).decode(encoding).split("\x1d")
+    return [fields[j::width] for j in range(width)]
+
+
+def _ct1_columns_bytes(lines, encoding='ascii', first_line=0, rejects=None,
+                       drop_unknown=False):
+    """
+    Stores the baskets of the lines (bytes) of a `CT1` file
+    without creating one dictionary per item or per basket.
+    Baskets are found by @see fn _ct1_baskets, lines are sorted by type,
+    lines of the same type are split at once and amounts are converted
+    column by column with :epkg:`numpy`. A basket the vectorized path
+    does not handle (a manually changed total, an item whose price is not
+    the product of the quantity and the unit price, a missing tax rate,
+    unexpected lines or fields...) is parsed by @see fn _ct1_parse_basket.
+
+    @param      lines           list of lines (bytes)
+    @param      encoding        encoding
+    @param      first_line      index of the first line (for error messages)
+    @param      rejects         see @see fn _tokenize_ct1
+    @param      drop_unknown    see @see fn _ct1_record
+    @return                     @see cl _CT1Columns or None if a line is outside
+                                any basket or if no basket has an item,
+                                the caller should use @see fn _tokenize_ct1
+                                which raises the exceptions in the order of the lines
+    """
+    outside = []
+    baskets = list(_ct1_baskets([lines], first_line=first_line, rejects=outside,
+                                encoding=encoding))
+    nb = len(baskets)
+    if outside or nb == 0:
+        return None
+
+    items = []
+    los, his = [], []
+    info = [blines[0] for _, blines, __ in baskets]
+    closes = [blines[-1] for _, blines, __ in baskets]
+    heads, sums, foots = [None] * nb, [None] * nb, [None] * nb
+    rates = []
+    regular = []
+    try:
+        for b, (_, blines, error) in enumerate(baskets):
+            los.append(len(items))
+            basket_rates = {}
+            rates.append(basket_rates)
+            # a regular basket has one line H, one line T 9, one line F
+            # in that order
+            order = b""
+            if error is None and closes[b][:1] == b"\x04":
+                for bline in itertools.islice(blines, 1, len(blines) - 1):
+                    head = bline[:2]
+                    if head == b"L\x1d":
+                        items.append(bline)
+                        continue
+                    if head[1:] != b"\x1d":
+                        continue
+                    c = head[0]
+                    if c == 84:  # T
+                        if bline[2:4] == b"9\x1d":
+                            sums[b] = bline
+                            order += b"T"
+                        else:
+                            spl = bline[2:].decode(encoding).split("\x1d")
+                            try:
+                                basket_rates[spl[0]] = _ct1_float(spl[1])
+                            except (IndexError, ValueError):
+                                # the basket is parsed by _ct1_parse_basket
+                                basket_rates[spl[0]] = None
+                    elif c == 72:  # H
+                        heads[b] = bline
+                        order += b"H"
+                    elif c == 70:  # F
+                        foots[b] = bline
+                        order += b"F"
+            his.append(len(items))
+            regular.append(order == b"HTF")
+    except ValueError:
+        return None
+
+    counts = numpy.array(his, dtype=numpy.int64) - numpy.array(los, dtype=numpy.int64)
+    keep = counts > 0
+    if not keep.any():
+        return None
+    regular = numpy.array(regular, dtype=numpy.bool_) & keep
+    selected = [heads, sums, foots, info, closes]
+
+    item_widths = _ct1_widths(items)
+    item_lo = numpy.array(los, dtype=numpy.int64)
+    if not regular.any():
+        width = 0
+    else:
+        width = numpy.bincount(item_widths[numpy.repeat(regular, counts)]).argmax()
+        regular[keep] &= ~numpy.logical_or.reduceat(
+            item_widths != width, item_lo[keep])
+
+    widths = []
+    for blines in selected[:4]:
+        if not regular.any():
+            break
+        w = numpy.zeros(nb, dtype=numpy.int64)
+        w[regular] = _ct1_widths([blines[j] for j in numpy.flatnonzero(regular).tolist()])
+        ref = numpy.bincount(w[regular]).argmax()
+        regular &= w == ref
+        widths.append(ref)
+
+    if regular.any():
+        # items of the regular baskets
+        n = min(width - 1, len(_ct1_l_names))
+        rb = numpy.flatnonzero(regular)
+        rcounts = counts[rb]
+        rlos = numpy.zeros(rb.shape[0] + 1, dtype=numpy.int64)
+        numpy.cumsum(rcounts, out=rlos[1:])
+        if n <= _ct1_l_names.index('NEG') or widths[1] < 5 or widths[2] < 5:
+            # _add_item or _post_process raises an exception
+            return None
+        try:
+            fields = _ct1_fields(list(itertools.compress(
+                items, numpy.repeat(regular, counts).tolist())), width, encoding)
+            cols = dict(_ct1_pairs(_ct1_l_names[:n], fields[1:], drop_unknown))
+            del fields
+
+            # same computation as _add_item
+            unit = _ct1_numbers(cols['ITUNIT'])
+            qu = _ct1_numbers(cols['ITQU'])
+            cat = _ct1_numbers(cols['CAT'])
+            price = _ct1_numbers(cols['ITPRICE'])
+            neg = _ct1_numbers(cols['NEG'])
+
+            bcols = {}
+            bl = [[blines[j] for j in rb.tolist()] for blines in selected]
+            if not drop_unknown:
+                fields = _ct1_fields(bl[3], widths[3], encoding)
+                bcols.update(zip(_ct1_info_names, fields))
+                bcols['INFO0'] = [v[1:] for v in bcols['INFO0']]
+                if widths[3] > len(_ct1_info_names):
+                    for j in range(len(_ct1_info_names), widths[3]):
+                        bcols['INFO%d' % j] = fields[j]
+            fields = _ct1_fields(bl[0], widths[0], encoding)
+            bcols.update(_ct1_pairs(_ct1_h_names, fields[1:], drop_unknown))
+            fields = _ct1_fields(bl[1], widths[1], encoding)
+            bcols.update(zip(_ct1_t9_names, map(_ct1_numbers, fields[2:])))
+            fields = _ct1_fields(bl[2], widths[2], encoding)
+            fcols = dict(zip(_ct1_f_names, fields[1:]))
+            for k, v in fcols.items():
+                if k == 'TOTAL-':
+                    bcols[k] = _ct1_numbers(v)
+                elif k not in ('DATE', 'TIME'):
+                    bcols[k] = v
+            bcols['DATETIME'] = list(map(_ct1_datetime, fcols['DATE'], fcols['TIME']))
+            bcols['BASKET'] = [v.strip("\x04\x05") for v in
+                               b"\n".join(bl[4]).decode(encoding).split("\n")]
+        except ValueError:
+            return None
+
+        piece = cat == 2
+        qu = numpy.where(piece, numpy.trunc(qu * 1000), qu)
+        if not numpy.isfinite(qu[piece]).all():
+            return None
+        negative = neg != 0
+        unit = numpy.where(negative, unit * -1, unit)
+        price = numpy.where(negative, price * -1, price)
+        diff = numpy.abs(qu * unit - price)
+        bad = numpy.logical_or.reduceat(diff >= 0.01, rlos[:-1])
+
+        # same computation as _post_process
+        price_list = price.tolist()
+        tvaids = cols['TVAID']
+        rate = []
+        total = []
+        for j, b in enumerate(rb.tolist()):
+            lo, hi = rlos[j], rlos[j + 1]
+            total.append(sum(price_list[lo:hi]))
+            basket_rates = list(map(rates[b].get, tvaids[lo:hi]))
+            if None in basket_rates:
+                bad[j] = True
+                basket_rates = [numpy.nan] * (hi - lo)
+            rate.extend(basket_rates)
+        total = numpy.array(total, dtype=numpy.float64)
+        bad |= numpy.abs(bcols.pop('TOTAL-') - total) >= 0.01
+        bad |= numpy.abs(bcols.pop('TOTAL_') - total) >= 0.01
+        regular[rb[bad]] = False
+        rate = numpy.array(rate, dtype=numpy.float64)
+        tva = price * rate / 100
+        bcols['HT'] = bcols['HT'].tolist()
+        bcols['TVA'] = bcols['TVA'].tolist()
+        bcols['TOTAL'] = total.tolist()
+
+        qu_list = qu.tolist()
+        for j in numpy.flatnonzero(piece).tolist():
+            qu_list[j] = int(qu_list[j])
+        values = {'ITMANUAL': None}
+        values.update(cols)
+        values.update(ITUNIT=unit.tolist(), ITQU=qu_list, CAT=cat.tolist(),
+                      ITPRICE=price_list, NEG=neg.tolist(), PIECE=piece.tolist(),
+                      TVARATE=rate.tolist(), TVA=tva.tolist())
+        # position of every basket among the regular ones
+        rindex = numpy.zeros(nb, dtype=numpy.int64)
+        rindex[regular] = numpy.flatnonzero(~bad)
+
+    # a basket with no item is parsed by _ct1_parse_basket,
+    # it is not returned but its lines may raise an exception
+    store = _CT1Columns()
+    regular = regular.tolist()
+    b = 0
+    while b < nb:
+        if not regular[b]:
+            rec = _ct1_parse_basket(*baskets[b], encoding=encoding, rejects=rejects,
+                                    drop_unknown=drop_unknown)
+            if rec is not None:
+                store.add_record(rec)
+            b += 1
+            continue
+        # consecutive baskets processed by the vectorized path
+        e = b
+        while e < nb and regular[e]:
+            e += 1
+        c0, c1 = rindex[b], rindex[e - 1] + 1
+        lo, hi = rlos[c0], rlos[c1]
+        store.add_items({k: (['0'] * (hi - lo) if v is None else v[lo:hi])
+                         for k, v in values.items()}, hi - lo)
+        store.add_baskets({k: v[c0:c1] for k, v in bcols.items()},
+                          rcounts[c0:c1].tolist())
+        b = e
+    return store
+
+
+def _ct1_columns_lines(lines, encoding='ascii', first_line=0, rejects=None,
+                       drop_unknown=False):
+    """
+    Stores the baskets of the lines (bytes) of a `CT1` file with
+    @see fn _ct1_columns_bytes or @see fn _tokenize_ct1 if the first
+    one cannot process the lines.
+    """
+    store = _ct1_columns_bytes(lines, encoding=encoding, first_line=first_line,
+                               rejects=rejects, drop_unknown=drop_unknown)
+    if store is None:
+        store = _ct1_columns(_tokenize_ct1([lines], encoding=encoding,
+                                           first_line=first_line, rejects=rejects,
+                                           drop_unknown=drop_unknown))
+    return store
+
+
+def _ascii_compatible(encoding):
+    "tells if the delimiters of the format are encoded as single bytes"
+    return "\x02\x04\x1dLTHF\r\n".encode(encoding) == b"\x02\x04\x1dLTHF\r\n"
+
+
+def _is_filename(file_or_str):
+    "tells if *file_or_str* is an existing filename"
+    return (isinstance(file_or_str, str) and len(file_or_str) < 4000 and
+            os.path.exists(file_or_str))
+
+
+#: size of the blocks read from a file or a binary stream,
+#: the memory used to parse a file does not depend on its size
+_ct1_block_size = 2 ** 24
+
+
+def _iter_file_lines(filename):
+    "reads a file by blocks of lines (bytes), see @see fn _iter_byte_lines"
+    with open(filename, "rb") as f:
+        yield from _iter_byte_lines(f, block_size=_ct1_block_size)
+
+
+def _ct1_blocks(file_or_str, encoding='ascii'):
+    """
+    Returns an iterator on blocks of lines (bytes) of a file, a binary stream,
+    bytes or a string, None for a text stream. Files and binary streams
+    are read by blocks (see @see fn _iter_byte_lines). Files and bytes
+    are split like a file opened in text mode, streams and strings like
+    @see fn iter_ct1 does.
+    """
+    if isinstance(file_or_str, bytes):
+        return [_split_byte_lines(file_or_str)]
+    if isinstance(file_or_str, (bytearray, memoryview)):
+        return [_split_byte_lines(bytes(file_or_str))]
+    if hasattr(file_or_str, 'read'):
+        if isinstance(file_or_str, io.TextIOBase):
+            return None
+        return _iter_byte_lines(file_or_str, block_size=_ct1_block_size,
+                                universal=False)
+    if len(file_or_str) < 4000 and os.path.exists(file_or_str):
+        return _iter_file_lines(file_or_str)
+    return [_split_byte_lines(file_or_str.encode(encoding), universal=False)]
+
+
+def _ct1_columns_blocks(blocks, encoding='ascii', first_line=0, rejects=None,
+                        typed=False, drop_unknown=False):
+    """
+    Stores the baskets of blocks of lines (bytes) of a `CT1` file
+    with @see fn _ct1_columns_lines. A block is cut after its last line
+    ``\\x04``, the following lines are processed with the next block,
+    only one block and one basket are held in memory at the same time.
+
+    @param      blocks          iterator on lists of lines (bytes)
+    @param      encoding        encoding
+    @param      first_line      index of the first line (for error messages)
+    @param      rejects         see @see fn _tokenize_ct1
+    @param      typed           converts the values block by block,
+                                see @see cl _CT1Frames
+    @param      drop_unknown    see @see fn _ct1_record
+    @return                     @see cl _CT1Frames
+    """
+    store = _CT1Frames(typed)
+    pending = []
+    for lines in blocks:
+        if pending:
+            pending.extend(lines)
+            lines = pending
+        cut = len(lines)
+        while cut > 0 and lines[cut - 1][:1] != b"\x04":
+            cut -= 1
+        if cut == 0:
+            pending = lines
+            continue
+        pending = lines[cut:]
+        del lines[cut:]
+        store.extend(_ct1_columns_lines(lines, encoding=encoding,
+                                        first_line=first_line, rejects=rejects,
+                                        drop_unknown=drop_unknown))
+        first_line += cut
+    if pending:
+        store.extend(_ct1_columns_lines(pending, encoding=encoding,
+                                        first_line=first_line, rejects=rejects,
+                                        drop_unknown=drop_unknown))
+    return store
+
+
+def _iter_ct1_fast(file_or_str, encoding='ascii', rejects=None, drop_unknown=False):
+    """
+    Parses a file, a binary stream, bytes or a string with
+    @see fn _tokenize_ct1, a file is read by blocks,
+    a text stream line by line as @see fn iter_ct1 does.
+    """
+    blocks = _ct1_blocks(file_or_str, encoding=encoding)
+    if blocks is None:
+        yield from _tokenize_ct1([_ct1_stream_lines(file_or_str, encoding)],
+                                 encoding='utf-8', rejects=rejects,
+                                 drop_unknown=drop_unknown)
+        return
+    yield from _tokenize_ct1(blocks, encoding=encoding, rejects=rejects,
+                             drop_unknown=drop_unknown)
+
+
+#: end of a basket (line ``\x04``) followed by the beginning
+#: of the next one (line ``\x02``)
+_ct1_split = re.compile(rb"(?:^|(?<=[\r\n]))\x04[^\r\n]*(?:\r\n|\r|\n)(?=\x02)")
+
+
+def _ct1_chunks(content, chunk_size):
+    """
+    Splits the content of a `CT1` file into chunks of about *chunk_size*
+    bytes. A chunk ends after the line ``\x04`` closing a basket and the next
+    one starts with the line ``\x02`` opening the following basket,
+    a basket never spans two chunks.
+
+    @param      content     bytes or `mmap`
+    @param      chunk_size  minimum size of a chunk
+    @return                 list of *(begin, end)*
+    """
+    size = len(content)
+    bounds = []
+    begin = 0
+    while begin < size:
+        end = size
+        if begin + chunk_size < size:
+            found = _ct1_split.search(content, begin + chunk_size)
+            if found is not None:
+                end = found.end()
+        bounds.append((begin, end))
+        begin = end
+    return bounds
+
+
+def _ct1_count_lines(content, begin, end, block_size=2 ** 24):
+    """
+    Counts the line breaks between two offsets as a file opened
+    in text mode does (``\r\n``, ``\r``, ``\n``).
+    """
+    n = 0
+    for b in range(begin, end, block_size):
+        e = min(b + block_size, end)
+        # one more byte to count a \r\n starting at the end of the block
+        block = content[b:min(e + 1, end)]
+        n += (block.count(b"\n", 0, e - b) + block.count(b"\r", 0, e - b) -
+              block.count(b"\r\n"))
+    return n
+
+
+def _read_ct1_chunk(filename, begin, end, encoding, as_df, first_line,
+                    tolerant=False, typed=False, drop_unknown=False):
+    """
+    Parses a chunk of a `CT1` file, see @see fn _read_ct1_parallel.
+
+    @return     *(results, rejects)*, results is a @see cl _CT1Frames
+                if *as_df* is True (typed dataframes if *typed* is True),
+                a list of baskets otherwise,
+                rejects is None if *tolerant* is False
+    """
+    with open(filename, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            lines = _split_byte_lines(mm[begin:end])
+    rejects = [] if tolerant else None
+    if as_df:
+        res = _CT1Frames(typed)
+        res.extend(_ct1_columns_lines(lines, encoding=encoding, first_line=first_line,
+                                      rejects=rejects, drop_unknown=drop_unknown))
+        if typed:
+            # typed values are smaller to send back to the main process
+            res.flush()
+    else:
+        res = list(_tokenize_ct1([lines], encoding=encoding, first_line=first_line,
+                                 rejects=rejects, drop_unknown=drop_unknown))
+    return res, rejects
+
+
+def _read_ct1_parallel(filename, encoding='ascii', as_df=True,
+                       n_jobs=None, chunk_size=None, rejects=None,
+                       typed=False, drop_unknown=False):
+    """
+    Memory-maps a `CT1` file, splits it into chunks (see @see fn _ct1_chunks)
+    and parses them in parallel processes, the results are concatenated
+    in the order of the file and are the same as a single process would get.
+
+    @param      filename        filename
+    @param      encoding        encoding
+    @param      as_df           returns a dataframe or a list of baskets
+    @param      n_jobs          number of processes, None or -1 for the number of cores
+    @param      chunk_size      size of a chunk in bytes, None to get four
+                                chunks per process
+    @param      rejects         see @see fn _tokenize_ct1
+    @param      typed           see @see fn _ct1_columns_blocks
+    @param      drop_unknown    see @see fn _ct1_record
+    @return                     @see cl _CT1Frames if *as_df* is True, a list otherwise
+    """
+    if n_jobs is None or n_jobs <= 0:
+        n_jobs = os.cpu_count() or 1
+    tolerant = rejects is not None
+    store = _CT1Frames(typed)
+    records = []
+
+    def collect(res):
+        "adds the results of a chunk"
+        res, rej = res
+        if as_df:
+            store.extend(res)
+        else:
+            records.extend(res)
+        if rej:
+            rejects.extend(rej)
+
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if chunk_size is None:
+                    chunk_size = max(size // (n_jobs * 4), 2 ** 20)
+                bounds = _ct1_chunks(mm, chunk_size)
+                n_jobs = min(n_jobs, len(bounds))
+                first_line = 0
+                if n_jobs <= 1:
+                    for begin, end in bounds:
+                        collect(_read_ct1_chunk(filename, begin, end, encoding,
+                                                as_df, first_line, tolerant,
+                                                typed, drop_unknown))
+                        first_line += _ct1_count_lines(mm, begin, end)
+                else:
+                    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                        # at most 2 * n_jobs chunks are parsed at the same time
+                        pending = []
+                        for begin, end in bounds:
+                            pending.append(executor.submit(
+                                _read_ct1_chunk, filename, begin, end,
+                                encoding, as_df, first_line, tolerant,
+                                typed, drop_unknown))
+                            first_line += _ct1_count_lines(mm, begin, end)
+                            if len(pending) >= 2 * n_jobs:
+                                collect(pending.pop(0).result())
+                        for fut in pending:
+                            collect(fut.result())
+    if as_df:
+        return store
+    return records
+
+
+def save_ct1_rejects(rejects, filename):
+    """
+    Saves rejected baskets (see @see fn read_ct1) in a file,
+    one :epkg:`json` dictionary per line, the exception is converted
+    into a string ``'<type>: <message>'``.
+
+    @param      rejects     list of rejected baskets
+    @param      filename    filename
+    """
+    import json
+    with open(filename, "w", encoding="utf-8") as f:
+        for rej in rejects:
+            rej = rej.copy()
+            err = rej['error']
+            if isinstance(err, Exception):
+                rej['error'] = "{}: {}".format(type(err).__name__, err)
+            f.write(json.dumps(rej))
+            f.write("\n")
+
+
+def _ct1_rejects(res, found, errors, rejects, file_or_str):
+    """
+    Returns the results of @see fn read_ct1 and stores
+    the rejected baskets in *rejects*.
+    """
+    if errors != 'collect':
+        return res
+    if _is_filename(file_or_str):
+        for rej in found:
+            rej['file'] = file_or_str
+    if rejects is None:
+        return res, found
+    if isinstance(rejects, list):
+        rejects.extend(found)
+    else:
+        save_ct1_rejects(found, rejects)
+    return res
+
+
+def read_ct1(file_or_str, encoding='ascii', as_df=True, engine='bytes',
+             n_jobs=1, chunk_size=None, baskets=None, start=None, end=None,
+             index=None, errors='raise', rejects=None, typed=False,
+             drop_unknown=False):
     """
     Parses a file or a string which follows a specific
     format called `CT1`.
     See function @see fn dummy_ct1 for an example.
 
-    @param      file_or_str     file or string
+    @param      file_or_str     file, file object or string
     @param      encoding        encoding
     @param      as_df           returns the results as a dataframe
+    @param      engine          ``'bytes'`` (see @see fn iter_ct1_bytes) or
+                                ``'text'`` (see @see fn iter_ct1), both parse
+                                baskets with the same functions and return
+                                the same results, the first one is faster,
+                                the second one reads the file as text
+                                and accepts any encoding
+    @param      n_jobs          if different from 1 and *file_or_str* is a filename,
+                                the file is memory-mapped, split into chunks
+                                and the chunks are parsed by *n_jobs* processes
+                                (None or -1 for the number of cores),
+                                only with engine ``'bytes'``
+    @param      chunk_size      size of a chunk in bytes if *n_jobs* is not 1,
+                                None for four chunks per process
+    @param      baskets         basket id or list of basket ids to parse,
+                                None for all
+    @param      start           parses only the baskets on or after this date
+    @param      end             parses only the baskets before this date
+    @param      index           sidecar file of the index used when *baskets*,
+                                *start* or *end* is specified,
+                                see @see fn build_ct1_index
+    @param      errors          ``'raise'`` raises an exception on the first
+                                malformed basket, ``'skip'`` skips the malformed
+                                baskets, ``'collect'`` skips them and stores them
+                                in *rejects*, only with engine ``'bytes'``
+    @param      rejects         receives the malformed baskets if *errors* is
+                                ``'collect'``, a list or a filename
+                                (see @see fn save_ct1_rejects), if None, the
+                                function returns *(results, rejects)*
+    @param      typed           the dataframe follows the types defined
+                                in *CT1_SCHEMA*, strings are categories,
+                                amounts are float32, values are converted
+                                while the file is parsed
+    @param      drop_unknown    the fields whose meaning is unknown
+                                (see @see fn ct1_unknown_column) are skipped
+                                when the lines are parsed, the baskets
+                                or the dataframe do not contain them
     @return                     dataframe
 
     Meaning of the columns:
@@ -69,221 +1461,72 @@ def read_ct1(file_or_str, encoding='ascii', as_df=True):
     * TVAID: tax id
     * TVARATE: tax rate
     * ERROR: check this line later
-    """
-    if len(file_or_str) < 4000 and os.path.exists(file_or_str):
-        with open(file_or_str, encoding=encoding) as f:
-            content = f.read()
-
-    def _post_process(rec):
-        manual = [o for o in rec['data'] if o['ITMANUAL'] == '1']
-        if len(manual) > 1:
-            raise ValueError(  # pragma: no cover
-                "More than one manual item.")
-        is_manual = len(manual) == 1
-
-        total = sum(obs['ITPRICE'] for obs in rec['data'])
-        if is_manual:
-            diff = record['TOTAL-'] - total
-            new_obs = {'CAT': 2.0, 'ERROR': 0.0,
-                       'ITCODE': '30002X',
-                       'ITMANUAL': '2',
-                       'ITPRICE': diff,
-                       'ITQU': 1,
-                       'ITUNIT': abs(diff),
-                       'NEG': 1 if diff < 0 else 0,
-                       'PIECE': True, 'TVAID': manual[0]['TVAID']}
-            rec['data'].append(new_obs)
-            total = sum(obs['ITPRICE'] for obs in rec['data'])
-
-        rec['TOTAL'] = total
-        if abs(record['TOTAL-'] - rec['TOTAL']) >= 0.01:
-            raise ValueError(  # pragma: no cover
-                "Mismatch total' {} != {}".format(
-                    rec['TOTAL'], record['TOTAL-']))
-        if abs(record['TOTAL_'] - rec['TOTAL']) >= 0.01:
-            raise ValueError(  # pragma: no cover
-                "Mismatch total' {} != {}".format(
-                    rec['TOTAL'], record['TOTAL_']))
-        del record['TOTAL_']
-        del record['TOTAL-']
-        tva_d = {t['TVAID']: t for t in record['tva']}
-        if is_manual:
-            for item in record['data']:
-                if item['ITMANUAL'] != '2':
-                    continue
-                tvaid = item['TVAID']
-                item['TVARATE'] = tva_d[tvaid]['RATE']
-                item['TVA'] = item['ITPRICE'] * item['TVARATE'] / 100
-        else:
-            for item in record['data']:
-                tvaid = item['TVAID']
-                item['TVARATE'] = tva_d[tvaid]['RATE']
-                item['TVA'] = item['ITPRICE'] * item['TVARATE'] / 100
-        if len(record["data"]) == 0:
-            raise ValueError("No record.")  # pragma: no cover
-
-    records = []
-    record = None
-    first_line = None
-    content_ = content.split('\n')
-    for i, line in enumerate(content_):
-        line = line.strip('\r')
-        if line.startswith("\x02"):
-            if record is not None:
-                raise RuntimeError(  # pragma: no cover
-                    "Wrong format at line {}".format(i + 1))
-            record = dict(data=[], tva=[])
-            spl = line[1:].split("\x1d")
-            for ii, info in enumerate(spl):
-                record['INFO%d' % ii] = info
-            first_line = i
-
-        elif line.startswith('\x04'):
-            if record is None:
-                raise RuntimeError(  # pragma: no cover
-                    "Wrong format at line {}".format(i + 1))
-            line = line.strip("\x04\x05")
-            record['BASKET'] = line  # pylint: disable=E1137
-
-            # verification
-            if len(record['data']) > 0:  # pylint: disable=E1136
-                try:
-                    _post_process(record)
-                except (KeyError, ValueError) as e:  # pragma: no cover
-                    raise ValueError("Unable to process one record line {}-{}\n{}\n-\n{}".format(
-                        first_line + 1, i + 1, pprint.pformat(record),
-                        "\n".join(content_[first_line: i + 1]))) from e
-
-                records.append(record)  # pylint: disable=E1137
-
-            first_line = None
-            record = None
-
-        elif line.startswith('H\x1d'):
-            # description
-            if record is None:
-                raise RuntimeError(  # pragma: no cover
-                    "Wrong format at line {}".format(i + 1))
-            line = line[2:]
-            spl = line.split("\x1d")
-            names = ['NB1', 'NB2', 'NAME', 'PLACE', 'STREET', 'ZIPCODE',
-                     'INFOL2', 'INFOL2_1', 'INFOL2_2', 'INFOL2_3', 'INFOL2_4']
-            for n, v in zip(names, spl):
-                record[n] = v  # pylint: disable=E1137
-
-        elif line.startswith('L\x1d'):
-            # items
-            if record is None:
-                raise RuntimeError(  # pragma: no cover
-                    "Wrong format at line {}".format(i + 1))
-            line = line[2:]
-            spl = line.split("\x1d")
-            names = ['ITCODE', 'ITNAME', 'IT1', 'IT2', 'TVAID', 'IT4',
-                     'ITUNIT', 'ITQU', 'CAT', 'ITPRICE',
-                     'IT6', 'NEG', 'IT8', 'IT9', 'IT10', 'IT11', 'IT12']
-            obs = {'ITMANUAL': '0'}
-            for n, v in zip(names, spl):
-                if n in ['ITUNIT', 'ITQU', 'ITPRICE', 'NEG', 'CAT']:
-                    obs[n] = float(v.replace(" ", ""))
-                else:
-                    obs[n] = v
-            n = 'ITQU'
-            if obs['CAT'] == 2:
-                obs['PIECE'] = True
-                obs[n] = int(obs[n] * 1000)
-            else:
-                obs['PIECE'] = False
-            if obs['NEG']:
-                obs['ITUNIT'] *= -1
-                obs['ITPRICE'] *= -1
-            diff = abs(obs['ITQU'] * obs['ITUNIT'] - obs['ITPRICE'])
-            add_obs = None
-            if diff >= 0.01:  # 1 cent
-                obs['ERROR'] = diff
-                if obs['ITQU'] == 0 or obs['ITUNIT'] == 0:
-                    obs['ERROR'] = 0.
-                    obs['ITPRICE'] = 0.
-                    if obs['ITCODE'] == '30002':
-                        obs['ITMANUAL'] = '1'
-                    else:
-                        obs['ITMANUAL'] = '?'
-                elif diff >= 0.02:  # pragma: no cover
-                    add_obs = obs.copy()
-                    add_obs['ITCODE'] += 'X'
-                    add_obs['ITPRICE'] = 0.
-                    add_obs['NEG'] = 1 if diff < 0 else 0
-                    add_obs['ITUNIT'] = abs(diff)
-                    add_obs['ITQU'] = 1
-                    add_obs['PIECE'] = True
-                    add_obs['CAT'] = 1
-            record['data'].append(obs)  # pylint: disable=E1136
-            if add_obs:
-                record['data'].append(add_obs)  # pylint: disable=E1136
-
-        elif line.startswith('T\x1d9\x1d'):
-            # items
-            if record is None:
-                raise RuntimeError(  # pragma: no cover
-                    "Wrong format at line {}".format(i + 1))
-            line = line[4:]
-            spl = line.split("\x1d")
-            names = ['HT', 'TVA', 'TOTAL_']
-            tva = {}
-            for n, v in zip(names, spl):
-                record[n] = float(v.replace(" ", ""))  # pylint: disable=E1137
-
-        elif line.startswith('T\x1d'):
-            # items
-            if record is None:
-                raise RuntimeError(  # pragma: no cover
-                    "Wrong format at line {}".format(i + 1))
-            line = line[2:]
-            spl = line.split("\x1d")
-            names = ['TVAID', 'RATE', 'HT', 'VALUE', 'TOTAL']
-            tva = {}
-            for n, v in zip(names, spl):
-                if n == 'TVAID':
-                    tva[n] = v
-                else:
-                    try:
-                        tva[n] = float(v.replace(" ", ""))
-                    except ValueError:  # pragma: no cover
-                        tva[n] = v
-            record['tva'].append(tva)  # pylint: disable=E1136
-
-        elif line.startswith('F\x1d'):
-            # items
-            if record is None:
-                raise RuntimeError("Wrong format at line {}".format(i + 1))
-            line = line[2:]
-            spl = line.split("\x1d")
-            names = ['FCODE', 'TOTAL-', 'DATE', 'TIME', 'FCODE1', 'FCODE2']
-            vtime = None
-            vdate = None
-            for n, v in zip(names, spl):
-                if n in {'TOTAL-', }:
-                    record[n] = float(v.replace(" ", "")  # pylint: disable=E1137
-                                      )  # pylint: disable=E1137
-                elif n == "TIME":
-                    vtime = v
-                elif n == "DATE":
-                    vdate = v
-                else:
-                    record[n] = v  # pylint: disable=E1137
-            record["DATETIME"] = datetime.datetime.strptime(  # pylint: disable=E1137
-                "{} {}".format(vdate, vtime), "%d.%m.%Y %H:%M:%S")
 
+    The parsing is done by @see fn iter_ct1 (*engine='text'*) which
+    processes the file one basket at a time. Engine ``'bytes'`` reads
+    the file by blocks and splits every block into lines as bytes
+    (a block ends after a basket), lines of the same type are split at once
+    and amounts are converted by :epkg:`numpy` when a dataframe is requested,
+    @see fn iter_ct1_bytes is used otherwise.
+    With *n_jobs*, a chunk ends after a basket and the next one starts
+    with the following basket (line ``\x02``), a basket is never split
+    between two processes and the results are the same.
+    With *baskets*, *start* or *end*, *file_or_str* must be a filename,
+    the function loads or builds an index of the baskets
+    (see @see fn load_ct1_index) and only parses the selected baskets.
+    A malformed basket raises an exception unless *errors* is not ``'raise'``,
+    parsing then goes on with the next basket. A rejected basket
+    is a dictionary with keys *first_line*, *last_line* (line numbers
+    starting at 1), *text* (the raw lines) and *error* (the exception),
+    a line outside any basket which cannot be parsed is also rejected.
+    """
+    if errors not in ('raise', 'skip', 'collect'):
+        raise ValueError("Unknown value for errors='{}'.".format(errors))
+    found = None if errors == 'raise' else []
+    if baskets is not None or start is not None or end is not None:
+        if not _is_filename(file_or_str):
+            raise ValueError(
+                "baskets, start, end require a filename.")
+        from .ct1_index import _read_ct1_index  # pylint: disable=C0415
+        res = _read_ct1_index(file_or_str, encoding=encoding, as_df=as_df,
+                              baskets=baskets, start=start, end=end,
+                              index=index, rejects=found, typed=typed,
+                              drop_unknown=drop_unknown)
+        if as_df:
+            res = res.to_dataframe()
+        return _ct1_rejects(res, found, errors, rejects, file_or_str)
+    if engine == 'bytes' and not _ascii_compatible(encoding):
+        if found is not None:
+            raise ValueError(
+                "errors='{}' requires an encoding compatible with ascii.".format(errors))
+        engine = 'text'
+    if engine == 'bytes':
+        if n_jobs != 1 and _is_filename(file_or_str):
+            res = _read_ct1_parallel(file_or_str, encoding=encoding, as_df=as_df,
+                                     n_jobs=n_jobs, chunk_size=chunk_size,
+                                     rejects=found, typed=typed,
+                                     drop_unknown=drop_unknown)
+            if as_df:
+                res = res.to_dataframe()
+            return _ct1_rejects(res, found, errors, rejects, file_or_str)
+        if as_df:
+            blocks = _ct1_blocks(file_or_str, encoding=encoding)
+            if blocks is not None:
+                res = _ct1_columns_blocks(blocks, encoding=encoding, rejects=found,
+                                          typed=typed, drop_unknown=drop_unknown)
+                res = res.to_dataframe()
+                return _ct1_rejects(res, found, errors, rejects, file_or_str)
+        records = _iter_ct1_fast(file_or_str, encoding=encoding, rejects=found,
+                                 drop_unknown=drop_unknown)
+    elif engine == 'text':
+        if found is not None:
+            raise ValueError(
+                "errors='{}' requires engine='bytes'.".format(errors))
+        records = iter_ct1(file_or_str, encoding=encoding, drop_unknown=drop_unknown)
+    else:
+        raise ValueError("Unknown engine '{}'.".format(engine))
     if as_df:
-        new_records = []
-        for record in records:
-            rec = copy.deepcopy(record)
-            del rec['tva']
-            data = rec['data']
-            del rec['data']
-            for d in data:
-                d.update(rec)
-                new_records.append(d)
-        import pandas
-        return pandas.DataFrame(new_records)
+        res = _ct1_frames(records, typed=typed).to_dataframe()
     else:
-        return records
+        res = list(records)
+    return _ct1_rejects(res, found, errors, rejects, file_or_str)
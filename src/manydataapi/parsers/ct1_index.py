@@ -0,0 +1,239 @@
+# -*- coding:utf-8 -*-
+"""
+@file
+@brief Index on the baskets of a `CT1` file to parse only some of them.
+"""
+import mmap
+import os
+import re
+import numpy
+from .ct1 import (
+    _CT1Frames, _ct1_block_size, _ct1_columns_lines, _ct1_count_lines,
+    _ct1_datetime, _ct1_reject, _split_byte_lines, _tokenize_ct1)
+
+#: lines the index looks at: beginning of a basket (``\x02``),
+#: end of a basket (``\x04``) and date (``F``)
+_ct1_markers = re.compile(
+    rb"(?:^|(?<=[\r\n]))(?:\x02|\x04[^\r\n]*|F\x1d[^\r\n]*)(?:\r\n|\r|\n)?")
+
+#: version of the index format
+_ct1_index_version = 2
+
+
+def _index_name(filename, index=None):
+    "returns the sidecar filename"
+    return index or (filename + ".idx")
+
+
+def _scan_ct1(content, encoding='ascii'):
+    """
+    Finds the baskets in the content of a `CT1` file.
+
+    @param      content     bytes or `mmap`
+    @param      encoding    encoding
+    @return                 dictionary of arrays, see @see fn build_ct1_index,
+                            the keys starting with ``broken_`` describe
+                            the baskets with no line ``\x04``
+    """
+    offsets, sizes, lines, baskets, dates = [], [], [], [], []
+    broken = []
+    begin = None
+    begin_line = 0
+    date = None
+    pos = 0
+    nline = 0
+    for m in _ct1_markers.finditer(content):
+        text = m.group()
+        c = text[0]
+        if c == 2:  # \x02
+            nline += _ct1_count_lines(content, pos, m.start())
+            pos = m.start()
+            if begin is not None:
+                # the previous basket never ends
+                broken.append((begin, pos - begin, begin_line))
+            begin = pos
+            begin_line = nline
+            date = None
+        elif begin is None:
+            # outside a basket
+            continue
+        elif c == 70:  # F
+            spl = text[2:].rstrip(b"\r\n").decode(encoding).split("\x1d")
+            try:
+                date = _ct1_datetime(spl[2], spl[3])
+            except (IndexError, ValueError):
+                date = None
+        else:  # \x04
+            offsets.append(begin)
+            sizes.append(m.end() - begin)
+            lines.append(nline)
+            baskets.append(text.rstrip(b"\r\n").decode(encoding).strip("\x04\x05"))
+            dates.append(numpy.datetime64('NaT') if date is None
+                         else numpy.datetime64(date, 's'))
+            begin = None
+    broken = numpy.array(broken, dtype=numpy.int64).reshape((-1, 3))
+    return dict(offset=numpy.array(offsets, dtype=numpy.int64),
+                size=numpy.array(sizes, dtype=numpy.int64),
+                line=numpy.array(lines, dtype=numpy.int64),
+                BASKET=numpy.array(baskets, dtype=str),
+                DATETIME=numpy.array(dates, dtype='datetime64[s]'),
+                broken_offset=broken[:, 0], broken_size=broken[:, 1],
+                broken_line=broken[:, 2])
+
+
+def _index_to_df(arrays):
+    "converts the arrays of an index into a dataframe"
+    import pandas
+    return pandas.DataFrame({k: arrays[k] for k in
+                             ['offset', 'size', 'line', 'BASKET', 'DATETIME']})
+
+
+def _build_ct1_index(filename, index=None, encoding='ascii'):
+    "builds and saves the index, returns the arrays, see @see fn build_ct1_index"
+    with open(filename, "rb") as f:
+        st = os.fstat(f.fileno())
+        if st.st_size == 0:
+            arrays = _scan_ct1(b"", encoding=encoding)
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                arrays = _scan_ct1(mm, encoding=encoding)
+    if index is not False:
+        name = _index_name(filename, index)
+        tmp = name + ".tmp"
+        with open(tmp, "wb") as f:
+            numpy.savez(f, version=_ct1_index_version, file_size=st.st_size,
+                        file_mtime=st.st_mtime_ns, **arrays)
+        os.replace(tmp, name)
+    return arrays
+
+
+def _load_ct1_index(filename, index=None, encoding='ascii'):
+    "loads or builds the index, returns the arrays, see @see fn load_ct1_index"
+    name = _index_name(filename, index)
+    if os.path.exists(name):
+        st = os.stat(filename)
+        with numpy.load(name) as data:
+            if (int(data['version']) == _ct1_index_version and
+                    int(data['file_size']) == st.st_size and
+                    int(data['file_mtime']) == st.st_mtime_ns):
+                return {k: data[k] for k in data.files}
+    return _build_ct1_index(filename, index=index, encoding=encoding)
+
+
+def build_ct1_index(filename, index=None, encoding='ascii'):
+    """
+    Builds an index on the baskets of a `CT1` file and saves it
+    in a sidecar file with :epkg:`numpy` (format ``.npz``).
+    The file is memory-mapped and only the lines ``\\x02``,
+    ``\\x04`` and ``F`` are looked at, baskets are not parsed.
+
+    @param      filename    `CT1` file
+    @param      index       sidecar filename, None for *filename*
+                            followed by ``.idx``, False to skip the saving
+    @param      encoding    encoding
+    @return                 dataframe, one row per basket
+
+    Columns of the index:
+
+    * *offset*: position of the line ``\\x02`` in the file (bytes)
+    * *size*: size of the basket up to the end of the line ``\\x04`` (bytes)
+    * *line*: index of the line ``\\x02`` (for error messages)
+    * *BASKET*: basket id
+    * *DATETIME*: date and time (line ``F``), NaT if it is missing
+
+    A basket with no line ``\\x04`` is not indexed but the index
+    keeps its position, @see fn read_ct1 raises an exception or rejects
+    it whatever the selection is. A basket truncated at the end
+    of the file is ignored as @see fn read_ct1 does.
+    """
+    return _index_to_df(_build_ct1_index(filename, index=index, encoding=encoding))
+
+
+def load_ct1_index(filename, index=None, encoding='ascii'):
+    """
+    Loads the index of a `CT1` file built by @see fn build_ct1_index,
+    the index is built again if it does not exist or if the file
+    was modified (size or modification time) since it was built.
+
+    @param      filename    `CT1` file
+    @param      index       sidecar filename, see @see fn build_ct1_index
+    @param      encoding    encoding
+    @return                 dataframe, one row per basket
+    """
+    return _index_to_df(_load_ct1_index(filename, index=index, encoding=encoding))
+
+
+def select_ct1_index(idx, baskets=None, start=None, end=None):
+    """
+    Selects baskets in an index.
+
+    @param      idx         index, see @see fn load_ct1_index
+    @param      baskets     basket id or list of basket ids, None for all
+    @param      start       first date (included), None for no limit
+    @param      end         last date (excluded), None for no limit
+    @return                 selected rows
+    """
+    import pandas
+    keep = numpy.ones(idx.shape[0], dtype=numpy.bool_)
+    if baskets is not None:
+        if isinstance(baskets, str):
+            baskets = [baskets]
+        keep &= idx['BASKET'].isin(baskets).values
+    if start is not None:
+        keep &= (idx['DATETIME'] >= pandas.Timestamp(start)).values
+    if end is not None:
+        keep &= (idx['DATETIME'] < pandas.Timestamp(end)).values
+    return idx[keep]
+
+
+def _read_ct1_index(filename, encoding='ascii', as_df=True, baskets=None,
+                    start=None, end=None, index=None, rejects=None,
+                    typed=False, drop_unknown=False):
+    """
+    Parses only the baskets selected by @see fn select_ct1_index,
+    see @see fn read_ct1, returns a @see cl _CT1Frames
+    if *as_df* is True, a list otherwise.
+    """
+    arrays = _load_ct1_index(filename, index=index, encoding=encoding)
+    sel = select_ct1_index(_index_to_df(arrays), baskets=baskets,
+                           start=start, end=end)
+    # consecutive baskets are read at once up to the size of a block
+    spans = []
+    for offset, size, line in zip(sel['offset'].tolist(), sel['size'].tolist(),
+                                  sel['line'].tolist()):
+        if (spans and spans[-1][1] == offset and
+                offset + size - spans[-1][0] <= _ct1_block_size):
+            spans[-1][1] = offset + size
+        else:
+            spans.append([offset, offset + size, line])
+
+    store = _CT1Frames(typed)
+    records = []
+    with open(filename, "rb") as f:
+        # a basket with no end cannot be selected, it is always reported
+        for begin, size, line in zip(arrays['broken_offset'].tolist(),
+                                     arrays['broken_size'].tolist(),
+                                     arrays['broken_line'].tolist()):
+            f.seek(begin)
+            lines = _split_byte_lines(f.read(size))
+            exc = RuntimeError("Wrong format at line {}".format(
+                line + len(lines) + 1))
+            if rejects is None:
+                raise exc
+            _ct1_reject(rejects, line, line + len(lines) - 1, lines, exc, encoding)
+        for begin, stop, line in spans:
+            f.seek(begin)
+            lines = _split_byte_lines(f.read(stop - begin))
+            if as_df:
+                store.extend(_ct1_columns_lines(lines, encoding=encoding,
+                                                first_line=line, rejects=rejects,
+                                                drop_unknown=drop_unknown))
+            else:
+                records.extend(_tokenize_ct1([lines], encoding=encoding,
+                                             first_line=line, rejects=rejects,
+                                             drop_unknown=drop_unknown))
+    if rejects:
+        rejects.sort(key=lambda r: r['first_line'])
+    if as_df:
+        return store
+    return records
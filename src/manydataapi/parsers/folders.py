@@ -3,13 +3,184 @@
 @file
 @brief Parses format from a paying machine.
 """
+import functools
+import hashlib
 import re
 import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from .dataframe_helper import dataframe_to
 
 
+def _read_ct1_df(name, typed=False, drop_unknown=False):
+    """
+    Parses a file with format `CT1` into a dataframe.
+    It is defined at module level so that it can be pickled
+    and sent to another process.
+    """
+    from .ct1 import read_ct1
+    return read_ct1(name, as_df=True, typed=typed, drop_unknown=drop_unknown)
+
+
+def _read_ct1_df_rejects(name, typed=False, drop_unknown=False):
+    """
+    Parses a file with format `CT1` into a dataframe,
+    skips the malformed baskets and returns them as well.
+    """
+    from .ct1 import read_ct1
+    return read_ct1(name, as_df=True, errors='collect', typed=typed,
+                    drop_unknown=drop_unknown)
+
+
+def _map_files(reader, names, n_jobs=1, backend='serial', errors='raise'):
+    """
+    Calls *reader* on every file, sequentially or with a pool of workers.
+
+    :param reader: function which parses a file
+    :param names: list of filenames
+    :param n_jobs: number of workers, None or -1 for the number of cores
+    :param backend: `'serial'`, `'thread'` or `'process'`
+    :param errors: `'raise'` stops on the first file which cannot be parsed,
+        otherwise the result for this file is the exception
+        whatever its type is
+    :return: iterator on *(name, result)*, the order follows *names*
+    """
+    if backend not in ('serial', 'thread', 'process'):
+        raise ValueError(
+            "Unknown backend '{}'.".format(backend))
+    if backend == 'serial' or len(names) <= 1:
+        for name in names:
+            try:
+                obj = reader(name)
+            except Exception as e:  # pylint: disable=W0703
+                if errors != 'raise':
+                    obj = e
+                elif isinstance(e, (ValueError, KeyError)):
+                    raise ValueError(
+                        "Unable to parse file '{}'.".format(name)) from e
+                else:
+                    raise
+            yield name, obj
+        return
+
+    cls = ThreadPoolExecutor if backend == 'thread' else ProcessPoolExecutor
+    if n_jobs is None or n_jobs <= 0:
+        n_jobs = os.cpu_count() or 1
+    n_jobs = min(n_jobs, len(names))
+
+    with cls(max_workers=n_jobs) as executor:
+        futures = [executor.submit(reader, name) for name in names]
+        for name, fut in zip(names, futures):
+            try:
+                obj = fut.result()
+            except Exception as e:  # pylint: disable=W0703
+                if errors != 'raise':
+                    obj = e
+                else:
+                    for f in futures:
+                        f.cancel()
+                    if not isinstance(e, (ValueError, KeyError)):
+                        raise
+                    raise ValueError(
+                        "Unable to parse file '{}'.".format(name)) from e
+            yield name, obj
+
+
+def _code_digest(code):
+    """
+    Returns a string which changes when the code of a function changes,
+    nested functions are processed recursively because their representation
+    contains an address.
+    """
+    consts = [_code_digest(c) if hasattr(c, 'co_code') else repr(c)
+              for c in code.co_consts]
+    return "{}|{}|{}|{}|{}".format(
+        code.co_filename, getattr(code, 'co_qualname', code.co_name),
+        code.co_code.hex(), consts, code.co_names)
+
+
+def _reader_version(reader):
+    """
+    Returns a string which identifies a reader and its version,
+    it is part of the cache key used by @see fn read_folder.
+    The string includes the module, the name and the code
+    of the function, its default values and the values captured
+    by a closure so that two lambda functions do not share
+    their results.
+    """
+    from .. import __version__
+    if isinstance(reader, functools.partial):
+        return "{}-{}-{}".format(_reader_version(reader.func), reader.args,
+                                 sorted(reader.keywords.items()))
+    version = "{}.{}-{}".format(
+        getattr(reader, '__module__', ''),
+        getattr(reader, '__qualname__', repr(reader)), __version__)
+    code = getattr(reader, '__code__', None)
+    if code is not None:
+        closure = getattr(reader, '__closure__', None) or []
+        version += "-{}-{}-{}-{}".format(
+            _code_digest(code), getattr(reader, '__defaults__', None),
+            getattr(reader, '__kwdefaults__', None),
+            [repr(c.cell_contents) for c in closure])
+    return version
+
+
+def _cache_name(cache_dir, name, version):
+    """
+    Returns the cache filename for a file and the prefix shared
+    by all cached versions of the same file parsed by the same reader.
+    The key depends on the absolute path, the reader and its options
+    (see @see fn _reader_version), the size and the modification time.
+    """
+    st = os.stat(name)
+    path = os.path.abspath(name)
+    prefix = "{}-{}".format(
+        hashlib.sha1(path.encode('utf-8')).hexdigest()[:16],
+        hashlib.sha1(version.encode('utf-8')).hexdigest()[:16])
+    key = "{}|{}".format(st.st_size, st.st_mtime_ns)
+    key = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, "{}-{}.pkl".format(prefix, key)), prefix
+
+
+def _cache_load(cache_name):
+    """
+    Loads a cached result, returns None if it does not exist.
+    """
+    if not os.path.exists(cache_name):
+        return None
+    with open(cache_name, "rb") as f:
+        return pickle.load(f)
+
+
+def _cache_save(cache_name, prefix, obj):
+    """
+    Stores a parsed result with :epkg:`pickle` (numpy blocks
+    for a dataframe). The file is written under a temporary name
+    and renamed so that an interrupted run never leaves a truncated
+    cache entry. Older versions of the same file parsed by the same
+    reader with the same options (same *prefix*) are removed once
+    the new entry exists, the results of other readers are kept.
+    """
+    tmp = cache_name + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, cache_name)
+    folder = os.path.dirname(cache_name)
+    for old in os.listdir(folder):
+        if (old.startswith(prefix + "-") and old.endswith(".pkl") and
+                old != os.path.basename(cache_name)):
+            os.remove(os.path.join(folder, old))
+
+
 def read_folder(folder=".", reader="CT1", pattern=".*[.].{1,3}$",
-                verbose=False, out=None, fLOG=None):
+                verbose=False, out=None, n_jobs=1, backend='serial',
+                cache_dir=None, errors='raise', rejects=None, typed=False,
+                drop_unknown=False, fLOG=None):
     """
     Applies the same parser on many files in a folder.
 
@@ -19,22 +190,53 @@ def read_folder(folder=".", reader="CT1", pattern=".*[.].{1,3}$",
     :param pattern: file pattern
     :param verbose: to show progress, it requires module :epkg:`tqdm`
     :param out: output the dataframe in a file
+    :param n_jobs: number of workers, None or -1 for the number of cores,
+        it is ignored if *backend* is `'serial'`
+    :param backend: `'serial'`, `'thread'` or `'process'`,
+        with `'process'`, *reader* must be picklable (no lambda function)
+    :param cache_dir: if not empty, every parsed file is stored in this
+        folder and only new or modified files are parsed again
+    :param errors: `'raise'` stops on the first malformed file or basket,
+        `'skip'` skips them, `'collect'` skips them and stores them in *rejects*
+        (see @see fn read_ct1)
+    :param rejects: receives the malformed baskets and files
+        if *errors* is `'collect'`, a list or a filename
+        (see @see fn save_ct1_rejects), if None, the function
+        returns *(results, rejects)*
+    :param typed: reader `CT1` returns typed dataframes (see @see fn read_ct1),
+        categories are merged when the dataframes are concatenated
+    :param drop_unknown: reader `CT1` skips the fields whose meaning
+        is unknown while it parses the files (see @see fn read_ct1)
     :param fLOG: logging function
     :return: concatenated list or DataFrame
 
+    Files are processed in alphabetical order and the results
+    are concatenated in that order whatever the backend is.
+    A cached result is reused if the file has the same path, size,
+    modification time and if the parser (its module, name, code, options
+    and the version of this module) did not change, the results of
+    different parsers or options are kept side by side.
+    With *errors* not `'raise'`, a malformed basket (reader `CT1`) is skipped,
+    a file the reader cannot parse is skipped and rejected
+    as a whole (*first_line*, *last_line* and *text* are None),
+    a long run does not stop because of one corrupted file.
     The function is also available through a command line.
 
    .. cmdref::
         :title: Parses and merges files in a dictionary with format CT1
         :cmd: -m manydataapi read_folder --help
     """
+    if errors not in ('raise', 'skip', 'collect'):
+        raise ValueError(
+            "Unknown value for errors='{}'.".format(errors))
+    ct1_rejects = False
     if isinstance(reader, str):
         if reader.lower() == 'ct1':
-            from .ct1 import read_ct1
-
-            def reader_(name):
-                return read_ct1(name, as_df=True)
-            reader = reader_
+            ct1_rejects = errors != 'raise'
+            reader = _read_ct1_df_rejects if ct1_rejects else _read_ct1_df
+            if typed or drop_unknown:
+                reader = functools.partial(reader, typed=typed,
+                                           drop_unknown=drop_unknown)
         else:
             raise ValueError(  # pragma: no cover
                 "Unknown parser '{}'.".format(reader))
@@ -43,28 +245,100 @@ def read_folder(folder=".", reader="CT1", pattern=".*[.].{1,3}$",
         fLOG("look into '%s'." % folder)
     names = []
     pat = re.compile(pattern)
-    for name in os.listdir(folder):
+    for name in sorted(os.listdir(folder)):
         if pat.search(name):
             names.append(name)
     if len(names) == 0:
         raise FileNotFoundError(  # pragma: no cover
             "Unable to find file in '{}' following pattern '{}'.".format(
                 folder, pattern))
-    objs = []
+    names = [os.path.join(folder, name) for name in names]
+    objs = [None for name in names]
+    if cache_dir:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        version = "{}-errors={}-typed={}-drop_unknown={}".format(
+            _reader_version(reader), errors, typed, drop_unknown)
+        caches = [_cache_name(cache_dir, name, version) for name in names]
+        for i, (cache_name, _) in enumerate(caches):
+            objs[i] = _cache_load(cache_name)
+        misses = [i for i, obj in enumerate(objs) if obj is None]
+        if verbose and fLOG:
+            fLOG("cache: %d hits, %d misses in '%s'." % (
+                len(names) - len(misses), len(misses), cache_dir))
+    else:
+        misses = list(range(len(names)))
+
+    if verbose and fLOG and backend != 'serial':
+        fLOG("parse %d files with backend=%r, n_jobs=%r." % (
+            len(misses), backend, n_jobs))
 
+    loop = _map_files(reader, [names[i] for i in misses],
+                      n_jobs=n_jobs, backend=backend, errors=errors)
     if verbose:
         from tqdm import tqdm  # pragma: no cover
-        loop = tqdm(names)  # pragma: no cover
-    else:
-        loop = iter(names)
+        loop = tqdm(loop, total=len(misses))  # pragma: no cover
+
+    for i, (_, obj) in zip(misses, loop):
+        objs[i] = obj
+        if cache_dir and not isinstance(obj, Exception):
+            _cache_save(caches[i][0], caches[i][1], obj)
+
+    if errors != 'raise':
+        found = []
+        for i, name in enumerate(names):
+            obj = objs[i]
+            if isinstance(obj, Exception):
+                if verbose and fLOG:
+                    fLOG("skip '%s': %s" % (name, obj))
+                found.append(dict(file=name, first_line=None, last_line=None,
+                                  text=None, error=obj))
+                objs[i] = None
+            elif ct1_rejects:
+                objs[i], rej = obj
+                found.extend(rej)
+        objs = [obj for obj in objs if obj is not None]
+        res = _merge_objs(objs, out=out, verbose=verbose, fLOG=fLOG)
+        if errors == 'skip':
+            return res
+        from .ct1 import _ct1_rejects
+        return _ct1_rejects(res, found, errors, rejects, None)
+    return _merge_objs(objs, out=out, verbose=verbose, fLOG=fLOG)
+
 
-    for name in loop:
-        try:
-            obj = reader(os.path.join(folder, name))
-        except (ValueError, KeyError) as e:  # pragma: no cover
-            raise ValueError("Unable to parse file '{}'.".format(name)) from e
-        objs.append(obj)
+def _merge_categories(df, objs):
+    """
+    Concatenated categories become objects if the categories differ,
+    this function merges the categories of every column which
+    is a category in one dataframe at least.
+    """
+    import numpy
+    from pandas import CategoricalDtype, Categorical
+    from pandas.api.types import union_categoricals
+    for k in df.columns:
+        if isinstance(df[k].dtype, CategoricalDtype):
+            continue
+        dtypes = [obj[k].dtype for obj in objs if k in obj.columns and
+                  isinstance(obj[k].dtype, CategoricalDtype)]
+        if not dtypes:
+            continue
+        parts = []
+        for obj in objs:
+            if k in obj.columns:
+                parts.append(Categorical(obj[k]))
+            else:
+                # missing values
+                parts.append(Categorical.from_codes(
+                    numpy.full(obj.shape[0], -1), dtype=dtypes[0]))
+        df[k] = union_categoricals(parts)
 
+
+def _merge_objs(objs, out=None, verbose=False, fLOG=None):
+    """
+    Concatenates the results of every file, see @see fn read_folder.
+    """
+    if len(objs) == 0:
+        return []
     if isinstance(objs[0], list):
         res = []
         for obj in objs:
@@ -73,6 +347,7 @@ def read_folder(folder=".", reader="CT1", pattern=".*[.].{1,3}$",
     from pandas import DataFrame, concat
     if isinstance(objs[0], DataFrame):
         df = concat(objs, sort=False)
+        _merge_categories(df, objs)
         if out is not None:
             dataframe_to(df, out)
             if verbose and fLOG:
@@ -4,4 +4,4 @@
 """
 
 from .dummies import daily_timeseries
-from .timeseries import plot_aggregated_ts
+from .timeseries import plot_aggregated_ts, aggregate_ts, TimeSeriesRollup
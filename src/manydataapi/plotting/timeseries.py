@@ -2,7 +2,9 @@
 @file
 @brief Common plots for timeseries.
 """
+import os
 import numpy
+import pandas
 
 
 def get_index_date(df):
@@ -32,12 +34,309 @@ def get_new_column(df, name):
     return name
 
 
+#: key columns of every aggregation, see @see fn aggregate_ts
+_agg_keys = {
+    'year': ['year'],
+    'month': ['year', 'month'],
+    'day': ['year', 'month', 'day'],
+    'weekday': ['weekday'],
+    'hour': ['hour'],
+    'weekhour': ['weekday', 'hour'],
+}
+
+
+def _date_keys(values, agg):
+    """
+    Computes the integer keys of an aggregation from datetime64 values.
+
+    @param      values      array of datetime64
+    @param      agg         see @see fn aggregate_ts
+    @return                 list of int64 arrays (one per key column),
+                            boolean mask of valid dates
+    """
+    if agg not in _agg_keys:
+        raise ValueError("Unknown aggregation '{}'.".format(agg))
+    values = values.astype('datetime64[us]')
+    valid = ~numpy.isnat(values)
+    values = values[valid]
+    days = values.astype('datetime64[D]')
+    months = values.astype('datetime64[M]')
+    res = []
+    for k in _agg_keys[agg]:
+        if k == 'year':
+            res.append(months.astype(numpy.int64) // 12 + 1970)
+        elif k == 'month':
+            res.append(months.astype(numpy.int64) % 12 + 1)
+        elif k == 'day':
+            res.append((days - months.astype('datetime64[D]')).astype(numpy.int64) + 1)
+        elif k == 'weekday':
+            # 1970-01-01 is a Thursday (3)
+            res.append((days.astype(numpy.int64) + 3) % 7)
+        else:
+            res.append((values - days).astype('timedelta64[h]').astype(numpy.int64))
+    return res, valid
+
+
+def _reducer_name(reducer):
+    "name of a reducer in the result"
+    if isinstance(reducer, float):
+        return "q%g" % (reducer * 100)
+    return reducer
+
+
+def _reduce(codes, ngroups, values, reducers):
+    """
+    Aggregates *values* for every group *codes* with every reducer.
+
+    @param      codes       group of every value (int64)
+    @param      ngroups     number of groups
+    @param      values      float values, NaN are ignored
+    @param      reducers    list of reducers
+    @return                 list of arrays (one per reducer)
+    """
+    nan = numpy.isnan(values)
+    count = numpy.bincount(codes[~nan], minlength=ngroups)
+    res = []
+    ordered = None
+    for red in reducers:
+        if red == 'count':
+            res.append(count)
+        elif red in ('sum', 'mean'):
+            total = numpy.bincount(codes[~nan], weights=values[~nan],
+                                   minlength=ngroups)
+            if red == 'sum':
+                res.append(total)
+            else:
+                with numpy.errstate(invalid='ignore', divide='ignore'):
+                    res.append(total / count)
+        else:
+            if ordered is None:
+                # values sorted within every group, NaN at the end
+                ordered = values[numpy.lexsort((values, codes))]
+                start = numpy.zeros(ngroups, dtype=numpy.int64)
+                numpy.cumsum(numpy.bincount(codes, minlength=ngroups)[:-1],
+                             out=start[1:])
+            if red == 'min':
+                q = 0.
+            elif red == 'max':
+                q = 1.
+            elif red == 'median':
+                q = 0.5
+            elif isinstance(red, float) and 0 <= red <= 1:
+                q = red
+            else:
+                raise ValueError("Unknown reducer {!r}.".format(red))
+            pos = q * numpy.maximum(count - 1, 0)
+            lo = numpy.floor(pos).astype(numpy.int64)
+            hi = numpy.ceil(pos).astype(numpy.int64)
+            a = ordered[numpy.minimum(start + lo, ordered.shape[0] - 1)]
+            b = ordered[numpy.minimum(start + hi, ordered.shape[0] - 1)]
+            r = a + (b - a) * (pos - lo)
+            r[count == 0] = numpy.nan
+            res.append(r)
+    return res
+
+
+def aggregate_ts(df, value, date=None, agg="month", reducer="sum"):
+    """
+    Aggregates a time series by a period of time.
+    The keys (year, month, ...) are computed from the datetime64 values
+    in one vectorized pass, every value column and every reducer
+    are computed with the same groups.
+
+    @param      df          dataframe
+    @param      value       column or list of columns to aggregate
+    @param      date        column to use as a date,
+                            if None, it assume there is one and only one
+    @param      agg         aggregation by ``'month'``, ``'day'``,
+                            ``'year'``, ``'weekday'``, ``'hour'``,
+                            ``weekhour'``
+    @param      reducer     ``'sum'``, ``'mean'``, ``'count'`` (number of
+                            values which are not missing), ``'min'``, ``'max'``,
+                            ``'median'``, a float in [0, 1] for a quantile
+                            (linear interpolation), or a list of them
+    @return                 dataframe indexed by the keys of the aggregation
+                            (``year``, ``month``, ``day``, ``weekday``
+                            (0 for Monday), ``hour``), one column per value
+                            if there is one reducer, ``<value>_<reducer>``
+                            otherwise (``q90`` for quantile 0.9),
+                            rows with a missing date are ignored
+
+    ::
+
+        from manydataapi.plotting import aggregate_ts, daily_timeseries
+        df = daily_timeseries()
+        gr = aggregate_ts(df, 'X', agg='month', reducer=['sum', 'mean', 0.9])
+    """
+    if date is None:
+        date = get_index_date(df)
+    values = [value] if isinstance(value, str) else list(value)
+    reducers = reducer if isinstance(reducer, list) else [reducer]
+
+    dates = df[date]
+    if getattr(dates.dt, 'tz', None) is not None:
+        dates = dates.dt.tz_localize(None)
+    keys, valid = _date_keys(dates.to_numpy(), agg)
+    names = _agg_keys[agg]
+
+    if len(keys) == 1:
+        uniq, codes = numpy.unique(keys[0], return_inverse=True)
+        uniq = [uniq]
+    else:
+        stacked = numpy.stack(keys, axis=1)
+        uniq, codes = numpy.unique(stacked, axis=0, return_inverse=True)
+        uniq = [uniq[:, i] for i in range(uniq.shape[1])]
+    codes = codes.ravel()
+    ngroups = uniq[0].shape[0]
+
+    data = {}
+    for col in values:
+        integer = df[col].dtype.kind in 'iu'
+        vals = df[col].to_numpy(dtype=numpy.float64)[valid]
+        for red, res in zip(reducers, _reduce(codes, ngroups, vals, reducers)):
+            if integer and red in ('sum', 'min', 'max'):
+                res = res.astype(numpy.int64)
+            name = col if len(reducers) == 1 else "{}_{}".format(
+                col, _reducer_name(red))
+            data[name] = res
+    if len(names) == 1:
+        index = pandas.Index(uniq[0], name=names[0])
+    else:
+        index = pandas.MultiIndex.from_arrays(uniq, names=names)
+    return pandas.DataFrame(data, index=index)
+
+
+class TimeSeriesRollup:
+    """
+    Keeps running aggregates of a time series (see @see fn aggregate_ts)
+    updated with chunks of new rows, an update costs in proportion
+    to the number of new rows and the number of groups.
+    The object can be pickled, it can also be saved with @see me save
+    and restored with @see me load. It can replace the dataframe
+    in @see fn plot_aggregated_ts.
+
+    ::
+
+        rollup = TimeSeriesRollup(['available_bikes'], date='collect_date')
+        for chunk in new_snapshots():
+            rollup.update(chunk)
+            plot_aggregated_ts(rollup, 'available_bikes', agg='weekhour', ax=ax)
+    """
+
+    #: reducers which can be updated
+    _reducers = ['sum', 'count', 'min', 'max']
+
+    def __init__(self, value, date=None,
+                 aggs=('month', 'day', 'hour', 'weekday', 'weekhour')):
+        """
+        @param      value       column or list of columns to aggregate
+        @param      date        column to use as a date, if None,
+                                the only datetime column of the first chunk
+        @param      aggs        aggregations to maintain, see @see fn aggregate_ts
+        """
+        self.values = [value] if isinstance(value, str) else list(value)
+        self.date = date
+        self.aggs = list(aggs)
+        for agg in self.aggs:
+            if agg not in _agg_keys:
+                raise ValueError("Unknown aggregation '{}'.".format(agg))
+        self.rows = 0
+        self._state = {}
+
+    def update(self, df):
+        """
+        Adds new rows.
+
+        @param      df      dataframe with the date column and the value columns
+        @return             self
+        """
+        if self.date is None:
+            self.date = get_index_date(df)
+        for agg in self.aggs:
+            new = aggregate_ts(df, self.values, date=self.date, agg=agg,
+                               reducer=self._reducers)
+            old = self._state.get(agg)
+            if old is not None:
+                both = pandas.concat([old, new])
+                gr = both.groupby(level=list(range(both.index.nlevels)))
+                funcs = {}
+                for col in self.values:
+                    for red in self._reducers:
+                        funcs["{}_{}".format(col, red)] = (
+                            'sum' if red == 'count' else red)
+                new = gr.agg(funcs)
+            self._state[agg] = new
+        self.rows += df.shape[0]
+        return self
+
+    def aggregate(self, value=None, agg="month", reducer="sum"):
+        """
+        Returns the aggregated values, same format as @see fn aggregate_ts.
+
+        @param      value       column or list of columns (None for all)
+        @param      agg         aggregation, it must be one of the
+                                aggregations given to the constructor
+        @param      reducer     ``'sum'``, ``'mean'``, ``'count'``,
+                                ``'min'``, ``'max'`` or a list of them
+        @return                 dataframe
+        """
+        if agg not in self.aggs:
+            raise ValueError(
+                "Aggregation '{}' is not maintained, only {}.".format(agg, self.aggs))
+        values = self.values if value is None else (
+            [value] if isinstance(value, str) else list(value))
+        reducers = reducer if isinstance(reducer, list) else [reducer]
+        state = self._state.get(agg)
+        if state is None:
+            raise RuntimeError("No data was added.")
+        data = {}
+        for col in values:
+            for red in reducers:
+                if red == 'mean':
+                    with numpy.errstate(invalid='ignore', divide='ignore'):
+                        res = (state[col + "_sum"].to_numpy(dtype=numpy.float64) /
+                               state[col + "_count"].to_numpy())
+                elif red in self._reducers:
+                    res = state["{}_{}".format(col, red)].to_numpy()
+                else:
+                    raise ValueError(
+                        "Reducer {!r} cannot be updated.".format(red))
+                name = col if len(reducers) == 1 else "{}_{}".format(col, red)
+                data[name] = res
+        return pandas.DataFrame(data, index=state.index)
+
+    def save(self, filename):
+        """
+        Saves the rollup with :mod:`pickle`.
+
+        @param      filename    filename
+        """
+        import pickle  # pylint: disable=C0415
+        tmp = filename + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(self, f)
+        os.replace(tmp, filename)
+
+    @staticmethod
+    def load(filename):
+        """
+        Restores a rollup saved with @see me save.
+
+        @param      filename    filename
+        @return                 @see cl TimeSeriesRollup
+        """
+        import pickle  # pylint: disable=C0415
+        with open(filename, "rb") as f:
+            return pickle.load(f)
+
+
 def plot_aggregated_ts(df, value, date=None, agg="month", ax=None,
                        kind='bar', **kwargs):
     """
-    Plots an aggregated time series by a period of time.
+    Plots an aggregated time series by a period of time,
+    the aggregation is done by @see fn aggregate_ts.
 
-    @param      df      dataframe
+    @param      df      dataframe or @see cl TimeSeriesRollup
     @param      value   column to show
     @param      date    column to use as a date,
                         if None, it assume there is one and only one
@@ -52,61 +351,24 @@ def plot_aggregated_ts(df, value, date=None, agg="month", ax=None,
     .. plot::
 
         import matplotlib.pyplot as plt
-        from manaydataapi.timeseries import plot_aggregated_ts, daily_timeseries
-        df = plot_aggregated_ts()
+        from manydataapi.plotting import plot_aggregated_ts, daily_timeseries
+        df = daily_timeseries()
         plot_aggregated_ts(df, value='X', agg='month')
         plt.show()
     """
     if not ax:
         import matplotlib.pyplot as plt  # pragma: no cover
         ax = plt.gca()  # pragma: no cover
-    if date is None:
-        date = get_index_date(df)
-    df = df[[date, value]].copy()
+    if isinstance(df, TimeSeriesRollup):
+        gr = df.aggregate(value, agg=agg)
+    else:
+        gr = aggregate_ts(df, value, date=date, agg=agg)
 
     if agg == 'weekhour':
-        col1 = get_new_column(df, 'weekday')
-        df[col1] = df[date].dt.weekday
-        col2 = get_new_column(df, 'hour')
-        df[col2] = df[date].dt.hour
-        key = [col2, col1]
-        vals = [_ for _ in sorted(set(df[col1])) if not numpy.isnan(_)]
-        drop_cols = [col1]
-        if date is not None:
-            drop_cols.append(date)
-        for v in vals:
-            gr = df[df[col1] == v].drop(drop_cols, axis=1).groupby(col2).sum()
-            gr.columns = ['wk=%d' % v]
-            gr.plot(kind=kind, ax=ax, **kwargs)
+        for v in gr.index.levels[0]:
+            sub = gr.xs(v, level='weekday')
+            sub.columns = ['wk=%d' % v]
+            sub.plot(kind=kind, ax=ax, **kwargs)
     else:
-        if agg == "month":
-            col1 = get_new_column(df, 'month')
-            df[col1] = df[date].dt.month
-            col2 = get_new_column(df, 'year')
-            df[col2] = df[date].dt.year
-            key = [col2, col1]
-        elif agg == 'year':
-            col2 = get_new_column(df, 'year')
-            df[col2] = df[date].dt.year
-            key = col2
-        elif agg == 'day':
-            col1 = get_new_column(df, 'month')
-            df[col1] = df[date].dt.month
-            col2 = get_new_column(df, 'year')
-            df[col2] = df[date].dt.year
-            col3 = get_new_column(df, 'day')
-            df[col3] = df[date].dt.day
-            key = [col2, col1, col3]
-        elif agg == 'weekday':
-            col1 = get_new_column(df, 'weekday')
-            df[col1] = df[date].dt.weekday
-            key = col1
-        elif agg == 'hour':
-            col1 = get_new_column(df, 'hour')
-            df[col1] = df[date].dt.hour
-            key = col1
-        else:
-            raise ValueError("Unknown aggregation '{}'.".format(agg))
-        gr = df.drop(date, axis=1).groupby(key).sum()
         gr.plot(kind=kind, ax=ax, **kwargs)
     return ax
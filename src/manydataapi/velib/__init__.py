@@ -3,3 +3,12 @@
 @brief Shortcuts to datasource
 """
 from .data_jcdecaux import DataCollectJCDecaux
+from .storage import (
+    JCDecauxBinaryWriter, read_jcdecaux_binary, read_jcdecaux_txt,
+    convert_jcdecaux_txt)
+from .http_session import KeepAliveSession
+from .scheduler import PeriodicScheduler
+from .geo import haversine, distance_matrix, station_distance_matrix
+from .spatial import StationIndex
+from .simulation import simulate_velib, simulate_batch, SimulationProgress
+from .rendering import VelibFrames, render_frames
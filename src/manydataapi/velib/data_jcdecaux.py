@@ -5,19 +5,25 @@
 
 """
 
+import asyncio
 import os
 import os.path
 import datetime
 import json
 import time
-import re
 import math
-import random
-import urllib
-import urllib.error
-import urllib.request
+import signal
+import threading
+import http.client
 import pandas
 import numpy
+from concurrent.futures import ThreadPoolExecutor
+from .storage import JCDecauxBinaryWriter, read_jcdecaux_txt
+from .http_session import KeepAliveSession
+from .scheduler import PeriodicScheduler
+from .spatial import StationIndex
+from .simulation import simulate_velib, _random_state, _progress_hook
+from .rendering import VelibFrames, _folium_layers
 
 
 class DataCollectJCDecaux:
@@ -53,72 +59,116 @@ class DataCollectJCDecaux:
     _url_api = "https://api.jcdecaux.com/vls/v1/stations?contract=%s&apiKey=%s"
     _url_apic = "https://api.jcdecaux.com/vls/v1/contracts?apiKey=%s"
 
-    def __init__(self, apiKey, fetch_contracts=False):
+    #: number of snapshots between two full snapshots with storage 'delta'
+    _keyframe_every = 60
+
+    def __init__(self, apiKey, fetch_contracts=False, session=None):
         """
         @param          apiKey              api key
         @param          fetch_contracts     if True, it uses a short list of known contracts,
                                             otherwise, it will updated through the website API
+        @param          session             @see cl KeepAliveSession, a new one is created if None,
+                                            connections are kept opened between two calls
         """
         self.apiKey = apiKey
+        self.session = KeepAliveSession() if session is None else session
         self.contracts = DataCollectJCDecaux._contracts_static if not fetch_contracts else self.get_contracts()
 
         # sometimes, lng and lat are null, check if some past retrieving
         # returned non null coordinates
         self.memoGeoStation = {}
 
+    def _fetch(self, url, conditional=False, tag=None, timeout=None):
+        """
+        Downloads an url, tries a second time after a short delay
+        if the first attempt fails.
+
+        @param      url             url
+        @param      conditional     returns None if the server answers
+                                    the content did not change since the previous call
+        @param      tag             name of the request in the metrics
+        @param      timeout         maximum duration in seconds including
+                                    the second attempt, None for no limit
+        @return                     bytes or None
+        @raise                      RuntimeError if both attempts fail,
+                                    TimeoutError if *timeout* is reached
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        for attempt in range(2):
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            try:
+                resp = self.session.get(url, conditional=conditional, tag=tag,
+                                        timeout=remaining)
+            except (http.client.HTTPException, OSError) as e:
+                exc = e
+            else:
+                if resp.not_modified:
+                    return None
+                if resp.status < 400:
+                    return resp.content
+                exc = None
+            if attempt == 0:
+                if deadline is not None and deadline - time.perf_counter() <= 0.5:
+                    break
+                # there was probably a mistake
+                # We try again after a given amount of time
+                time.sleep(0.5)
+        if deadline is not None and isinstance(exc, TimeoutError):
+            raise TimeoutError(
+                "Timeout for url %r." % (tag or url)) from exc
+        raise RuntimeError("Unable to access url %r." % (tag or url)) from exc
+
+    def http_metrics(self):
+        """
+        Returns metrics about the requests sent to the API,
+        see @see me KeepAliveSession.stats.
+        The history of requests (latency, received bytes)
+        is available through ``self.session.history``.
+        """
+        return self.session.stats()
+
     def get_contracts(self):
         """
         Returns the list of contracts.
 
         @return     dictionary, something like ``{'station': 1}``
         """
-        url = DataCollectJCDecaux._url_apic % (self.apiKey)
-        try:
-            with urllib.request.urlopen(url) as u:
-                js = u.read()
-        except (urllib.error.HTTPError, urllib.error.URLError):  # pragma: no cover
-            # there was probably a mistake
-            # We try again after a given amount of time
-            time.sleep(0.5)
-            try:
-                with urllib.request.urlopen(url) as u:
-                    js = u.read()
-            except (urllib.error.HTTPError, urllib.error.URLError) as exc2:
-                # there was probably a mistake, we stop
-                raise RuntimeError("Unable to access url %r." % url) from exc2
-
+        url = self._url_apic % (self.apiKey)
+        js = self._fetch(url, tag="contracts")
         js = str(js, encoding="utf8")
         js = json.loads(js)
         cont = {k["name"]: 1 for k in js}
         return cont
 
-    def get_json(self, contract):
+    def get_json(self, contract, conditional=False, timeout=None):
         """
         Returns the data associated to a contract.
 
         @param      contract        contract name, @see te _contracts
+        @param      conditional     if True, the function returns None
+                                    if the server tells the data did not change
+                                    since the previous call (HTTP 304)
+        @param      timeout         maximum duration of the request in seconds,
+                                    applied to the socket (see @see me KeepAliveSession.get),
+                                    None for the timeout of the session
         @return                     :epkg:`json` string
+        @raise                      TimeoutError if *timeout* is reached
         """
         if contract not in self.contracts:
             raise RuntimeError(  # pragma: no cover
                 "Unable to find contract '{0}' in:\n{1}".format(contract, "\n".join(
                     self.contracts.keys())))
-        url = DataCollectJCDecaux._url_api % (contract, self.apiKey)
+        url = self._url_api % (contract, self.apiKey)
 
         try:
-            with urllib.request.urlopen(url) as u:
-                js = u.read()
-        except (urllib.error.HTTPError, urllib.error.URLError):  # pragma: no cover
+            js = self._fetch(url, conditional=conditional, tag=contract,
+                             timeout=timeout)
+        except RuntimeError:
             # there was probably a mistake
-            # We try again after a given amount of time
-            time.sleep(0.5)
-            try:
-                with urllib.request.urlopen(url) as u:
-                    js = u.read()
-            except (urllib.error.HTTPError, urllib.error.URLError):
-                # there was probably a mistake
-                # we stop
-                return json.loads("[]")
+            # we stop
+            return json.loads("[]")
+        if js is None:
+            return None
 
         js = str(js, encoding="utf8")
         js = json.loads(js)
@@ -163,9 +213,54 @@ class DataCollectJCDecaux:
 
         return js
 
+    @staticmethod
+    def _write_snapshot(js, now, outfile, single_file=True, storage='txt',
+                        writers=None):
+        """
+        Writes a snapshot returned by @see me get_json.
+
+        @param      js              list of stations
+        @param      now             collection time
+        @param      outfile         filename or prefix, see @see me collecting_data
+        @param      single_file     one file or one file per snapshot
+        @param      storage         ``'txt'``, ``'bin'`` or ``'delta'``
+        @param      writers         cache of @see cl JCDecauxBinaryWriter
+                                    indexed by filename
+        @return                     written filename
+        """
+        if storage in ('bin', 'delta'):
+            if single_file:
+                if writers is None:
+                    writers = {}
+                if outfile not in writers:
+                    writers[outfile] = JCDecauxBinaryWriter(
+                        outfile, keyframe_every=(
+                            DataCollectJCDecaux._keyframe_every
+                            if storage == 'delta' else None))
+                writers[outfile].append(js)
+                return outfile
+            name = outfile + "." + \
+                str(now).replace(":", "-").replace(
+                    "/", "-").replace(" ", "_") + ".bin"
+            JCDecauxBinaryWriter(name).append(js)
+            return name
+        if single_file:
+            with open(outfile, "a", encoding="utf8") as f:
+                f.write("%s\t%s\n" % (str(now), str(js)))
+            return outfile
+        name = outfile + "." + \
+            str(now).replace(":",
+                             "-").replace("/",
+                                          "-").replace(" ",
+                                                       "_") + ".txt"
+        with open(name, "w", encoding="utf8") as f:
+            f.write(str(js))
+        return name
+
     def collecting_data(self, contract, delayms=1000, outfile="velib_data.txt",
                         single_file=True, stop_datetime=None, log_every=10,
-                        fLOG=print):
+                        storage='txt', policy='skip', jitter=0.,
+                        handle_signals=True, fLOG=print):
         """
         Collects data for a period of time.
 
@@ -175,45 +270,179 @@ class DataCollectJCDecaux:
         @param      single_file     if True, one file, else, many files with timestamp as a suffix
         @param      stop_datetime   if None, never stops, else stops when the date is reached
         @param      log_every       print something every <log_every> times data were collected
+        @param      storage         ``'txt'`` (python representation), ``'bin'``
+                                    or ``'delta'`` (binary, only changed stations
+                                    between two full snapshots),
+                                    see @see cl JCDecauxBinaryWriter
+        @param      policy          ``'skip'`` or ``'catchup'``, what to do
+                                    when a collection takes longer than the delay,
+                                    see @see cl PeriodicScheduler
+        @param      jitter          random delay (in ms) added to every collection
+        @param      handle_signals  if True, *SIGTERM* stops the collection
+                                    once the current snapshot is written
         @param      fLOG            logging function (None to disable)
-        @return                     list of created file
+        @return                     summary, see @see me PeriodicScheduler.summary
+
+        The collections follow a schedule based on a monotonic clock
+        (see @see cl PeriodicScheduler), it does not drift
+        when a request is slow. The lateness of every collection
+        is logged.
+        Snapshots the server reports as unchanged (HTTP 304) are not written.
+        With ``storage='bin'`` or ``'delta'``, data can be read back with
+        @see fn read_jcdecaux_binary.
         """
-        delay = datetime.timedelta(seconds=delayms / 1000)
-        now = datetime.datetime.now()
-        cloc = now
-        delayms /= 50
-        delays = delayms / 1000.0
+        if storage not in ('txt', 'bin', 'delta'):
+            raise ValueError(  # pragma: no cover
+                "Unknown storage '{}'.".format(storage))
+        writers = {}
+        sched = PeriodicScheduler(delayms / 1000, policy=policy,
+                                  jitter=jitter / 1000,
+                                  stop_datetime=stop_datetime)
+
+        installed = (handle_signals and
+                     threading.current_thread() is threading.main_thread())
+        if installed:
+            previous = signal.signal(
+                signal.SIGTERM, lambda signum, frame: sched.stop())
+        try:
+            for nb in sched:
+                now = datetime.datetime.now()
+                js = self.get_json(contract, conditional=True)
+
+                if js is not None:
+                    # None means the data did not change
+                    self._write_snapshot(js, now, outfile, single_file=single_file,
+                                         storage=storage, writers=writers)
+
+                if fLOG and (nb + 1) % log_every == 0:
+                    fLOG("DataCollectJCDecaux.collecting_data: nb={0} {1} late={2:.3f}s "
+                         "skipped={3}".format(nb + 1, now, sched.lateness[-1],
+                                              sched.skipped))
+        finally:
+            if installed:
+                signal.signal(signal.SIGTERM, previous)
+        if fLOG and sched.stopped:
+            fLOG("DataCollectJCDecaux.collecting_data: stopped after {0} "
+                 "collections".format(sched.ticks))
+        return sched.summary()
+
+    def collect_many(self, contracts, delayms=60000, folder=".",
+                     prefix="velib_data", single_file=True, stop_datetime=None,
+                     max_concurrency=8, timeout=30, log_every=10,
+                     storage='txt', fLOG=print):
+        """
+        Collects data for many contracts at the same time.
+        Every *delayms* milliseconds, all contracts are requested
+        concurrently with :epkg:`asyncio`, requests and writes
+        are executed in a pool of threads.
 
-        nb = 0
-        while stop_datetime is None or now < stop_datetime:
-            now = datetime.datetime.now()
-            cloc += delay
-            js = self.get_json(contract)
+        @param      contracts       list of contracts
+        @param      delayms         delay between two collections (in ms)
+        @param      folder          destination folder
+        @param      prefix          files are named ``<prefix>.<contract>.txt``
+                                    (or ``.bin``) if *single_file* is True,
+                                    ``<prefix>.<contract>.<timestamp>.txt``
+                                    otherwise
+        @param      single_file     one file per contract or one file per snapshot
+        @param      stop_datetime   if None, never stops, else stops when the date is reached
+        @param      max_concurrency maximum number of simultaneous requests
+        @param      timeout         a request taking longer than *timeout* seconds
+                                    is abandoned, nothing is written for this contract
+                                    and this period, the timeout is applied
+                                    to the socket so that the thread
+                                    sending the request is released,
+                                    None for no limit
+        @param      log_every       print something every <log_every> periods
+        @param      storage         ``'txt'``, ``'bin'`` or ``'delta'``, see @see me collecting_data
+        @param      fLOG            logging function (None to disable)
+        @return                     dictionary ``{contract: number of written snapshots}``
 
-            if single_file:
-                with open(outfile, "a", encoding="utf8") as f:
-                    f.write("%s\t%s\n" % (str(now), str(js)))
-            else:
-                name = outfile + "." + \
-                    str(now).replace(":",
-                                     "-").replace("/",
-                                                  "-").replace(" ",
-                                                               "_") + ".txt"
-                with open(name, "w", encoding="utf8") as f:
-                    f.write(str(js))
-
-            nb += 1
-            if fLOG and nb % log_every == 0:
-                fLOG("DataCollectJCDecaux.collecting_data: nb={0} {1} delay={2}".format(
-                    nb, now, delay))
-
-            while now < cloc:
-                now = datetime.datetime.now()
-                time.sleep(delays)
+        Snapshots the server reports as unchanged (HTTP 304) are not written,
+        see @see me http_metrics. An error raised while a contract
+        is requested or written is logged, the other contracts
+        and the next periods are still collected.
+
+        ::
+
+            velib = DataCollectJCDecaux(private_key, True)
+            velib.collect_many(["lyon", "nancy", "besancon"], delayms=60000,
+                               folder="velib_data")
+        """
+        if storage not in ('txt', 'bin', 'delta'):
+            raise ValueError(  # pragma: no cover
+                "Unknown storage '{}'.".format(storage))
+        return asyncio.run(self._collect_many_async(
+            contracts, delayms=delayms, folder=folder, prefix=prefix,
+            single_file=single_file, stop_datetime=stop_datetime,
+            max_concurrency=max_concurrency, timeout=timeout,
+            log_every=log_every, storage=storage, fLOG=fLOG))
+
+    async def _collect_many_async(self, contracts, delayms, folder, prefix,
+                                  single_file, stop_datetime, max_concurrency,
+                                  timeout, log_every, storage, fLOG):
+        "asynchronous part of @see me collect_many"
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(max_concurrency)
+        ext = ".txt" if storage == 'txt' else ".bin"
+        outfiles = {c: os.path.join(folder, "%s.%s%s" % (
+            prefix, c, ext if single_file else "")) for c in contracts}
+        counts = {c: 0 for c in contracts}
+        writers = {}
+        # one lock per contract, two writes on the same file never overlap
+        locks = {c: asyncio.Lock() for c in contracts}
+
+        async def collect_one(executor, contract):
+            now = datetime.datetime.now()
+            try:
+                async with semaphore:
+                    now = datetime.datetime.now()
+                    # the socket stops the request, wait_for is only
+                    # a backstop if the thread does not return in time
+                    js = await asyncio.wait_for(
+                        loop.run_in_executor(
+                            executor, self.get_json, contract, True, timeout),
+                        None if timeout is None else timeout + 1)
+                if js is None:
+                    # the data did not change
+                    return
+                async with locks[contract]:
+                    await loop.run_in_executor(
+                        executor, lambda: self._write_snapshot(
+                            js, now, outfiles[contract], single_file=single_file,
+                            storage=storage, writers=writers))
+                counts[contract] += 1
+            except (asyncio.TimeoutError, TimeoutError):
+                if fLOG:
+                    fLOG("DataCollectJCDecaux.collect_many: timeout for '{0}' "
+                         "at {1}".format(contract, now))
+            except Exception as e:  # pylint: disable=W0703
+                # one contract does not stop the others
+                if fLOG:
+                    fLOG("DataCollectJCDecaux.collect_many: error for '{0}' "
+                         "at {1}: {2}".format(contract, now, e))
+
+        delay = delayms / 1000
+        start = loop.time()
+        nb = 0
+        with ThreadPoolExecutor(max_workers=max_concurrency + 1) as executor:
+            while stop_datetime is None or datetime.datetime.now() < stop_datetime:
+                await asyncio.gather(*[collect_one(executor, c)
+                                       for c in contracts])
+                nb += 1
+                if fLOG and nb % log_every == 0:
+                    fLOG("DataCollectJCDecaux.collect_many: nb={0} {1} counts={2}".format(
+                        nb, datetime.datetime.now(), counts))
+                # next tick of the shared schedule, periods
+                # missed by slow requests are skipped
+                now = loop.time()
+                ticks = int((now - start) / delay) + 1
+                await asyncio.sleep(start + ticks * delay - now)
+        return counts
 
     @staticmethod
     def run_collection(key=None, contract="Paris", delayms=60000, folder_file="velib_data",
-                       stop_datetime=None, single_file=False, log_every=1, fLOG=print):
+                       stop_datetime=None, single_file=False, log_every=1,
+                       storage='txt', fLOG=print):
         """
         Runs the collection of the data for velib, data are stored using :epkg:`json` format.
         The function creates a file every time a new status is downloaded.
@@ -226,6 +455,7 @@ class DataCollectJCDecaux:
         @param      single_file     if True, every json status will be stored in a single file, if False, it will be
                                     a different file each time, if True, then folder_file is a file
         @param      log_every       log some information every 1 (minutes)
+        @param      storage         ``'txt'``, ``'bin'`` or ``'delta'``, see @see me collecting_data
         @param      fLOG            logging function (None to disable)
 
         .. exref::
@@ -246,16 +476,21 @@ class DataCollectJCDecaux:
                 "key cannot be None")
         velib = DataCollectJCDecaux(key, True)
         velib.collecting_data(contract, delayms, folder_file, stop_datetime=stop_datetime,
-                              single_file=single_file, log_every=log_every, fLOG=fLOG)
+                              single_file=single_file, log_every=log_every,
+                              storage=storage, fLOG=fLOG)
 
     @staticmethod
-    def to_df(folder, regex="velib_data.*[.]txt"):
+    def to_df(folder, regex="velib_data.*[.]txt", columns=None, n_jobs=1):
         """
         Reads all files in a folder (assuming there were produced by this class) and
         returns a dataframe with it.
 
         @param  folder      folder where to find the files
         @param  regex       regular expression which filter the files
+        @param  columns     columns to keep (None for all), the others
+                            are skipped while parsing
+        @param  n_jobs      number of processes parsing the files,
+                            None or -1 for the number of cores
         @return             pandas DataFrame
 
         Each file is a status of all stations, a row per
@@ -277,36 +512,12 @@ class DataCollectJCDecaux:
         - number
         - status
         - file
+
+        Files are parsed by @see fn read_jcdecaux_txt,
+        the function does not call :epkg:`python:eval`.
         """
-        if regex is None:
-            regex = ".*"
-        reg = re.compile(regex)
-
-        files_ = os.listdir(folder)
-        files = [_ for _ in files_ if reg.search(_)]
-
-        if len(files) == 0:
-            raise FileNotFoundError(  # pragma: no cover
-                "No found files in directory: '{}'\nregex: '{}'.".format(
-                    folder, regex))
-
-        rows = []
-        for file_ in files:
-            file = os.path.join(folder, file_)
-            with open(file, "r", encoding="utf8") as f:
-                lines = f.readlines()
-            for i, line in enumerate(lines):
-                dl = eval(line.strip("\n\r\t "))  # pylint: disable=W0123
-                if not isinstance(dl, list):
-                    raise TypeError(  # pragma: no cover
-                        "Expects a list for line {0} in file {1}".format(
-                            i,
-                            file))
-                for d in dl:
-                    d["file"] = file_
-                rows.extend(dl)
-
-        return pandas.DataFrame(rows)
+        return read_jcdecaux_txt(folder, regex=regex, columns=columns,
+                                 n_jobs=n_jobs)
 
     @staticmethod
     def draw(df, use_folium=False, **args):
@@ -332,10 +543,10 @@ class DataCollectJCDecaux:
 
             x = df["lng"]
             y = df["lat"]
-            areaf = df.apply(
-                lambda r: r["available_bike_stands"] ** 0.5 * size, axis=1)
-            areab = df.apply(
-                lambda r: r["available_bikes"] ** 0.5 * size, axis=1)
+            areaf = numpy.sqrt(df["available_bike_stands"].to_numpy(
+                dtype=numpy.float64)) * size
+            areab = numpy.sqrt(df["available_bikes"].to_numpy(
+                dtype=numpy.float64)) * size
             ax.scatter(x, y, areaf, alpha=0.5, label="place", color="r")
             ax.scatter(x, y, areab, alpha=0.5, label="bike", color="g")
             ax.grid(True)
@@ -349,17 +560,9 @@ class DataCollectJCDecaux:
             x = df["lat"].mean()
             y = df["lng"].mean()
             map_osm = folium.Map(location=[x, y], zoom_start=13)
-
-            def add_marker(row):
-                "add marker"
-                t = "+ {0} o {1}".format(row["available_bikes"],
-                                         row["available_bike_stands"])
-                folium.CircleMarker([row["lat"], row["lng"]], color='#3186cc', fill_color='#3186cc',
-                                    popup=t, radius=(row["available_bikes"] / numpy.pi) ** 0.5 * 30 * size).add_to(map_osm)
-                folium.CircleMarker([row["lat"], row["lng"]], color='#cc8631', fill_color='#cc8631',
-                                    popup=t, radius=(row["available_bike_stands"] / numpy.pi) ** 0.5 * 30 * size).add_to(map_osm)
-
-            df.apply(lambda row: add_marker(row), axis=1)
+            # one layer for all bikes, one for all stands
+            for layer in _folium_layers(df, size=size):
+                layer.add_to(map_osm)
             return map_osm
 
     @staticmethod
@@ -369,7 +572,7 @@ class DataCollectJCDecaux:
         see `animation.FuncAnimation
         <http://matplotlib.org/api/animation_api.html#matplotlib.animation.FuncAnimation>`_.
 
-        @param      df                  dataframe
+        @param      df                  dataframe or @see cl VelibFrames
         @param      interval            see `animation.FuncAnimation
                                         <http://matplotlib.org/api/animation_api.html#matplotlib.animation.FuncAnimation>`_
         @param      module              module to build the animation
@@ -393,22 +596,7 @@ class DataCollectJCDecaux:
         if 'duration' in args:
             del args['duration']
 
-        dates = list(sorted(set(df["file"])))
-        datas = []
-        for d in dates:
-            sub = df[df["file"] == d]
-            x = sub["lng"]
-            y = sub["lat"]
-            colp = sub.apply(
-                lambda r: r["available_bike_stands"] ** 0.5 * size, axis=1)
-            colb = sub.apply(
-                lambda r: r["available_bikes"] ** 0.5 * size, axis=1)
-            x = tuple(x)
-            y = tuple(y)
-            colp = tuple(colp)
-            colb = tuple(colb)
-            data = (x, y, colp, colb)
-            datas.append(data)
+        datas = df if isinstance(df, VelibFrames) else VelibFrames(df, size=size)
 
         import matplotlib.pyplot as plt
 
@@ -435,8 +623,8 @@ class DataCollectJCDecaux:
                 # scat2.set_array(numpy.array(d))
                 #scat1.set_array(numpy.array(x + y))
                 #scat2.set_array(numpy.array(x + y))
-                scat1._sizes = c
-                scat2._sizes = d
+                scat1.set_sizes(c)
+                scat2.set_sizes(d)
                 return scat1, scat2
 
             fig, _, scat1, scat2 = scatter_fig()
@@ -455,8 +643,8 @@ class DataCollectJCDecaux:
                 __, _, c, d = datas[i]
                 # scat1.set_xdata(x)  # <= Update the curve
                 # scat1.set_ydata(y)  # <= Update the curve
-                scat1._sizes = c
-                scat2._sizes = d
+                scat1.set_sizes(c)
+                scat2.set_sizes(d)
                 res = mplfig_to_npimage(fig)
                 return res
 
@@ -471,6 +659,7 @@ class DataCollectJCDecaux:
     def distance_haversine(lat1, lon1, lat2, lon2):
         """
         Computes the `haversine <https://en.wikipedia.org/wiki/Haversine_formula>`_ distance.
+        @see fn haversine does the same on arrays.
 
         @return      double
         """
@@ -487,6 +676,8 @@ class DataCollectJCDecaux:
     def simulate(df, nbbike, speed,
                  period=datetime.timedelta(minutes=1),
                  iteration=500, min_min=10, delta_speed=2.5,
+                 index=None, start=None, seed=None, engine="array",
+                 progress=None, trace=False, sink=None, chunk_size=100,
                  fLOG=print):
         """
         Simulates velibs on a set of stations given by *df*.
@@ -498,15 +689,51 @@ class DataCollectJCDecaux:
         @param      iteration   number of iterations
         @param      min_min     minimum duration of a trip
         @param      delta_speed allowed speed difference
-        @param      fLOG        logging function
+        @param      index       None, True or a @see cl StationIndex,
+                                if not None, a returned bike is put back
+                                in a station drawn among the stations the bike
+                                can reach at speed *speed + delta_speed*,
+                                otherwise the station is drawn among all stations
+        @param      start       time of the first iteration (None for now)
+        @param      seed        None to use module :mod:`random`, an integer,
+                                a `random.Random` or a `numpy.random.Generator`,
+                                see @see fn simulate_velib
+        @param      engine      ``'array'`` (see @see fn simulate_velib) or
+                                ``'python'`` (the first implementation,
+                                slower, same results for the same seed)
+        @param      progress    progress hook, see @see fn simulate_velib
+        @param      sink        None, a callable or a filename which receives
+                                the status by chunks (engine ``'array'`` only),
+                                see @see fn simulate_velib
+        @param      chunk_size  number of iterations sent to *sink* at once
+        @param      trace       logs every bicycle leaving or returning to
+                                a station with *fLOG* (debugging)
+        @param      fLOG        logging function, it receives the progress
+                                at most once per second
         @return                 simulated paths, data (as DataFrame)
         """
+        if engine == "array":
+            return simulate_velib(df, nbbike, speed, period=period,
+                                  iteration=iteration, min_min=min_min,
+                                  delta_speed=delta_speed, index=index,
+                                  start=start, seed=seed, progress=progress,
+                                  trace=trace, sink=sink,
+                                  chunk_size=chunk_size, fLOG=fLOG)
+        if engine != "python":
+            raise ValueError(  # pragma: no cover
+                "Unknown engine '{}'.".format(engine))
+        if sink is not None:
+            raise ValueError(  # pragma: no cover
+                "sink is only available with engine='array'.")
+
+        rgen = _random_state(seed)
+        hook = _progress_hook(progress, fLOG)
         cities = df[["lat", "lng", "name", "number"]]
-        start = cities.drop_duplicates()
+        stations = cities.drop_duplicates()
         idvelo = 0
 
         current = {}
-        for row in start.values:
+        for row in stations.values:
             r = []
             for i in range(0, 5):
                 r.append(idvelo)
@@ -516,6 +743,12 @@ class DataCollectJCDecaux:
             current[ids] = r
 
         running = []
+        if index is True:
+            index = StationIndex(df)
+        if index is not None:
+            bynumber = {}
+            for k in current:
+                bynumber.setdefault(k[3], k)
 
         def free(v):
             "free bycicles"
@@ -533,7 +766,8 @@ class DataCollectJCDecaux:
                 if _ != -1:
                     r = v[i]
                     v[i] = -1
-                    fLOG("    pop", v)
+                    if trace and fLOG:
+                        fLOG("    pop", v)
                     return r
             raise RuntimeError("no free bike")  # pragma: no cover
 
@@ -542,7 +776,8 @@ class DataCollectJCDecaux:
             for i, _ in enumerate(v):
                 if _ == -1:
                     v[i] = idv
-                    fLOG("    push", v)
+                    if trace and fLOG:
+                        fLOG("    push", v)
                     return None
             raise RuntimeError("no free spot: " + str(v))  # pragma: no cover
 
@@ -564,7 +799,9 @@ class DataCollectJCDecaux:
         paths = []
         keys = list(current.keys())
         iter = 0
-        tim = datetime.datetime.now()
+        tim = datetime.datetime.now() if start is None else start
+        if hook is not None:
+            hook.start(iteration, nbbike)
         while iter < iteration:
 
             status = give_status(current, tim)
@@ -572,7 +809,7 @@ class DataCollectJCDecaux:
 
             # a bike
             if len(running) < nbbike:
-                rnd = random.randint(0, len(keys) - 1)
+                rnd = rgen.randint(0, len(keys) - 1)
                 v = current[keys[rnd]]
                 if bike(v):
                     v = (tim, pop(v), keys[rnd], "begin")
@@ -593,8 +830,16 @@ class DataCollectJCDecaux:
                 delta = tim - r[0]
                 h = delta.total_seconds() / 3600
                 if h * 60 > min_min:
-                    for _ in cities.values:
-                        row = cities.values[random.randint(0, len(cities) - 1)]
+                    if index is None:
+                        candidates = cities.values
+                    else:
+                        # only the stations the bike may have reached
+                        reach, _ = index.query_radius(
+                            r[2][0], r[2][1], (speed + delta_speed) * h)
+                        candidates = [bynumber[n] for n in reach
+                                      if n in bynumber]
+                    for _ in candidates:
+                        row = candidates[rgen.randint(0, len(candidates) - 1)]
                         keycity = tuple(row)
                         station = current[keycity]
                         if free(station):
@@ -608,7 +853,7 @@ class DataCollectJCDecaux:
                             sp = dist / h
                             dsp = abs(sp - speed)
                             if (dsp < delta_speed or (sp < speed and h >= 1)) \
-                                    and random.randint(0, 10) == 0:
+                                    and rgen.randint(0, 10) == 0:
                                 # we put it back
                                 push(station, r[1])
                                 rem.append(i)
@@ -634,12 +879,13 @@ class DataCollectJCDecaux:
 
             running = [r for i, r in enumerate(running) if i not in rem]
 
-            if fLOG:
-                fLOG("[DataCollectJCDecaux.simulate] iter", "time ", tim, " - ", len(running),
-                     "/", nbbike, " paths ", len(paths))
+            if hook is not None:
+                hook.update(iter, len(running), len(paths), tim)
 
             # end of loop
             tim += period
             iter += 1
 
+        if hook is not None:
+            hook.close()
         return pandas.DataFrame(paths), pandas.DataFrame(simulation)
@@ -0,0 +1,126 @@
+# -*- coding:utf-8 -*-
+"""
+@file
+@brief Vectorized distances between stations.
+"""
+import hashlib
+import collections
+import numpy
+import pandas
+
+#: earth radius in kilometers
+EARTH_RADIUS = 6371
+
+_matrix_cache = collections.OrderedDict()
+_matrix_cache_size = 8
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Computes the `haversine <https://en.wikipedia.org/wiki/Haversine_formula>`_
+    distance (in km) with :epkg:`numpy`, the inputs are scalars or arrays
+    and follow :epkg:`numpy` broadcasting rules.
+
+    @param      lat1        latitudes of the first points (degrees)
+    @param      lon1        longitudes of the first points (degrees)
+    @param      lat2        latitudes of the second points (degrees)
+    @param      lon2        longitudes of the second points (degrees)
+    @return                 distances, a float if all inputs are scalars
+
+    ::
+
+        # distances from one point to every station
+        d = haversine(48.85, 2.35, df["lat"].values, df["lng"].values)
+
+        # all pairs
+        d = haversine(lat[:, None], lng[:, None], lat[None, :], lng[None, :])
+    """
+    lat1 = numpy.radians(numpy.asarray(lat1, dtype=numpy.float64))
+    lat2 = numpy.radians(numpy.asarray(lat2, dtype=numpy.float64))
+    dlat = lat2 - lat1
+    dlon = numpy.radians(numpy.asarray(lon2, dtype=numpy.float64) -
+                         numpy.asarray(lon1, dtype=numpy.float64))
+    a = numpy.sin(dlat / 2) ** 2 + \
+        numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin(dlon / 2) ** 2
+    c = 2 * numpy.arctan2(numpy.sqrt(a), numpy.sqrt(1 - a))
+    d = EARTH_RADIUS * c
+    return d[()] if d.ndim == 0 else d
+
+
+def distance_matrix(lat1, lng1, lat2=None, lng2=None,
+                    dtype=numpy.float32, block_size=None):
+    """
+    Computes the haversine distances (in km) between two sets of points.
+
+    @param      lat1        latitudes of the first set
+    @param      lng1        longitudes of the first set
+    @param      lat2        latitudes of the second set (None for the first set)
+    @param      lng2        longitudes of the second set (None for the first set)
+    @param      dtype       type of the results, distances between
+                            stations of the same city do not need double precision
+    @param      block_size  if not None, the matrix is computed by blocks
+                            of *block_size* rows, intermediate results are
+                            computed in double precision and a block
+                            bounds the memory they need
+    @return                 matrix of shape *(len(lat1), len(lat2))*
+    """
+    lat1 = numpy.asarray(lat1, dtype=numpy.float64)
+    lng1 = numpy.asarray(lng1, dtype=numpy.float64)
+    if lat2 is None:
+        lat2, lng2 = lat1, lng1
+    else:
+        lat2 = numpy.asarray(lat2, dtype=numpy.float64)
+        lng2 = numpy.asarray(lng2, dtype=numpy.float64)
+    if block_size is None:
+        block_size = max(lat1.shape[0], 1)
+
+    res = numpy.empty((lat1.shape[0], lat2.shape[0]), dtype=dtype)
+    for begin in range(0, lat1.shape[0], block_size):
+        end = begin + block_size
+        res[begin:end] = haversine(lat1[begin:end, None], lng1[begin:end, None],
+                                   lat2[None, :], lng2[None, :])
+    return res
+
+
+def station_distance_matrix(df, dtype=numpy.float32, block_size=None,
+                            cache=True):
+    """
+    Computes the distances (in km) between all stations.
+
+    @param      df          dataframe with columns *number*, *lat*, *lng*
+                            such as the one returned by
+                            @see me DataCollectJCDecaux.to_df, a station
+                            may appear many times (one per snapshot)
+    @param      dtype       type of the distances
+    @param      block_size  see @see fn distance_matrix
+    @param      cache       keeps the last matrices in memory, the same
+                            set of stations returns the same matrix
+                            without computing it again
+    @return                 square DataFrame indexed by station numbers
+                            (sorted) on both axes, the matrix is read-only
+                            if it comes from the cache
+    """
+    stations = df[["number", "lat", "lng"]].drop_duplicates(
+        "number").sort_values("number")
+    numbers = stations["number"].values
+    lat = stations["lat"].values.astype(numpy.float64)
+    lng = stations["lng"].values.astype(numpy.float64)
+
+    key = None
+    if cache:
+        h = hashlib.sha1()
+        for a in (numbers.astype(numpy.int64), lat, lng):
+            h.update(a.tobytes())
+        key = h.hexdigest(), numpy.dtype(dtype).str
+        if key in _matrix_cache:
+            _matrix_cache.move_to_end(key)
+            return _matrix_cache[key]
+
+    mat = distance_matrix(lat, lng, dtype=dtype, block_size=block_size)
+    res = pandas.DataFrame(mat, index=numbers, columns=numbers)
+    if cache:
+        mat.setflags(write=False)
+        _matrix_cache[key] = res
+        while len(_matrix_cache) > _matrix_cache_size:
+            _matrix_cache.popitem(last=False)
+    return res
@@ -0,0 +1,221 @@
+# -*- coding:utf-8 -*-
+"""
+@file
+@brief Persistent HTTP connections used to poll :epkg:`JCDecaux`.
+"""
+import collections
+import gzip
+import http.client
+import ssl
+import threading
+import time
+import urllib.parse
+
+
+class HttpResponse:
+    """
+    Response returned by @see cl KeepAliveSession.
+
+    * *status*: HTTP status
+    * *content*: decompressed body, None if the server
+      answered 304 (not modified)
+    * *latency*: duration of the request in seconds
+    * *size*: number of bytes received for the body
+      (before decompression)
+    """
+
+    def __init__(self, status, content, latency, size):
+        self.status = status
+        self.content = content
+        self.latency = latency
+        self.size = size
+
+    @property
+    def not_modified(self):
+        "Tells if the server answered 304."
+        return self.status == 304
+
+
+class KeepAliveSession:
+    """
+    Keeps connections opened between two requests
+    (one pool per host), asks for :epkg:`gzip` compression
+    and sends conditional requests (*ETag*, *Last-Modified*)
+    so that an unchanged resource costs a 304 answer.
+    It can be shared across threads.
+
+    ::
+
+        session = KeepAliveSession()
+        resp = session.get("https://api.jcdecaux.com/vls/v1/contracts?apiKey=...")
+        print(resp.status, resp.latency, resp.size)
+        print(session.stats())
+    """
+
+    def __init__(self, timeout=30, max_history=1000):
+        """
+        @param      timeout         timeout of a connection in seconds
+        @param      max_history     number of requests kept in
+                                    attribute *history*
+        """
+        self.timeout = timeout
+        self._idle = {}
+        self._validators = {}
+        self._lock = threading.Lock()
+        self.history = collections.deque(maxlen=max_history)
+        self.counters = dict(requests=0, not_modified=0, errors=0,
+                             connections=0, bytes=0, latency=0.)
+
+    def _get_connection(self, scheme, netloc):
+        "returns an idle connection or a new one"
+        key = scheme, netloc
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), False
+            self.counters['connections'] += 1
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(
+                netloc, timeout=self.timeout,
+                context=ssl.create_default_context())
+        else:
+            conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+        return conn, True
+
+    @staticmethod
+    def _set_timeout(conn, timeout):
+        "changes the timeout of a connection and of its socket if it is opened"
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+
+    def _remaining(self, deadline):
+        "returns the timeout for the next socket operation"
+        if deadline is None:
+            return self.timeout
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            raise TimeoutError("The request did not complete in time.")
+        return remaining if self.timeout is None else min(remaining, self.timeout)
+
+    def _read(self, conn, resp, deadline, block_size=2 ** 16):
+        "reads the body of a response before the deadline"
+        if deadline is None:
+            return resp.read()
+        chunks = []
+        while True:
+            self._set_timeout(conn, self._remaining(deadline))
+            chunk = resp.read(block_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def _release(self, scheme, netloc, conn):
+        "puts a connection back in the pool"
+        with self._lock:
+            self._idle.setdefault((scheme, netloc), []).append(conn)
+
+    def close(self):
+        "Closes all idle connections."
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def get(self, url, conditional=True, tag=None, timeout=None):
+        """
+        Sends a GET request.
+
+        @param      url             url
+        @param      conditional     sends the validators (*ETag*,
+                                    *Last-Modified*) received for the same url
+        @param      tag             stored in *history* instead of the url
+                                    (the url may contain a key)
+        @param      timeout         maximum duration of the request in seconds,
+                                    it is applied to the socket, the request
+                                    raises `TimeoutError` once it is reached,
+                                    None to only apply the timeout of
+                                    the session to every socket operation
+        @return                     @see cl HttpResponse
+        @raise                      `http.client.HTTPException`, `OSError`
+        """
+        parsed = urllib.parse.urlsplit(url)
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        headers = {"Accept-Encoding": "gzip"}
+        if conditional:
+            with self._lock:
+                etag, modified = self._validators.get(url, (None, None))
+            if etag:
+                headers["If-None-Match"] = etag
+            if modified:
+                headers["If-Modified-Since"] = modified
+
+        begin = time.perf_counter()
+        deadline = None if timeout is None else begin + timeout
+        for attempt in range(2):
+            conn, new = self._get_connection(parsed.scheme, parsed.netloc)
+            try:
+                self._set_timeout(conn, self._remaining(deadline))
+                conn.request("GET", path, headers=headers)
+                self._set_timeout(conn, self._remaining(deadline))
+                resp = conn.getresponse()
+                body = self._read(conn, resp, deadline)
+                break
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                # an idle connection may have been closed by the server,
+                # the request is sent again once with a new connection
+                if new or attempt == 1 or (
+                        deadline is not None and time.perf_counter() >= deadline):
+                    with self._lock:
+                        self.counters['errors'] += 1
+                    raise
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self._set_timeout(conn, self.timeout)
+            self._release(parsed.scheme, parsed.netloc, conn)
+        latency = time.perf_counter() - begin
+
+        size = len(body)
+        if resp.status == 304:
+            content = None
+        else:
+            if resp.getheader("Content-Encoding", "").lower() == "gzip":
+                body = gzip.decompress(body)
+            content = body
+            if resp.status == 200:
+                etag = resp.getheader("ETag")
+                modified = resp.getheader("Last-Modified")
+                if etag or modified:
+                    with self._lock:
+                        self._validators[url] = etag, modified
+
+        with self._lock:
+            self.counters['requests'] += 1
+            self.counters['bytes'] += size
+            self.counters['latency'] += latency
+            if resp.status == 304:
+                self.counters['not_modified'] += 1
+            self.history.append(dict(
+                url=tag or url, status=resp.status, latency=latency,
+                bytes=size, time=time.time()))
+        return HttpResponse(resp.status, content, latency, size)
+
+    def stats(self):
+        """
+        Returns aggregated metrics: number of requests, number of 304,
+        number of errors, number of opened connections, received bytes,
+        total and average latency.
+        """
+        with self._lock:
+            res = dict(self.counters)
+        res['avg_latency'] = (res['latency'] / res['requests']
+                              if res['requests'] else 0.)
+        return res
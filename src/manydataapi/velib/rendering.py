@@ -0,0 +1,296 @@
+# -*- coding:utf-8 -*-
+"""
+@file
+@brief Precomputed frames to draw or animate velib snapshots.
+"""
+import json
+import os
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+import pandas
+
+
+class VelibFrames:
+    """
+    Positions and marker sizes of every snapshot (one value of column *file*)
+    stored in contiguous arrays, snapshot *i* is
+    ``slice(offsets[i], offsets[i + 1])``, stations keep
+    the order they have in the dataframe.
+
+    * *dates*: sorted values of column *file*
+    * *offsets*: array of *len(dates) + 1* integers
+    * *lng*, *lat*: coordinates
+    * *stands*, *bikes*: marker sizes, square roots of *available_bike_stands*,
+      *available_bikes* multiplied by *size*
+    """
+
+    def __init__(self, df, size=1):
+        """
+        @param      df      dataframe with columns *file*, *lng*, *lat*,
+                            *available_bike_stands*, *available_bikes*
+        @param      size    multiplies the marker sizes
+        """
+        codes, dates = pandas.factorize(df["file"], sort=True)
+        order = numpy.argsort(codes, kind="stable")
+        counts = numpy.bincount(codes, minlength=len(dates))
+        self.dates = list(dates)
+        self.offsets = numpy.zeros(len(dates) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=self.offsets[1:])
+
+        def column(name):
+            "sorted contiguous column"
+            return numpy.ascontiguousarray(
+                df[name].to_numpy(dtype=numpy.float64)[order])
+
+        self.lng = column("lng")
+        self.lat = column("lat")
+        self.stands = numpy.sqrt(column("available_bike_stands")) * size
+        self.bikes = numpy.sqrt(column("available_bikes")) * size
+
+    def __len__(self):
+        "Returns the number of frames."
+        return len(self.dates)
+
+    def __getitem__(self, i):
+        """
+        Returns frame *i*: *(lng, lat, stands, bikes)* (views on the arrays).
+        """
+        sl = slice(self.offsets[i], self.offsets[i + 1])
+        return self.lng[sl], self.lat[sl], self.stands[sl], self.bikes[sl]
+
+    def limits(self):
+        "Returns the limits of the coordinates *(lng_min, lng_max, lat_min, lat_max)*."
+        return (numpy.nanmin(self.lng), numpy.nanmax(self.lng),
+                numpy.nanmin(self.lat), numpy.nanmax(self.lat))
+
+
+def _folium_layers(df, size=1):
+    """
+    Builds two :epkg:`folium` layers (available bikes, available stands),
+    every layer is one `folium.GeoJson` with a circle per station
+    instead of one object per marker.
+    """
+    import folium  # pylint: disable=C0415
+    lat = df["lat"].to_numpy(dtype=numpy.float64)
+    lng = df["lng"].to_numpy(dtype=numpy.float64)
+    bikes = df["available_bikes"].to_numpy(dtype=numpy.float64)
+    stands = df["available_bike_stands"].to_numpy(dtype=numpy.float64)
+    texts = ("+ " + df["available_bikes"].astype(str) +
+             " o " + df["available_bike_stands"].astype(str)).tolist()
+    keep = ~(numpy.isnan(lat) | numpy.isnan(lng))
+
+    layers = []
+    for values, color in [(bikes, '#3186cc'), (stands, '#cc8631')]:
+        radius = numpy.nan_to_num((values / numpy.pi) ** 0.5 * 30 * size)
+        features = [
+            {"type": "Feature",
+             "geometry": {"type": "Point", "coordinates": [x, y]},
+             "properties": {"radius": r, "text": t}}
+            for x, y, r, t, k in zip(lng.tolist(), lat.tolist(), radius.tolist(),
+                                     texts, keep.tolist()) if k]
+        data = json.dumps(dict(type="FeatureCollection", features=features))
+        layers.append(folium.GeoJson(
+            data, marker=folium.CircleMarker(color=color, fill_color=color),
+            style_function=lambda f, c=color: dict(
+                radius=f["properties"]["radius"], color=c, fillColor=c),
+            popup=folium.GeoJsonPopup(fields=["text"], labels=False)))
+    return layers
+
+
+_worker_frames = None
+
+
+class _FrameRenderer:
+    "draws frames with :epkg:`matplotlib` without any display"
+
+    def __init__(self, frames, figsize=(8, 6), dpi=100, xlim=None, ylim=None):
+        from matplotlib.figure import Figure  # pylint: disable=C0415
+        from matplotlib.backends.backend_agg import FigureCanvasAgg  # pylint: disable=C0415
+        self.frames = frames
+        self.fig = Figure(figsize=figsize, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        ax = self.fig.add_subplot(1, 1, 1)
+        x, y, c, d = frames[0]
+        self.scat1 = ax.scatter(x, y, c, alpha=0.5, color="r", label="place")
+        self.scat2 = ax.scatter(x, y, d, alpha=0.5, color="g", label="bike")
+        if xlim is None or ylim is None:
+            lim = frames.limits()
+            dx = (lim[1] - lim[0]) * 0.05
+            dy = (lim[3] - lim[2]) * 0.05
+            xlim = xlim or (lim[0] - dx, lim[1] + dx)
+            ylim = ylim or (lim[2] - dy, lim[3] + dy)
+        ax.set_xlim(*xlim)
+        ax.set_ylim(*ylim)
+        ax.grid(True)
+        ax.legend(loc="upper right")
+        ax.set_xlabel("longitude")
+        ax.set_ylabel("latitude")
+        self.title = ax.set_title("")
+
+    def render(self, i):
+        "returns frame *i* as an RGB array"
+        x, y, c, d = self.frames[i]
+        xy = numpy.column_stack([x, y])
+        self.scat1.set_offsets(xy)
+        self.scat2.set_offsets(xy)
+        self.scat1.set_sizes(c)
+        self.scat2.set_sizes(d)
+        self.title.set_text(str(self.frames.dates[i]))
+        self.canvas.draw()
+        return numpy.asarray(self.canvas.buffer_rgba())[:, :, :3]
+
+
+def _init_renderer(frames, options):
+    "creates the renderer in every worker"
+    global _worker_frames  # pylint: disable=W0603
+    _worker_frames = _FrameRenderer(frames, **options)
+
+
+def _render_chunk(indices, pattern=None, renderer=None):
+    """
+    Renders a list of frames, writes them as images if *pattern*
+    is not None or returns them as raw RGB bytes.
+    """
+    renderer = renderer or _worker_frames
+    res = []
+    for i in indices:
+        img = renderer.render(i)
+        if pattern is None:
+            res.append(img.tobytes())
+        else:
+            from matplotlib.image import imsave  # pylint: disable=C0415
+            imsave(pattern % i, img)
+    return res, img.shape, len(indices)
+
+
+def _ffmpeg_exe():
+    "returns the path to ffmpeg"
+    try:
+        import imageio_ffmpeg  # pylint: disable=C0415
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except ImportError:  # pragma: no cover
+        return "ffmpeg"
+
+
+def render_frames(frames, output, fps=20, n_jobs=1, chunk_size=10,
+                  figsize=(8, 6), dpi=100, size=1, fLOG=None):
+    """
+    Renders the frames of an animation without any display,
+    frames are drawn by parallel processes with :epkg:`matplotlib`
+    and written as images or sent to :epkg:`ffmpeg` as raw RGB buffers,
+    only a few chunks of frames are kept in memory.
+
+    @param      frames      @see cl VelibFrames or a dataframe
+    @param      output      video filename (``.mp4``, ``.avi``, ...) encoded
+                            by :epkg:`ffmpeg` (from :epkg:`imageio-ffmpeg`
+                            if installed), or a pattern of image filenames
+                            such as ``"frames/img_%05d.png"`` which receives
+                            the frame index
+    @param      fps         frames per second of the video
+    @param      n_jobs      number of processes, None or -1 for the number of cores
+    @param      chunk_size  number of frames rendered by a process at once
+    @param      figsize     figure size
+    @param      dpi         resolution
+    @param      size        multiplies the marker sizes if *frames* is a dataframe
+    @param      fLOG        logging function, it receives the rendering speed
+                            (frames per second) about every second
+    @return                 dictionary with the number of frames,
+                            the duration and the speed (frames per second),
+                            nothing is written if there is no frame
+
+    ::
+
+        frames = VelibFrames(df)
+        render_frames(frames, "velib.mp4", n_jobs=-1, fLOG=print)
+        render_frames(frames, "png/velib_%05d.png", n_jobs=-1)
+    """
+    if not isinstance(frames, VelibFrames):
+        frames = VelibFrames(frames, size=size)
+    if len(frames) == 0:
+        return dict(frames=0, seconds=0., fps=0.)
+    images = "%" in output
+    if images:
+        folder = os.path.dirname(output)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+    options = dict(figsize=figsize, dpi=dpi)
+    chunks = [list(range(i, min(i + chunk_size, len(frames))))
+              for i in range(0, len(frames), chunk_size)]
+    pattern = output if images else None
+
+    if n_jobs is None or n_jobs <= 0:
+        n_jobs = os.cpu_count() or 1
+    n_jobs = min(n_jobs, len(chunks))
+    if n_jobs > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=n_jobs, initializer=_init_renderer,
+            initargs=(frames, options))
+
+        def results():
+            "submits chunks in order, at most 2 * n_jobs at the same time"
+            pending = []
+            with executor:
+                for chunk in chunks:
+                    pending.append(executor.submit(_render_chunk, chunk, pattern))
+                    if len(pending) >= 2 * n_jobs:
+                        yield pending.pop(0).result()
+                for fut in pending:
+                    yield fut.result()
+    else:
+        renderer = _FrameRenderer(frames, **options)
+
+        def results():
+            "renders chunks in this process"
+            for chunk in chunks:
+                yield _render_chunk(chunk, pattern, renderer)
+
+    proc = None
+    begin = time.perf_counter()
+    last = begin
+    done = 0
+    completed = False
+    try:
+        for imgs, shape, n in results():
+            if not images:
+                if proc is None:
+                    h, w = shape[:2]
+                    proc = subprocess.Popen(
+                        [_ffmpeg_exe(), "-y", "-loglevel", "error",
+                         "-f", "rawvideo", "-vcodec", "rawvideo",
+                         "-s", "%dx%d" % (w, h), "-pix_fmt", "rgb24",
+                         "-r", str(fps), "-i", "-", "-an",
+                         "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+                         "-pix_fmt", "yuv420p", output],
+                        stdin=subprocess.PIPE)
+                for img in imgs:
+                    proc.stdin.write(img)
+            done += n
+            now = time.perf_counter()
+            if fLOG and now - last >= 1:
+                fLOG("[render_frames] {}/{} frames, {:.1f} fps".format(
+                    done, len(frames), done / (now - begin)))
+                last = now
+        completed = True
+    finally:
+        if proc is not None:
+            try:
+                proc.stdin.close()
+            except OSError:
+                # ffmpeg already stopped, its return code tells why
+                pass
+            code = proc.wait()
+            # an exception raised while the frames are rendered
+            # or sent is not replaced by this one
+            if completed and code != 0:
+                raise RuntimeError(
+                    "ffmpeg failed with code {} for '{}'.".format(code, output))
+
+    duration = time.perf_counter() - begin
+    res = dict(frames=done, seconds=duration,
+               fps=done / duration if duration > 0 else 0.)
+    if fLOG:
+        fLOG("[render_frames] {} frames in {:.1f}s, {:.1f} fps".format(
+            res['frames'], res['seconds'], res['fps']))
+    return res
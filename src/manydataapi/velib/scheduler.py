@@ -0,0 +1,130 @@
+# -*- coding:utf-8 -*-
+"""
+@file
+@brief Periodic scheduler used to collect data at a fixed pace.
+"""
+import collections
+import datetime
+import math
+import random
+import threading
+import time
+
+
+class PeriodicScheduler:
+    """
+    Yields ticks at a fixed period based on a monotonic clock,
+    the targets are computed from the start time so that
+    the schedule does not drift when a tick takes longer than expected.
+
+    ::
+
+        sched = PeriodicScheduler(60, policy='skip')
+        for tick in sched:
+            collect()
+            print(sched.lateness[-1])
+
+    Every tick records its lateness (seconds between the target time
+    and the time the tick is yielded) in attribute *lateness*
+    (the last *max_history* ones), *max_lateness* and *total_lateness*
+    summarize all ticks.
+    """
+
+    def __init__(self, period, policy='skip', jitter=0., stop_datetime=None,
+                 max_ticks=None, seed=None, max_history=10000,
+                 clock=time.monotonic):
+        """
+        @param      period          period in seconds
+        @param      policy          what to do when a tick runs longer than
+                                    the period, ``'skip'``: missed ticks are
+                                    dropped and the schedule resumes on the next
+                                    target, ``'catchup'``: missed ticks are yielded
+                                    immediately one after another
+        @param      jitter          a random delay between 0 and *jitter* seconds
+                                    is added to every target, it does not accumulate
+        @param      stop_datetime   stops when this datetime is reached (None for never)
+        @param      max_ticks       stops after this number of ticks (None for never)
+        @param      seed            seed for the jitter
+        @param      max_history     number of lateness values kept
+        @param      clock           monotonic clock
+        """
+        if policy not in ('skip', 'catchup'):
+            raise ValueError("Unknown policy '{}'.".format(policy))
+        if period <= 0:
+            raise ValueError(  # pragma: no cover
+                "period must be positive not {}.".format(period))
+        self.period = period
+        self.policy = policy
+        self.jitter = jitter
+        self.stop_datetime = stop_datetime
+        self.max_ticks = max_ticks
+        self.clock = clock
+        self.lateness = collections.deque(maxlen=max_history)
+        self.max_lateness = 0.
+        self.total_lateness = 0.
+        self.ticks = 0
+        self.skipped = 0
+        self._rnd = random.Random(seed)
+        self._stop = threading.Event()
+
+    def stop(self):
+        """
+        Stops the scheduler, the current tick finishes,
+        a waiting scheduler wakes up immediately. It can be called from
+        another thread or from a signal handler.
+        """
+        self._stop.set()
+
+    @property
+    def stopped(self):
+        "Tells if @see me stop was called."
+        return self._stop.is_set()
+
+    def _continue(self, nb):
+        "tells if the scheduler should yield one more tick"
+        if self._stop.is_set():
+            return False
+        if self.max_ticks is not None and nb >= self.max_ticks:
+            return False
+        if (self.stop_datetime is not None and
+                datetime.datetime.now() >= self.stop_datetime):
+            return False
+        return True
+
+    def __iter__(self):
+        start = self.clock()
+        index = 0
+        nb = 0
+        while self._continue(nb):
+            target = start + index * self.period
+            if self.jitter:
+                target += self._rnd.uniform(0, self.jitter)
+            wait = target - self.clock()
+            if wait > 0 and self._stop.wait(wait):
+                break
+            if not self._continue(nb):
+                break
+            late = max(self.clock() - target, 0.)
+            self.lateness.append(late)
+            self.max_lateness = max(self.max_lateness, late)
+            self.total_lateness += late
+            self.ticks += 1
+            yield nb
+            nb += 1
+            index += 1
+            if self.policy == 'skip':
+                # targets already in the past are dropped
+                first = math.ceil((self.clock() - start) / self.period)
+                if first > index:
+                    self.skipped += first - index
+                    index = first
+
+    def summary(self):
+        """
+        Returns the number of ticks, the number of skipped ticks,
+        the average and maximum lateness (in seconds).
+        """
+        return dict(ticks=self.ticks, skipped=self.skipped,
+                    avg_lateness=(self.total_lateness / self.ticks
+                                  if self.ticks else 0.),
+                    max_lateness=self.max_lateness)
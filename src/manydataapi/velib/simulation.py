@@ -0,0 +1,625 @@
+# -*- coding:utf-8 -*-
+"""
+@file
+@brief Simulation of bicycles moving between stations
+based on :epkg:`numpy` arrays.
+"""
+import datetime
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy
+import pandas
+from .geo import haversine
+from .spatial import StationIndex
+
+
+#: number of docks of a station
+_capacity = 10
+
+
+class _GeneratorRandom:
+    "Exposes method *randint* of module :mod:`random` for a numpy Generator."
+
+    def __init__(self, gen):
+        self.gen = gen
+
+    def randint(self, a, b):
+        "random integer in [a, b]"
+        return int(self.gen.integers(a, b + 1))
+
+
+class SimulationProgress:
+    """
+    Reports the progress of a simulation at most every *interval* seconds,
+    the simulation calls method @see me update after every iteration
+    and @see me close at the end.
+
+    ::
+
+        from tqdm import tqdm
+        simulate_velib(df, 100, 15, iteration=1440, fLOG=None,
+                       progress=tqdm(total=1440))
+
+        # or any callable receiving the metrics
+        simulate_velib(df, 100, 15, iteration=1440, fLOG=None,
+                       progress=lambda m: print(m['iteration'], m['paths']))
+    """
+
+    def __init__(self, callback=None, fLOG=None, interval=1.,
+                 clock=time.perf_counter):
+        """
+        @param      callback    callable receiving a dictionary with the metrics
+                                or an object with a method *update(n)*
+                                (such as :epkg:`tqdm`) receiving
+                                the number of iterations done since the last call
+        @param      fLOG        logging function
+        @param      interval    minimum time between two reports (seconds)
+        @param      clock       clock
+        """
+        self.callback = callback
+        self.fLOG = fLOG
+        self.interval = interval
+        self.clock = clock
+        self.iterations = None
+        self.nbbike = None
+        self.iteration = 0
+        self.running = 0
+        self.paths = 0
+        self.time = None
+        self.reports = 0
+        self._reported = 0
+        self._begin = None
+        self._next = None
+
+    def start(self, iterations, nbbike):
+        "Starts the clock."
+        self.iterations = iterations
+        self.nbbike = nbbike
+        self._begin = self.clock()
+        self._next = self._begin + self.interval
+
+    def update(self, iteration, running, paths, time=None):  # pylint: disable=W0621
+        """
+        Stores the current state, reports it if the last report
+        is older than *interval*.
+
+        @param      iteration   current iteration (starting at 0)
+        @param      running     number of running bicycles
+        @param      paths       number of paths
+        @param      time        simulated time
+        """
+        self.iteration = iteration + 1
+        self.running = running
+        self.paths = paths
+        self.time = time
+        if self.clock() >= self._next:
+            self._report()
+
+    def close(self):
+        "Reports the final state."
+        if self._reported < self.iteration or self.reports == 0:
+            self._report()
+
+    def metrics(self):
+        "Returns the metrics."
+        return dict(iteration=self.iteration, iterations=self.iterations,
+                    running=self.running, nbbike=self.nbbike,
+                    paths=self.paths, time=self.time,
+                    elapsed=self.clock() - self._begin)
+
+    def _report(self):
+        "calls the callback and the logging function"
+        self.reports += 1
+        if self.callback is not None:
+            if hasattr(self.callback, 'update'):
+                self.callback.update(self.iteration - self._reported)
+            else:
+                self.callback(self.metrics())
+        if self.fLOG:
+            self.fLOG("[DataCollectJCDecaux.simulate] iter", self.iteration,
+                      "/", self.iterations, "time ", self.time, " - ",
+                      self.running, "/", self.nbbike, " paths ", self.paths)
+        self._reported = self.iteration
+        self._next = self.clock() + self.interval
+
+
+def _progress_hook(progress, fLOG):
+    "returns a @see cl SimulationProgress or None if there is nothing to report"
+    if isinstance(progress, SimulationProgress):
+        return progress
+    if progress is None and not fLOG:
+        return None
+    return SimulationProgress(progress, fLOG=fLOG)
+
+
+def _random_state(seed):
+    """
+    Returns an object with a method *randint* like module :mod:`random`.
+
+    @param      seed        None (module :mod:`random`), an integer,
+                            a `random.Random` or a `numpy.random.Generator`
+    """
+    if seed is None:
+        return random
+    if isinstance(seed, random.Random):
+        return seed
+    if isinstance(seed, numpy.random.Generator):
+        return _GeneratorRandom(seed)
+    return random.Random(seed)
+
+
+def simulate_velib(df, nbbike, speed, period=datetime.timedelta(minutes=1),
+                   iteration=500, min_min=10, delta_speed=2.5, index=None,
+                   start=None, seed=None, progress=None, trace=False,
+                   sink=None, chunk_size=100, fLOG=print):
+    """
+    Simulates velibs on a set of stations given by *df*,
+    this is the engine behind @see me DataCollectJCDecaux.simulate.
+    Every station starts with 5 bicycles and 10 docks.
+    Every iteration, one bicycle leaves a random station
+    if less than *nbbike* are running and every running
+    bicycle looks for a station to return to.
+
+    The state is kept in arrays: the docks of every station
+    (bicycle ids, -1 for a free dock) with the number of bicycles
+    per station, the running trips (start iteration, bicycle,
+    station), the number of available bicycles per station and
+    per iteration is written into a preallocated array.
+    The random draws are the same as the ones the first implementation
+    did, the results are the same for the same seed.
+
+    @param      df          dataframe with station information
+    @param      nbbike      number of bicycles
+    @param      speed       average speed (in km/h)
+    @param      period      period
+    @param      iteration   number of iterations
+    @param      min_min     minimum duration of a trip
+    @param      delta_speed allowed speed difference
+    @param      index       None, True or a @see cl StationIndex,
+                            see @see me DataCollectJCDecaux.simulate
+    @param      start       time of the first iteration (None for now)
+    @param      seed        None to use module :mod:`random` (global state),
+                            an integer, a `random.Random` or a
+                            `numpy.random.Generator`, the simulation
+                            does not change any global state if not None
+    @param      progress    a callable, an object with a method *update*
+                            such as :epkg:`tqdm` or a @see cl SimulationProgress
+                            notified at most once per second
+    @param      trace       logs every bicycle leaving or returning to
+                            a station with *fLOG* (debugging)
+    @param      sink        None to return the status of the stations
+                            as a DataFrame, a callable which receives
+                            the status by chunks of *chunk_size* iterations
+                            (DataFrame), or a filename, the chunks are appended
+                            to this file (see below)
+    @param      chunk_size  number of iterations in a chunk (see *sink*)
+    @param      fLOG        logging function, it receives the progress
+                            at most once per second
+    @return                 simulated paths, data (as DataFrame),
+                            data is None if *sink* is a callable, the filename
+                            if *sink* is a filename
+
+    The status of every station at every iteration may not fit in memory,
+    the status is then sent to a *sink*, the simulation only keeps
+    *chunk_size* iterations in memory. A filename with extension
+    ``.parquet`` is written with :epkg:`pyarrow`, any other extension
+    is written as a text file (``.csv``: comma separated, otherwise
+    tab separated).
+
+    ::
+
+        paths, name = simulate_velib(df, 1000, 15, iteration=1440 * 7,
+                                     sink="status.parquet", fLOG=None)
+    """
+    if start is None:
+        start = datetime.datetime.now()
+    times = [start + period * it for it in range(iteration)]
+    writer = None
+    on_status = None
+    if sink is not None:
+        writer = sink if callable(sink) else _status_writer(sink)
+
+        def on_status(stations, first, status):
+            "converts a chunk into a dataframe"
+            writer(_status_to_df(stations, times[first: first + status.shape[0]],
+                                 status, _capacity))
+
+    try:
+        res = _simulate(df, nbbike, speed, period=period, iteration=iteration,
+                        min_min=min_min, delta_speed=delta_speed, index=index,
+                        start=start, rnd=_random_state(seed),
+                        progress=_progress_hook(progress, fLOG),
+                        trace=fLOG if trace else None, on_status=on_status,
+                        chunk_size=chunk_size)
+    finally:
+        if isinstance(writer, _StatusFileWriter):
+            writer.close()
+    paths = _paths_to_df(res['stations'], times, *res['events'])
+    if sink is None:
+        return paths, _status_to_df(res['stations'], times, res['status'],
+                                    res['capacity'])
+    return paths, None if callable(sink) else sink
+
+
+class _StatusFileWriter:
+    "appends chunks of status to a file"
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.ext = os.path.splitext(filename)[-1].lower()
+        self.writer = None
+        self.header = True
+        if self.ext == ".parquet":
+            import pyarrow  # pylint: disable=C0415
+            import pyarrow.parquet  # pylint: disable=C0415
+            self.pyarrow = pyarrow
+        elif os.path.exists(filename):
+            os.remove(filename)
+
+    def __call__(self, df):
+        if self.ext == ".parquet":
+            table = self.pyarrow.Table.from_pandas(df, preserve_index=False)
+            if self.writer is None:
+                self.writer = self.pyarrow.parquet.ParquetWriter(
+                    self.filename, table.schema)
+            self.writer.write_table(table)
+        else:
+            df.to_csv(self.filename, sep="," if self.ext == ".csv" else "\t",
+                      index=False, mode="a", header=self.header)
+            self.header = False
+
+    def close(self):
+        "closes the file"
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def _status_writer(filename):
+    "returns a writer for a filename"
+    if not isinstance(filename, str):
+        raise TypeError(  # pragma: no cover
+            "sink must be None, a callable or a filename not {}.".format(
+                type(filename)))
+    return _StatusFileWriter(filename)
+
+
+def _simulate(df, nbbike, speed, period, iteration, min_min, delta_speed,
+              index, start, rnd, progress=None, trace=None, on_status=None,
+              chunk_size=100):
+    """
+    Runs the simulation described in @see fn simulate_velib
+    and returns the arrays it produces, *progress* is None
+    or a @see cl SimulationProgress, *trace* is None or a logging function.
+    If *on_status* is not None, it receives the status by chunks
+    of *chunk_size* iterations *(stations, first iteration, array)*,
+    the array is reused for the next chunk, the returned status is None.
+    """
+    cities = df[["lat", "lng", "name", "number"]]
+    stations = cities.drop_duplicates()
+    keys = [tuple(row) for row in stations.values]
+    positions = {k: i for i, k in enumerate(keys)}
+    # station of every row of df, draws are made on rows
+    row_station = [positions[tuple(row)] for row in cities.values]
+    nst = len(keys)
+    lat = stations["lat"].to_numpy(dtype=numpy.float64)
+    lng = stations["lng"].to_numpy(dtype=numpy.float64)
+
+    if index is True:
+        index = StationIndex(df)
+    if index is not None:
+        bynumber = {}
+        for i, k in enumerate(keys):
+            bynumber.setdefault(k[3], i)
+
+    capacity = _capacity
+    docks = numpy.full((nst, capacity), -1, dtype=numpy.int64)
+    docks[:, :5] = numpy.arange(nst * 5).reshape((nst, 5))
+    nbikes = numpy.full(nst, 5, dtype=numpy.int64)
+    if on_status is None:
+        status = numpy.empty((iteration, nst), dtype=numpy.int64)
+    else:
+        # only one chunk is kept in memory
+        chunk_size = max(min(chunk_size, iteration), 1)
+        status = numpy.empty((chunk_size, nst), dtype=numpy.int64)
+    first = 0
+
+    # running trips
+    trip_start = numpy.empty(nbbike, dtype=numpy.int64)
+    trip_bike = numpy.empty(nbbike, dtype=numpy.int64)
+    trip_station = numpy.empty(nbbike, dtype=numpy.int64)
+    nrun = 0
+
+    # paths
+    ev_iter, ev_bike, ev_from, ev_to, ev_hours, ev_dist = [], [], [], [], [], []
+
+    period_us = period // datetime.timedelta(microseconds=1)
+    distances = {}
+    if progress is not None:
+        progress.start(iteration, nbbike)
+
+    for it in range(iteration):
+        if on_status is None:
+            status[it] = nbikes
+        else:
+            if it - first == chunk_size:
+                on_status(stations, first, status)
+                first = it
+            status[it - first] = nbikes
+
+        # a bike
+        if nrun < nbbike:
+            s = rnd.randint(0, nst - 1)
+            if nbikes[s] > 0:
+                slot = int(numpy.argmax(docks[s] != -1))
+                idv = int(docks[s, slot])
+                docks[s, slot] = -1
+                nbikes[s] -= 1
+                trip_start[nrun] = it
+                trip_bike[nrun] = idv
+                trip_station[nrun] = s
+                nrun += 1
+                ev_iter.append(it)
+                ev_bike.append(idv)
+                ev_from.append(s)
+                ev_to.append(-1)
+                ev_hours.append(0.)
+                ev_dist.append(0.)
+                if trace:
+                    trace("    begin", it, "bike", idv, "station", keys[s])
+
+        # do we put the bike back
+        if nrun > 0:
+            seconds = ((it - trip_start[:nrun]) * period_us) / 10 ** 6
+            hours = seconds / 3600
+            keep = numpy.ones(nrun, dtype=numpy.bool_)
+            for i in numpy.nonzero(hours * 60 > min_min)[0].tolist():
+                s0 = int(trip_station[i])
+                h = float(hours[i])
+                if s0 not in distances:
+                    distances[s0] = haversine(lat[s0], lng[s0], lat, lng)
+                dist = distances[s0]
+                sp = dist / h
+                accept = ((numpy.abs(sp - speed) < delta_speed) |
+                          ((sp < speed) & (h >= 1))).tolist()
+
+                if index is None:
+                    candidates = row_station
+                else:
+                    reach, _ = index.query_radius(
+                        lat[s0], lng[s0], (speed + delta_speed) * h)
+                    candidates = [bynumber[n] for n in reach if n in bynumber]
+                ncand = len(candidates)
+
+                for _ in range(ncand):
+                    s = candidates[rnd.randint(0, ncand - 1)]
+                    if accept[s] and nbikes[s] < capacity and \
+                            rnd.randint(0, 10) == 0:
+                        # we put it back
+                        slot = int(numpy.argmax(docks[s] == -1))
+                        docks[s, slot] = trip_bike[i]
+                        nbikes[s] += 1
+                        keep[i] = False
+                        ev_iter.append(it)
+                        ev_bike.append(int(trip_bike[i]))
+                        ev_from.append(s0)
+                        ev_to.append(s)
+                        ev_hours.append(h)
+                        ev_dist.append(float(dist[s]))
+                        if trace:
+                            trace("    end", it, "bike", int(trip_bike[i]),
+                                  "station", keys[s])
+                        break
+
+            if not keep.all():
+                sel = numpy.nonzero(keep)[0]
+                nrun = sel.shape[0]
+                trip_start[:nrun] = trip_start[sel]
+                trip_bike[:nrun] = trip_bike[sel]
+                trip_station[:nrun] = trip_station[sel]
+
+        if progress is not None:
+            progress.update(it, nrun, len(ev_iter), start + period * it)
+
+    if progress is not None:
+        progress.close()
+    if on_status is not None:
+        if iteration > first:
+            on_status(stations, first, status[:iteration - first])
+        status = None
+
+    return dict(stations=stations, status=status, capacity=capacity,
+                events=(ev_iter, ev_bike, ev_from, ev_to, ev_hours, ev_dist))
+
+
+def _status_to_df(stations, times, status, capacity):
+    "builds the dataframe with the status of every station at every iteration"
+    n = status.shape[0]
+    data = {c: numpy.tile(stations[c].to_numpy(), n)
+            for c in ["lat", "lng", "name", "number"]}
+    bikes = status.ravel()
+    data["available_bike_stands"] = capacity - bikes
+    data["available_bikes"] = bikes
+    nst = stations.shape[0]
+    data["collect_date"] = numpy.repeat(
+        numpy.array(times, dtype="datetime64[us]"), nst)
+    data["file"] = numpy.repeat(numpy.array([str(t) for t in times], dtype=object),
+                                nst)
+    return pandas.DataFrame(data)
+
+
+def _paths_to_df(stations, times, ev_iter, ev_bike, ev_from, ev_to,
+                 ev_hours, ev_dist):
+    "builds the dataframe with the paths"
+    if not ev_iter:
+        return pandas.DataFrame([])
+    ev_from = numpy.array(ev_from, dtype=numpy.int64)
+    ev_to = numpy.array(ev_to, dtype=numpy.int64)
+    end = ev_to >= 0
+    data = {}
+    for c in ["lat", "lng", "name", "number"]:
+        data[c + "0"] = stations[c].to_numpy()[ev_from]
+    data["time"] = numpy.array(times, dtype="datetime64[us]")[ev_iter]
+    data["idvelo"] = numpy.array(ev_bike, dtype=numpy.int64)
+    data["beginend"] = numpy.where(end, "end", "begin").astype(object)
+    data["hours"] = numpy.array(ev_hours, dtype=numpy.float64)
+    data["dist"] = numpy.array(ev_dist, dtype=numpy.float64)
+    if end.any():
+        to = numpy.where(end, ev_to, 0)
+        for c in ["lat", "lng", "name", "number"]:
+            values = stations[c].to_numpy()[to]
+            if c == "name":
+                values = values.astype(object)
+                values[~end] = numpy.nan
+            else:
+                values = values.astype(numpy.float64)
+                values[~end] = numpy.nan
+            data[c + "1"] = values
+    return pandas.DataFrame(data)
+
+
+_worker_stations = None
+
+
+def _init_worker(cities):
+    "stores the stations in every worker of the pool"
+    global _worker_stations  # pylint: disable=W0603
+    _worker_stations = cities
+
+
+def _replication_stats(cities, params, seed, period, iteration, min_min):
+    """
+    Runs one replication and returns its statistics,
+    *cities* is None when it was sent to the worker by @see fn _init_worker.
+    """
+    if cities is None:
+        cities = _worker_stations
+    params = dict(params)
+    nbbike = params.pop('nbbike')
+    speed = params.pop('speed')
+    counts = [0, 0]
+
+    def on_status(stations, first, status):
+        "counts empty and full stations"
+        counts[0] += int((status == 0).sum())
+        counts[1] += int((status == _capacity).sum())
+
+    delta_speed = params.pop('delta_speed', 2.5)
+    index = params.pop('index', None)
+    if params:
+        raise ValueError(  # pragma: no cover
+            "Unexpected parameters {}.".format(list(params)))
+    res = _simulate(cities, nbbike, speed, period=period, iteration=iteration,
+                    min_min=min_min, delta_speed=delta_speed, index=index,
+                    start=datetime.datetime(2000, 1, 1), rnd=random.Random(seed),
+                    on_status=on_status)
+    ev_to = numpy.array(res['events'][3], dtype=numpy.int64)
+    end = ev_to >= 0
+    hours = numpy.array(res['events'][4], dtype=numpy.float64)[end]
+    dist = numpy.array(res['events'][5], dtype=numpy.float64)[end]
+    minutes = period.total_seconds() / 60
+    return dict(departures=int((~end).sum()), trips=int(end.sum()),
+                empty_minutes=float(counts[0] * minutes),
+                full_minutes=float(counts[1] * minutes),
+                avg_hours=float(hours.mean()) if hours.shape[0] else numpy.nan,
+                avg_dist=float(dist.mean()) if dist.shape[0] else numpy.nan)
+
+
+def simulate_batch(df, scenarios, replications=10, seed=0,
+                   period=datetime.timedelta(minutes=1), iteration=500,
+                   min_min=10, n_jobs=1, backend='process', aggregate=True,
+                   fLOG=None):
+    """
+    Runs many simulations (see @see fn simulate_velib) and returns
+    statistics about them, the status of the stations is not kept.
+
+    @param      df              dataframe with station information
+    @param      scenarios       list of dictionaries with keys *nbbike*, *speed*
+                                and optionally *delta_speed*, *index*
+    @param      replications    number of replications of every scenario
+    @param      seed            the seeds of the replications are drawn
+                                from this one, replication *i* uses the same seed
+                                for every scenario (common random numbers)
+    @param      period          see @see fn simulate_velib
+    @param      iteration       see @see fn simulate_velib
+    @param      min_min         see @see fn simulate_velib
+    @param      n_jobs          number of workers, None or -1 for the number of cores
+    @param      backend         ``'serial'``, ``'thread'`` or ``'process'``
+    @param      aggregate       returns one row per scenario (mean and standard
+                                deviation of every statistic) or one row
+                                per replication
+    @param      fLOG            logging function
+    @return                     DataFrame
+
+    Statistics are the number of bicycles which left a station
+    (*departures*), the number of finished trips (*trips*),
+    the number of minutes stations were empty (*empty_minutes*)
+    or full (*full_minutes*) summed over all stations,
+    the average duration (*avg_hours*) and length (*avg_dist*) of a trip.
+
+    ::
+
+        scenarios = [dict(nbbike=n, speed=s) for n in (50, 100, 200)
+                     for s in (10, 15)]
+        stats = simulate_batch(df, scenarios, replications=20, n_jobs=-1)
+    """
+    if backend not in ('serial', 'thread', 'process'):
+        raise ValueError(
+            "Unknown backend '{}'.".format(backend))
+    cities = df[["lat", "lng", "name", "number"]]
+    seeds = [int(s.generate_state(1, numpy.uint64)[0])
+             for s in numpy.random.SeedSequence(seed).spawn(replications)]
+    tasks = [(i, r, sc, seeds[r]) for i, sc in enumerate(scenarios)
+             for r in range(replications)]
+
+    rows = []
+
+    def add(task, stats):
+        i, r, sc, _ = task
+        row = dict(scenario=i, replication=r)
+        row.update({k: v for k, v in sc.items() if k != 'index'})
+        row.update(stats)
+        rows.append(row)
+        if fLOG:
+            fLOG("[simulate_batch] {}/{} scenario={} replication={}".format(
+                len(rows), len(tasks), i, r))
+
+    if backend == 'serial' or n_jobs == 1 or len(tasks) <= 1:
+        for task in tasks:
+            add(task, _replication_stats(cities, task[2], task[3], period,
+                                         iteration, min_min))
+    else:
+        if n_jobs is None or n_jobs <= 0:
+            n_jobs = os.cpu_count() or 1
+        n_jobs = min(n_jobs, len(tasks))
+        if backend == 'thread':
+            executor = ThreadPoolExecutor(max_workers=n_jobs)
+            data = cities
+        else:
+            # stations are sent once to every worker
+            executor = ProcessPoolExecutor(
+                max_workers=n_jobs, initializer=_init_worker,
+                initargs=(cities,))
+            data = None
+        with executor:
+            futures = [executor.submit(_replication_stats, data, task[2], task[3],
+                                       period, iteration, min_min)
+                       for task in tasks]
+            for task, fut in zip(tasks, futures):
+                add(task, fut.result())
+
+    res = pandas.DataFrame(rows)
+    if not aggregate:
+        return res
+    stats = ['departures', 'trips', 'empty_minutes', 'full_minutes',
+             'avg_hours', 'avg_dist']
+    params = [c for c in res.columns
+              if c not in stats and c not in ('scenario', 'replication')]
+    gr = res.groupby('scenario')
+    agg = gr[stats].agg(['mean', 'std'])
+    agg.columns = ["{}_{}".format(a, b) for a, b in agg.columns]
+    agg = pandas.concat([gr[params].first(), agg], axis=1)
+    agg.insert(0, 'replications', gr.size())
+    return agg.reset_index()
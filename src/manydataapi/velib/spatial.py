@@ -0,0 +1,212 @@
+# -*- coding:utf-8 -*-
+"""
+@file
+@brief Spatial index on stations.
+"""
+import itertools
+import math
+import numpy
+from .geo import EARTH_RADIUS
+
+
+def _to_xyz(lat, lng):
+    "converts degrees into cartesian coordinates (km)"
+    lat = numpy.radians(numpy.asarray(lat, dtype=numpy.float64))
+    lng = numpy.radians(numpy.asarray(lng, dtype=numpy.float64))
+    cos = numpy.cos(lat)
+    return numpy.stack([cos * numpy.cos(lng), cos * numpy.sin(lng),
+                        numpy.sin(lat)], axis=-1) * EARTH_RADIUS
+
+
+def _chord_to_arc(chord):
+    "converts a chord length into a distance on the sphere"
+    return 2 * EARTH_RADIUS * numpy.arcsin(
+        numpy.minimum(chord / (2 * EARTH_RADIUS), 1.))
+
+
+def _arc_to_chord(arc):
+    "converts a distance on the sphere into a chord length"
+    return 2 * EARTH_RADIUS * math.sin(min(arc / (2 * EARTH_RADIUS), math.pi / 2))
+
+
+class StationIndex:
+    """
+    Grid index on the stations to look for the nearest stations
+    or the stations within a radius without computing the
+    distance to every station.
+    Stations are placed in cubic cells of size *cell* (km)
+    on their cartesian coordinates, the euclidean distance
+    between two points (a chord) increases with the distance
+    on the sphere, a query only looks into the cells around the point.
+    Distances are returned in km and are equal to
+    @see fn haversine up to rounding errors.
+
+    ::
+
+        index = StationIndex(df)
+        # stations within 500 meters
+        numbers, dist = index.query_radius(48.85, 2.35, 0.5)
+        # 3 nearest stations with a free stand
+        last = df[df["collect_date"] == df["collect_date"].max()]
+        free = last.loc[last["available_bike_stands"] > 0, "number"]
+        numbers, dist = index.query_knn(48.85, 2.35, k=3, mask=free)
+    """
+
+    def __init__(self, df, cell=0.5):
+        """
+        @param      df          dataframe with columns *number*, *lat*, *lng*
+                                (see @see me DataCollectJCDecaux.to_df),
+                                a station may appear many times
+        @param      cell        size of a cell in km
+        """
+        stations = df[["number", "lat", "lng"]].drop_duplicates(
+            "number").sort_values("number")
+        self.numbers = stations["number"].values
+        self.lat = stations["lat"].values.astype(numpy.float64)
+        self.lng = stations["lng"].values.astype(numpy.float64)
+        self.cell = cell
+        self.xyz = _to_xyz(self.lat, self.lng)
+
+        cells = numpy.floor(self.xyz / cell).astype(numpy.int64)
+        keys, inv = numpy.unique(cells, axis=0, return_inverse=True)
+        inv = inv.ravel()
+        order = numpy.argsort(inv, kind="stable")
+        bounds = numpy.searchsorted(inv[order], numpy.arange(keys.shape[0] + 1))
+        self._cells = {tuple(k): order[bounds[i]:bounds[i + 1]]
+                       for i, k in enumerate(keys.tolist())}
+        self._offsets = {}
+
+    def __len__(self):
+        "Returns the number of stations."
+        return self.numbers.shape[0]
+
+    def position(self, numbers):
+        """
+        Returns the positions of stations in attribute *numbers*.
+
+        @param      numbers     station numbers
+        @return                 array of positions
+        """
+        pos = numpy.searchsorted(self.numbers, numbers)
+        pos = numpy.minimum(pos, len(self) - 1)
+        if not numpy.all(self.numbers[pos] == numbers):
+            raise KeyError(  # pragma: no cover
+                "Unknown station numbers.")
+        return pos
+
+    def _mask(self, mask):
+        "converts a list of numbers into a boolean mask"
+        if mask is None:
+            return None
+        mask = numpy.asarray(mask)
+        if mask.dtype == numpy.bool_:
+            if mask.shape != self.numbers.shape:
+                raise ValueError(  # pragma: no cover
+                    "mask must have {} elements not {}.".format(
+                        self.numbers.shape[0], mask.shape[0]))
+            return mask
+        return numpy.isin(self.numbers, mask)
+
+    def _candidates(self, cell, m):
+        "returns the stations within cells at distance m of cell"
+        if (2 * m + 1) ** 3 >= len(self._cells):
+            return None
+        if m not in self._offsets:
+            self._offsets[m] = list(itertools.product(range(-m, m + 1), repeat=3))
+        found = []
+        for dx, dy, dz in self._offsets[m]:
+            idx = self._cells.get((cell[0] + dx, cell[1] + dy, cell[2] + dz))
+            if idx is not None:
+                found.append(idx)
+        if not found:
+            return numpy.empty(0, dtype=numpy.int64)
+        return numpy.concatenate(found)
+
+    def _queries(self, lat, lng):
+        "converts the queries into cartesian coordinates and cells"
+        scalar = numpy.ndim(lat) == 0 and numpy.ndim(lng) == 0
+        lat, lng = numpy.broadcast_arrays(
+            numpy.atleast_1d(lat), numpy.atleast_1d(lng))
+        xyz = _to_xyz(lat, lng)
+        cells = numpy.floor(xyz / self.cell).astype(numpy.int64).tolist()
+        return scalar, xyz, cells
+
+    def query_radius(self, lat, lng, radius, mask=None, positions=False):
+        """
+        Returns the stations within a radius.
+
+        @param      lat         latitude (or array of latitudes)
+        @param      lng         longitude (or array of longitudes)
+        @param      radius      radius in km
+        @param      mask        restricts the search to some stations,
+                                a boolean array aligned with attribute *numbers*
+                                or a list of station numbers
+        @param      positions   returns positions in attribute *numbers*
+                                instead of station numbers
+        @return                 *(numbers, distances)* sorted by distance,
+                                a list of them if *lat*, *lng* are arrays
+        """
+        scalar, xyz, cells = self._queries(lat, lng)
+        mask = self._mask(mask)
+        chord = _arc_to_chord(radius)
+        m = int(math.ceil(chord / self.cell))
+        res = []
+        for q, cell in zip(xyz, cells):
+            cand = self._candidates(cell, m)
+            if cand is None:
+                cand = numpy.arange(len(self))
+            if mask is not None:
+                cand = cand[mask[cand]]
+            dist = _chord_to_arc(numpy.sqrt(((self.xyz[cand] - q) ** 2).sum(axis=1)))
+            keep = dist <= radius
+            cand, dist = cand[keep], dist[keep]
+            order = numpy.argsort(dist, kind="stable")
+            cand, dist = cand[order], dist[order]
+            res.append((cand if positions else self.numbers[cand], dist))
+        return res[0] if scalar else res
+
+    def query_knn(self, lat, lng, k=1, mask=None, positions=False):
+        """
+        Returns the *k* nearest stations.
+
+        @param      lat         latitude (or array of latitudes)
+        @param      lng         longitude (or array of longitudes)
+        @param      k           number of neighbors, at least 1
+        @param      mask        restricts the search to some stations,
+                                see @see me query_radius
+        @param      positions   returns positions in attribute *numbers*
+                                instead of station numbers
+        @return                 *(numbers, distances)*, two arrays of shape *(k,)*
+                                or *(len(lat), k)*, missing neighbors
+                                (less than *k* stations) are -1 with an infinite
+                                distance
+        """
+        if k < 1:
+            raise ValueError("k must be >= 1 not {}.".format(k))
+        scalar, xyz, cells = self._queries(lat, lng)
+        mask = self._mask(mask)
+        n = len(xyz)
+        found = numpy.full((n, k), -1, dtype=numpy.int64)
+        dists = numpy.full((n, k), numpy.inf, dtype=numpy.float64)
+        for i, (q, cell) in enumerate(zip(xyz, cells)):
+            m = 1
+            while True:
+                cand = self._candidates(cell, m)
+                last = cand is None
+                if last:
+                    cand = numpy.arange(len(self))
+                if mask is not None:
+                    cand = cand[mask[cand]]
+                if cand.shape[0] >= k or last:
+                    chord = numpy.sqrt(((self.xyz[cand] - q) ** 2).sum(axis=1))
+                    order = numpy.argsort(chord, kind="stable")[:k]
+                    # a station outside the cells is farther than m * cell
+                    if last or chord[order[-1]] <= m * self.cell:
+                        break
+                m += 1
+            nb = order.shape[0]
+            found[i, :nb] = cand[order] if positions else self.numbers[cand[order]]
+            dists[i, :nb] = _chord_to_arc(chord[order])
+        if scalar:
+            return found[0], dists[0]
+        return found, dists
@@ -0,0 +1,686 @@
+# -*- coding:utf-8 -*-
+"""
+@file
+@brief Compact binary storage for snapshots collected by
+@see cl DataCollectJCDecaux.
+
+The file starts with a magic string followed by blocks.
+Every block is made of a kind (one byte), a length (uint32)
+and a payload:
+
+* ``S``: :epkg:`json` payload which extends the table of
+  stations (contract name, name, address) and the table of status,
+* ``D``: a snapshot (or keyframe), a label (uint16 length + utf-8 string)
+  followed by fixed size records (see ``_record_dtype``),
+* ``E``: a delta, a label, the collect date (int64), the number of
+  removed stations (uint32), the removed stations (see ``_key_dtype``)
+  followed by the records of the stations which changed since
+  the previous snapshot.
+
+Datetimes are naive, they are stored as microseconds
+since 1970-01-01 with no timezone conversion.
+"""
+import ast
+import datetime
+import json
+import os
+import re
+import struct
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+import pandas
+
+
+_magic = b"JCDBIN\x01\n"
+
+_record_dtype = numpy.dtype([
+    ('number', '<i4'), ('station', '<i4'),
+    ('available_bikes', '<i2'), ('available_bike_stands', '<i2'),
+    ('bike_stands', '<i2'), ('banking', 'i1'), ('bonus', 'i1'),
+    ('status', 'i1'), ('last_update', '<i8'), ('collect_date', '<i8'),
+    ('lat', '<f8'), ('lng', '<f8')])
+
+_key_dtype = numpy.dtype([('number', '<i4'), ('station', '<i4')])
+
+_block_header = struct.Struct("<cI")
+
+#: column order of the dataframe returned by @see fn read_jcdecaux_binary,
+#: it is the order of the fields returned by the API
+_columns = ['contract_name', 'number', 'bike_stands', 'banking', 'lat',
+            'last_update', 'available_bikes', 'available_bike_stands',
+            'name', 'address', 'collect_date', 'status', 'bonus', 'lng',
+            'file']
+
+_nat = numpy.iinfo(numpy.int64).min
+
+
+def _to_us(dt):
+    "converts a naive datetime into microseconds"
+    if dt is None:
+        return _nat
+    return int(numpy.datetime64(dt, 'us').astype(numpy.int64))
+
+
+def _iter_blocks(content, filename=None):
+    """
+    Iterates on all blocks of a binary file.
+
+    @param      content     bytes
+    @param      filename    used in error messages
+    @return                 iterator on *(kind, payload)*
+    """
+    if not content.startswith(_magic):
+        raise ValueError(
+            "File '{}' is not a binary velib file.".format(filename))
+    pos = len(_magic)
+    size = len(content)
+    while pos < size:
+        if pos + _block_header.size > size:
+            raise ValueError(  # pragma: no cover
+                "Truncated block at position {} in '{}'.".format(pos, filename))
+        kind, length = _block_header.unpack_from(content, pos)
+        pos += _block_header.size
+        if pos + length > size:
+            raise ValueError(  # pragma: no cover
+                "Truncated block at position {} in '{}'.".format(pos, filename))
+        yield kind, memoryview(content)[pos: pos + length]
+        pos += length
+
+
+class JCDecauxBinaryWriter:
+    """
+    Appends snapshots returned by @see me DataCollectJCDecaux.get_json
+    to a binary file. Static fields (name, address, contract name)
+    are written once, every snapshot is stored as typed records:
+    station number as int32, bike counts as int16, dates as int64.
+    With *keyframe_every*, only the stations which changed are stored
+    between two full snapshots, other dynamic fields (*last_update*,
+    *bike_stands*) of an unchanged station are the ones of the last
+    stored record, *collect_date* is the one of the snapshot.
+
+    ::
+
+        from manydataapi.velib import DataCollectJCDecaux, JCDecauxBinaryWriter
+        velib = DataCollectJCDecaux(private_key)
+        writer = JCDecauxBinaryWriter("velib_data.bin")
+        writer.append(velib.get_json("besancon"))
+    """
+
+    def __init__(self, filename, keyframe_every=None):
+        """
+        @param      filename        file to create or to append to
+        @param      keyframe_every  if not None, a full snapshot is written
+                                    every *keyframe_every* snapshots, in between,
+                                    only the stations whose *available_bikes*,
+                                    *available_bike_stands* or *status* changed
+                                    are written (delta)
+        """
+        self.filename = filename
+        self.keyframe_every = keyframe_every
+        self.stations = {}
+        self.status = {}
+        # state of the last snapshot, None forces a keyframe
+        self._last = None
+        self._since_keyframe = 0
+        if os.path.exists(filename):
+            with open(filename, "rb") as f:
+                content = f.read()
+            for kind, payload in _iter_blocks(content, filename):
+                if kind == b'S':
+                    self._update_tables(json.loads(bytes(payload)))
+        else:
+            with open(filename, "wb") as f:
+                f.write(_magic)
+
+    def _update_tables(self, tables):
+        "updates the tables of strings"
+        for st in tables.get("stations", []):
+            self.stations[tuple(st)] = len(self.stations)
+        for st in tables.get("status", []):
+            self.status[st] = len(self.status)
+
+    def append(self, js, label=None):
+        """
+        Appends a snapshot.
+
+        @param      js      list of stations, output of
+                            @see me DataCollectJCDecaux.get_json
+        @param      label   label of the snapshot (the column *file* in
+                            @see fn read_jcdecaux_binary), the collect
+                            date if None
+        @return             number of written bytes
+        """
+        new_stations = []
+        new_status = []
+        rec = numpy.zeros(len(js), dtype=_record_dtype)
+        for i, o in enumerate(js):
+            key = (o["contract_name"], o["name"], o["address"])
+            if key not in self.stations:
+                self.stations[key] = len(self.stations)
+                new_stations.append(key)
+            if o["status"] not in self.status:
+                self.status[o["status"]] = len(self.status)
+                new_status.append(o["status"])
+            lat = o["lat"]
+            lng = o["lng"]
+            rec[i] = (o["number"], self.stations[key],
+                      o["available_bikes"], o["available_bike_stands"],
+                      o["bike_stands"], o["banking"], o["bonus"],
+                      self.status[o["status"]],
+                      _to_us(o["last_update"]), _to_us(o["collect_date"]),
+                      numpy.nan if lat is None else lat,
+                      numpy.nan if lng is None else lng)
+
+        if label is None:
+            label = str(js[0]["collect_date"]) if js else ""
+        blabel = label.encode("utf-8")
+
+        data = []
+        if new_stations or new_status:
+            tables = json.dumps(dict(stations=new_stations, status=new_status),
+                                ensure_ascii=False).encode("utf-8")
+            data.append(_block_header.pack(b'S', len(tables)))
+            data.append(tables)
+        keyframe = (self.keyframe_every is None or self._last is None or
+                    self._since_keyframe + 1 >= self.keyframe_every)
+        state = dict(zip(
+            zip(rec['number'].tolist(), rec['station'].tolist()),
+            zip(rec['available_bikes'].tolist(),
+                rec['available_bike_stands'].tolist(),
+                rec['status'].tolist()))) if self.keyframe_every else None
+        if keyframe:
+            payload = rec.tobytes()
+            data.append(_block_header.pack(
+                b'D', 2 + len(blabel) + len(payload)))
+            data.append(struct.pack("<H", len(blabel)))
+            data.append(blabel)
+            data.append(payload)
+            self._since_keyframe = 0
+        else:
+            keys = list(state)
+            changed = numpy.array(
+                [self._last.get(k) != state[k] for k in keys], dtype=bool)
+            removed = numpy.array([k for k in self._last if k not in state],
+                                  dtype=_key_dtype)
+            payload = rec[changed].tobytes()
+            collect = rec['collect_date'][0] if rec.shape[0] else _nat
+            data.append(_block_header.pack(
+                b'E', 2 + len(blabel) + 12 + removed.nbytes + len(payload)))
+            data.append(struct.pack("<H", len(blabel)))
+            data.append(blabel)
+            data.append(struct.pack("<qI", collect, removed.shape[0]))
+            data.append(removed.tobytes())
+            data.append(payload)
+            self._since_keyframe += 1
+        self._last = state
+        data = b"".join(data)
+        with open(self.filename, "ab") as f:
+            f.write(data)
+        return len(data)
+
+
+def _records_to_df(rec, stations, status, labels, extra=None):
+    "builds the dataframe returned by @see fn read_jcdecaux_binary"
+    table = numpy.array(stations, dtype=object).reshape((-1, 3))
+    status = numpy.array(status, dtype=object)
+    labels = numpy.repeat(numpy.array([lb[0] for lb in labels], dtype=object),
+                          [lb[1] for lb in labels])
+    cols = dict(
+        contract_name=table[rec['station'], 0],
+        number=rec['number'],
+        bike_stands=rec['bike_stands'],
+        banking=rec['banking'],
+        lat=rec['lat'],
+        last_update=rec['last_update'].view('M8[us]'),
+        available_bikes=rec['available_bikes'],
+        available_bike_stands=rec['available_bike_stands'],
+        name=table[rec['station'], 1],
+        address=table[rec['station'], 2],
+        collect_date=rec['collect_date'].view('M8[us]'),
+        status=status[rec['status']],
+        bonus=rec['bonus'],
+        lng=rec['lng'],
+        file=labels)
+    df = pandas.DataFrame({k: cols[k] for k in _columns})
+    if extra:
+        for k, v in extra.items():
+            df[k] = v
+    return df
+
+
+def _parse_delta(payload):
+    "parses a block ``E``"
+    n = struct.unpack_from("<H", payload, 0)[0]
+    label = bytes(payload[2: 2 + n]).decode("utf-8")
+    pos = 2 + n
+    collect, n_removed = struct.unpack_from("<qI", payload, pos)
+    pos += 12
+    removed = numpy.frombuffer(
+        payload[pos: pos + n_removed * _key_dtype.itemsize], dtype=_key_dtype)
+    pos += n_removed * _key_dtype.itemsize
+    rec = numpy.frombuffer(payload[pos:], dtype=_record_dtype)
+    return label, collect, removed, rec
+
+
+def read_jcdecaux_binary(filename, mode='snapshots', at=None):
+    """
+    Reads a file produced by @see cl JCDecauxBinaryWriter.
+
+    @param      filename    filename
+    @param      mode        ``'snapshots'`` returns every snapshot, deltas are
+                            expanded into full snapshots, ``'events'`` returns
+                            the records as they are stored (keyframes and
+                            changed stations) with an additional column
+                            *keyframe*
+    @param      at          only returns the last snapshot collected
+                            before or at this datetime, only with
+                            mode ``'snapshots'``
+    @return                 dataframe, same columns as
+                            @see me DataCollectJCDecaux.to_df
+    """
+    if mode not in ('snapshots', 'events'):
+        raise ValueError("Unknown mode '{}'.".format(mode))
+    if at is not None and mode != 'snapshots':
+        raise ValueError("Parameter at requires mode='snapshots' not '{}'.".format(mode))
+    if at is not None:
+        at = _to_us(at)
+    with open(filename, "rb") as f:
+        content = f.read()
+
+    stations = []
+    status = []
+    recs = []
+    labels = []
+    keyframes = []
+    # current state, used to expand deltas
+    state = None
+    index = None
+    for kind, payload in _iter_blocks(content, filename):
+        if kind == b'S':
+            tables = json.loads(bytes(payload))
+            stations.extend(tables.get("stations", []))
+            status.extend(tables.get("status", []))
+            continue
+        if kind == b'D':
+            n = struct.unpack_from("<H", payload, 0)[0]
+            label = bytes(payload[2: 2 + n]).decode("utf-8")
+            rec = numpy.frombuffer(payload[2 + n:], dtype=_record_dtype)
+            collect = rec['collect_date'][0] if rec.shape[0] else _nat
+            if mode == 'snapshots':
+                state = rec.copy()
+                index = None
+            keyframes.append(numpy.ones(rec.shape[0], dtype=bool))
+        elif kind == b'E':
+            label, collect, removed, rec = _parse_delta(payload)
+            if mode == 'snapshots':
+                if state is None:
+                    raise ValueError(  # pragma: no cover
+                        "A delta precedes the first keyframe in '{}'.".format(
+                            filename))
+                if index is None:
+                    index = {k: i for i, k in enumerate(
+                        zip(state['number'].tolist(), state['station'].tolist()))}
+                keep = numpy.ones(state.shape[0], dtype=bool)
+                for k in removed.tolist():
+                    keep[index[k]] = False
+                new_rows = []
+                for i, k in enumerate(zip(rec['number'].tolist(),
+                                          rec['station'].tolist())):
+                    if k in index and keep[index[k]]:
+                        state[index[k]] = rec[i]
+                    else:
+                        new_rows.append(i)
+                if new_rows or not keep.all():
+                    state = numpy.concatenate([state[keep], rec[new_rows]])
+                    index = None
+                state['collect_date'] = collect
+                rec = state.copy() if at is None else state
+            keyframes.append(numpy.zeros(rec.shape[0], dtype=bool))
+        else:
+            raise ValueError(  # pragma: no cover
+                "Unexpected block kind {} in '{}'.".format(kind, filename))
+
+        if at is not None:
+            if collect > at:
+                break
+            recs = [rec.copy()]
+            labels = [(label, rec.shape[0])]
+        else:
+            recs.append(rec)
+            labels.append((label, rec.shape[0]))
+
+    rec = (numpy.concatenate(recs) if recs
+           else numpy.zeros(0, dtype=_record_dtype))
+    extra = None
+    if mode == 'events':
+        extra = dict(keyframe=(numpy.concatenate(keyframes) if keyframes
+                               else numpy.zeros(0, dtype=bool)))
+    return _records_to_df(rec, stations, status, labels, extra)
+
+
+_value = r"""(?:'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|datetime\.datetime\([\d,\s]*\)|-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|None|True|False)"""
+
+_key_value = re.compile(
+    r"""'([^'\\]*)'\s*:\s*(""" + _value + r""")(?=\s*[,}])""")
+
+_token = re.compile(
+    r"""(?P<sep>[\s,\[\]]+)|(?P<open>\{)|(?P<close>\})|""" +
+    r"""'(?P<key>[^'\\]*)'\s*:\s*(?P<val>""" + _value + ")")
+
+
+def _tokenize_uniform(content, columns):
+    """
+    Fast path of @see fn _tokenize_file: every row has the same keys
+    in the same order (it is the case for files produced by
+    @see me DataCollectJCDecaux.collecting_data). All pairs
+    *(key, value)* are extracted with one regular expression
+    and every column is a slice of the list of values.
+
+    @return     *({name: raw values}, number of rows)* or None
+    """
+    pairs = _key_value.findall(content)
+    if len(pairs) == 0:
+        return None
+    keys, values = zip(*pairs)
+    try:
+        period = keys.index(keys[0], 1)
+    except ValueError:
+        period = len(keys)
+    if len(keys) % period != 0 or keys != keys[:period] * (len(keys) // period):
+        return None
+    nrows = len(keys) // period
+    if (len(set(keys[:period])) != period or
+            content.count("{") != nrows or content.count("}") != nrows or
+            content.count("': ") + content.count('": ') != len(keys)):
+        # nested structures, a value which was not recognized
+        # or a string which looks like a key
+        return None
+    cols = {}
+    for i, k in enumerate(keys[:period]):
+        if columns is None or k in columns:
+            cols[k] = list(values[i::period])
+    return cols, nrows
+
+
+def _tokenize_line(line, columns):
+    """
+    Tokenizes one line written by
+    @see me DataCollectJCDecaux.collecting_data.
+
+    @param      line        line
+    @param      columns     columns to keep (None for all)
+    @return                 list of rows *{name: raw value}* or None
+                            if the line cannot be tokenized
+    """
+    pos = 0
+    rows = []
+    row = None
+    for m in _token.finditer(line):
+        if m.start() != pos:
+            return None
+        pos = m.end()
+        g = m.lastgroup
+        if g == 'sep':
+            continue
+        if g == 'open':
+            if row is not None:
+                return None
+            row = {}
+        elif g == 'close':
+            if row is None:
+                return None
+            rows.append(row)
+            row = None
+        else:
+            if row is None:
+                return None
+            key = m.group('key')
+            if columns is None or key in columns:
+                row[key] = m.group('val')
+    if pos != len(line) or row is not None:
+        return None
+    return rows
+
+
+def _append_rows(rows, cols, nrows):
+    """
+    Appends tokenized rows to the columns *{name: raw values}*,
+    missing values are None. Returns the new number of rows.
+    """
+    for row in rows:
+        for k, v in row.items():
+            if k not in cols:
+                cols[k] = [None] * nrows
+            cols[k].append(v)
+        nrows += 1
+        if len(row) < len(cols):
+            for values in cols.values():
+                if len(values) < nrows:
+                    values.append(None)
+    return nrows
+
+
+#: constructor of a datetime as written by :epkg:`python:repr`
+_datetime_call = re.compile(r"datetime[.]datetime[(]([0-9, ]*)[)]")
+
+
+def _literal_line(line, columns, i, filename):
+    """
+    Parses a line the tokenizer cannot handle with
+    ``ast.literal_eval``, datetimes are replaced
+    by a string before the evaluation, :epkg:`python:eval`
+    is never called.
+
+    @param      line        line
+    @param      columns     columns to keep (None for all)
+    @param      i           line index (for error messages)
+    @param      filename    filename (for error messages)
+    @return                 list of rows *{name: raw value}*
+    """
+    marker = "\x00datetime\x00"
+    text = _datetime_call.sub(
+        lambda m: repr(marker + m.group(1)), line)
+    try:
+        dl = ast.literal_eval(text)
+    except (ValueError, SyntaxError, TypeError, MemoryError,
+            RecursionError) as e:
+        raise ValueError(
+            "Unable to parse line {0} in file '{1}'.".format(
+                i + 1, filename)) from e
+    if (not isinstance(dl, list) or
+            not all(isinstance(d, dict) for d in dl)):
+        raise ValueError(
+            "Expects a list of dictionaries for line {0} in file "
+            "'{1}'.".format(i + 1, filename))
+
+    def _raw(v):
+        if isinstance(v, str) and v.startswith(marker):
+            return "datetime.datetime({})".format(v[len(marker):])
+        return repr(v)
+
+    return [{k: _raw(v) for k, v in d.items()
+             if columns is None or k in columns} for d in dl]
+
+
+def _tokenize_file(filename, columns=None):
+    """
+    Tokenizes a text file produced by
+    @see me DataCollectJCDecaux.collecting_data with ``single_file=False``.
+    Values are kept as they appear in the file, they are converted
+    by @see fn _convert_column.
+
+    @param      filename    filename
+    @param      columns     columns to keep (None for all)
+    @return                 *({name: raw values}, number of rows)*
+    """
+    with open(filename, "r", encoding="utf8") as f:
+        content = f.read()
+    res = _tokenize_uniform(content, columns)
+    if res is not None:
+        return res
+
+    cols = {}
+    nrows = 0
+    for i, line in enumerate(content.split("\n")):
+        line = line.strip("\n\r\t ")
+        if not line:
+            continue
+        rows = _tokenize_line(line, columns)
+        if rows is None:
+            # unexpected syntax, falls back to a literal evaluation
+            rows = _literal_line(line, columns, i, filename)
+        nrows = _append_rows(rows, cols, nrows)
+    return cols, nrows
+
+
+def _datetime_dtype():
+    "dtype pandas uses for a list of datetime"
+    return pandas.Series([datetime.datetime(2000, 1, 1)]).dtype
+
+
+def _parse_datetimes(values):
+    """
+    Converts strings ``datetime.datetime(...)``
+    into an array of datetime64 in one pass.
+    """
+    args = []
+    for v in values:
+        if v is None:
+            args.append("1970,1,1,0,0,0,0")
+            continue
+        v = v[18:-1]
+        n = v.count(',')
+        args.append(v + ",0" * (6 - n) if n < 6 else v)
+    ints = numpy.array(",".join(args).split(","),
+                       dtype=numpy.int64).reshape((-1, 7))
+    months = (ints[:, 0] - 1970) * 12 + ints[:, 1] - 1
+    days = months.astype('M8[M]').astype('M8[D]') + (ints[:, 2] - 1)
+    us = (((ints[:, 3] * 60 + ints[:, 4]) * 60 + ints[:, 5]) * 1000000 +
+          ints[:, 6])
+    res = days.astype('M8[us]') + us.astype('m8[us]')
+    res[[v is None for v in values]] = numpy.datetime64('NaT')
+    return res
+
+
+def _raw_value(v):
+    "converts a raw value into a python object"
+    if v is None:
+        return numpy.nan
+    if v.startswith("datetime.datetime("):
+        return datetime.datetime(*map(int, v[18:-1].split(',')))
+    return ast.literal_eval(v)
+
+
+def _convert_column(values):
+    """
+    Converts a column of raw values into an array,
+    the dtype is the one pandas would infer from python objects.
+    """
+    firsts = {v[0] if v else None for v in values}
+    missing = None in firsts
+    firsts.discard(None)
+    if firsts and firsts <= set("-0123456789"):
+        if not missing:
+            values = numpy.array(values)
+            try:
+                return values.astype(numpy.int64)
+            except ValueError:
+                # not an integer
+                return values.astype(numpy.float64)
+        return numpy.array(['nan' if v is None else v for v in values]
+                           ).astype(numpy.float64)
+    if firsts == {'d'} and all(v is None or v[-1] == ')' for v in values):
+        return pandas.Series(_parse_datetimes(values)).astype(
+            _datetime_dtype())
+    if firsts and firsts <= {"'", '"'}:
+        return pandas.Series([
+            numpy.nan if v is None else (
+                v[1:-1] if '\\' not in v else ast.literal_eval(v))
+            for v in values])
+    return pandas.Series([_raw_value(v) for v in values])
+
+
+def read_jcdecaux_txt(folder, regex="velib_data.*[.]txt", columns=None,
+                      n_jobs=1):
+    """
+    Reads all text files in a folder produced by
+    @see me DataCollectJCDecaux.collecting_data (``single_file=False``)
+    without calling :epkg:`python:eval`. Every line is tokenized
+    with a regular expression, values are appended to one list
+    per column and converted into arrays once all files are read.
+    A line the regular expression cannot handle is parsed with
+    ``ast.literal_eval``, *ValueError* is raised
+    with the file name and the line number if it fails.
+
+    @param      folder      folder where to find the files
+    @param      regex       regular expression which filter the files
+    @param      columns     columns to keep (None for all), the others
+                            are never converted
+    @param      n_jobs      number of processes used to tokenize the files,
+                            None or -1 for the number of cores
+    @return                 dataframe, same as @see me DataCollectJCDecaux.to_df
+    """
+    if regex is None:
+        regex = ".*"
+    reg = re.compile(regex)
+    files = [_ for _ in os.listdir(folder) if reg.search(_)]
+    if len(files) == 0:
+        raise FileNotFoundError(
+            "No found files in directory: '{}'\nregex: '{}'.".format(
+                folder, regex))
+    keep = None if columns is None else set(columns)
+    names = [os.path.join(folder, f) for f in files]
+
+    if n_jobs is None or n_jobs <= 0:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs > 1 and len(names) > 1:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(names))) as ex:
+            parts = list(ex.map(_tokenize_file, names,
+                                [keep for n in names]))
+    else:
+        parts = [_tokenize_file(name, keep) for name in names]
+
+    # merges the columns of all files
+    cols = {}
+    nrows = 0
+    file_col = []
+    for file_, (part, n) in zip(files, parts):
+        for k, values in part.items():
+            if k not in cols:
+                cols[k] = [None] * nrows
+            cols[k].extend(values)
+        nrows += n
+        for values in cols.values():
+            if len(values) < nrows:
+                values.extend([None] * (nrows - len(values)))
+        file_col.extend([file_] * n)
+
+    res = {k: _convert_column(values) for k, values in cols.items()}
+    if columns is None or 'file' in columns:
+        res['file'] = pandas.Series(file_col)
+    df = pandas.DataFrame(res)
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    return df
+
+
+def convert_jcdecaux_txt(folder, outfile, regex="velib_data.*[.]txt"):
+    """
+    Converts text files produced by
+    @see me DataCollectJCDecaux.collecting_data (``single_file=False``)
+    into one binary file, see @see cl JCDecauxBinaryWriter.
+    Every file becomes a snapshot labelled with the file name.
+
+    @param      folder      folder where to find the files
+    @param      outfile     binary file to create or to append to
+    @param      regex       regular expression which filter the files
+    @return                 number of converted files
+    """
+    df = read_jcdecaux_txt(folder, regex=regex)
+    writer = JCDecauxBinaryWriter(outfile)
+    df = df.sort_values("file", kind="stable")
+    nb = 0
+    for name, sub in df.groupby("file", sort=False):
+        writer.append(sub.drop("file", axis=1).to_dict("records"), label=name)
+        nb += 1
+    return nb